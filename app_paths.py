@@ -12,8 +12,14 @@ def get_app_data_dir():
     Возвращает путь к папке данных приложения в пользовательской директории
     Для Windows: %LOCALAPPDATA%\ChatList
     Для Linux/Mac: ~/.local/share/ChatList или ~/Library/Application Support/ChatList
+    
+    Переменная окружения CHATLIST_DATA_DIR задает другую папку (например,
+    временную базу для бенчмарков).
     """
-    if sys.platform == "win32":
+    override = os.getenv("CHATLIST_DATA_DIR")
+    if override:
+        app_dir = override
+    elif sys.platform == "win32":
         # Windows: используем LOCALAPPDATA (не синхронизируется с облаком)
         app_data = os.getenv("LOCALAPPDATA", os.path.expanduser("~"))
         app_dir = os.path.join(app_data, "ChatList")
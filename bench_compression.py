@@ -0,0 +1,181 @@
+"""
+Бенчмарк сжатия ответов в таблице results
+
+Для каждого метода хранения ("none" - без сжатия, "zlib", "lzma")
+сохраняет одинаковый набор ответов размером от нескольких КБ до сотен КБ
+во временную базу (CHATLIST_DATA_DIR) и измеряет:
+  - размер файла базы после VACUUM и суммарный размер колонки response
+  - время сохранения ответов
+  - время загрузки первой и последующих страниц списка (db.get_results_page)
+  - время чтения полного ответа (db.get_result_by_id), p50/p95
+  - время поиска по полнотекстовому индексу
+
+Ответы - markdown-подобный текст из случайных слов, кода и списков (сжимается
+хуже повторяющейся строки и ближе к реальным ответам моделей).
+
+Запуск:
+    python bench_compression.py
+    python bench_compression.py --rows 5000 --max-size 204800 --output compression.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from bench_fanout import percentile
+
+
+DEFAULT_MODES = "none,zlib,lzma"
+
+WORDS = (
+    "модель ответ запрос данные функция значение список таблица индекс поиск "
+    "результат промт сервер клиент поток память время размер строка файл "
+    "model response request value function table index search result server "
+    "client thread memory size string file python sqlite cache latency"
+).split()
+
+
+def make_response(rng: random.Random, size: int) -> str:
+    """Генерирует ответ примерно из size символов"""
+    parts = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.15:
+            name = rng.choice(WORDS)
+            block = (f"```python\ndef {name}_{rng.randint(1, 999)}(x):\n"
+                     f"    return x * {rng.randint(2, 99)} + {rng.choice(WORDS)!r}\n```")
+        elif kind < 0.35:
+            block = "\n".join(f"- {' '.join(rng.choices(WORDS, k=rng.randint(3, 8)))}"
+                              for _ in range(rng.randint(2, 5)))
+        else:
+            block = " ".join(rng.choices(WORDS, k=rng.randint(20, 60))).capitalize() + "."
+        parts.append(block)
+        length += len(block) + 2
+    return "\n\n".join(parts)[:size]
+
+
+def make_responses(rows: int, min_size: int, max_size: int, seed: int) -> List[str]:
+    """Ответы с размерами, равномерно распределенными по логарифмической шкале"""
+    rng = random.Random(seed)
+    ratio = max_size / min_size
+    return [make_response(rng, int(min_size * ratio ** rng.random())) for _ in range(rows)]
+
+
+def run_mode(mode: str, responses: List[str], reads: int, seed: int) -> Dict:
+    """
+    Сохраняет ответы с методом mode в новую временную базу и выполняет замеры
+    
+    Returns:
+        Словарь с измерениями
+    """
+    import db
+    
+    os.environ["CHATLIST_DATA_DIR"] = tempfile.mkdtemp(prefix=f"chatlist_compression_{mode}_")
+    db.init_db()
+    db.save_setting("response_compression", mode)
+    
+    started = time.perf_counter()
+    for start in range(0, len(responses), 100):
+        with db.transaction():
+            for n, response in enumerate(responses[start:start + 100], start):
+                db.save_result(None, None, response, f"Промт {n}")
+    insert_seconds = time.perf_counter() - started
+    
+    conn = db.get_connection()
+    stored_bytes = conn.execute("SELECT SUM(length(CAST(response AS BLOB))) FROM results").fetchone()[0]
+    compressed = conn.execute("SELECT COUNT(*) FROM results WHERE response_format != 'text'").fetchone()[0]
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db_bytes = os.path.getsize(db.get_db_path())
+    
+    # Список результатов: первая страница и все последующие
+    started = time.perf_counter()
+    rows, next_key = db.get_results_page()
+    first_page_ms = (time.perf_counter() - started) * 1000
+    page_times = []
+    while next_key is not None:
+        started = time.perf_counter()
+        rows, next_key = db.get_results_page(next_key)
+        page_times.append((time.perf_counter() - started) * 1000)
+    
+    # Полный ответ по ID
+    rng = random.Random(seed)
+    ids = [row[0] for row in conn.execute("SELECT id FROM results")]
+    read_times = []
+    for result_id in rng.choices(ids, k=reads):
+        started = time.perf_counter()
+        db.get_result_by_id(result_id)
+        read_times.append((time.perf_counter() - started) * 1000)
+    
+    # Поиск по индексу (первая страница, как в окне результатов)
+    search_times = []
+    for word in rng.choices(WORDS, k=20):
+        started = time.perf_counter()
+        db.get_results_page(query=word)
+        search_times.append((time.perf_counter() - started) * 1000)
+    
+    db.close_connection()
+    return {
+        "mode": mode,
+        "rows": len(responses),
+        "compressed_rows": compressed,
+        "text_mb": sum(len(response.encode("utf-8")) for response in responses) / 1024 / 1024,
+        "stored_mb": stored_bytes / 1024 / 1024,
+        "db_mb": db_bytes / 1024 / 1024,
+        "insert_rows_per_second": len(responses) / insert_seconds if insert_seconds else 0.0,
+        "first_page_ms": first_page_ms,
+        "next_page_ms": sum(page_times) / len(page_times) if page_times else None,
+        "read_p50_ms": percentile(read_times, 50),
+        "read_p95_ms": percentile(read_times, 95),
+        "search_p50_ms": percentile(search_times, 50),
+    }
+
+
+def format_result(result: Dict) -> str:
+    """Строка отчета по одному методу"""
+    def ms(value):
+        return "-" if value is None else f"{value:.2f}"
+    return (f"{result['mode']:>5}: база {result['db_mb']:.1f} МБ, ответы {result['stored_mb']:.1f} МБ "
+            f"(текст {result['text_mb']:.1f} МБ, сжато {result['compressed_rows']} из {result['rows']}), "
+            f"запись {result['insert_rows_per_second']:.0f}/с, "
+            f"страница {ms(result['first_page_ms'])}/{ms(result['next_page_ms'])} мс, "
+            f"ответ p50/p95 {ms(result['read_p50_ms'])}/{ms(result['read_p95_ms'])} мс, "
+            f"поиск {ms(result['search_p50_ms'])} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сжатия ответов в таблице results")
+    parser.add_argument("--modes", default=DEFAULT_MODES, help="Методы через запятую: none, zlib, lzma")
+    parser.add_argument("--rows", type=int, default=2000, help="Число сохраняемых ответов")
+    parser.add_argument("--min-size", type=int, default=2048, help="Минимальный размер ответа в символах")
+    parser.add_argument("--max-size", type=int, default=102400, help="Максимальный размер ответа в символах")
+    parser.add_argument("--reads", type=int, default=200, help="Число чтений полного ответа")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора текста")
+    parser.add_argument("--output", help="Файл для результатов в JSON")
+    args = parser.parse_args()
+    
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    responses = make_responses(args.rows, args.min_size, args.max_size, args.seed)
+    results = []
+    for mode in [item.strip() for item in args.modes.split(",") if item.strip()]:
+        result = run_mode(mode, responses, args.reads, args.seed)
+        results.append(result)
+        print(format_result(result), flush=True)
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "args": vars(args), "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Бенчмарк переиспользования HTTP-соединений
+
+Поднимает локальный OpenAI-совместимый сервер (mock_server), считает
+принятые им TCP-соединения и сравнивает два режима:
+  - "до": каждый запрос через requests.post (новое соединение на запрос)
+  - "после": запросы через общую сессию network.get_session (keep-alive пул)
+
+Запуск:
+    python bench_connections.py [--requests 200] [--concurrency 8]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import network
+from mock_server import MockServer
+
+
+def run(post, url: str, total: int, concurrency: int) -> float:
+    """Выполняет total запросов в concurrency потоков, возвращает время в секундах"""
+    payload = {"model": "bench", "messages": [{"role": "user", "content": "ping"}]}
+    
+    def one(_):
+        response = post(url, json=payload, timeout=10)
+        response.raise_for_status()
+        response.json()
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение числа TCP-соединений до и после пула сессий")
+    parser.add_argument("--requests", type=int, default=200, help="Число запросов в каждом режиме")
+    parser.add_argument("--concurrency", type=int, default=8, help="Число параллельных потоков")
+    args = parser.parse_args()
+    
+    server = MockServer().start()
+    url = server.url
+    
+    try:
+        results = {}
+        for mode, post in (
+            ("до (requests.post)", requests.post),
+            ("после (network.get_session)", network.get_session(url).post),
+        ):
+            server.stats.reset()
+            elapsed = run(post, url, args.requests, args.concurrency)
+            results[mode] = (server.stats.snapshot()["connections"], elapsed)
+        
+        print(f"Запросов: {args.requests}, потоков: {args.concurrency}")
+        print("-" * 60)
+        for mode, (connections, elapsed) in results.items():
+            print(f"{mode:30} соединений: {connections:5}  время: {elapsed:.3f} с")
+    finally:
+        server.stop()
+        network.reset_sessions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Бенчмарк пропускной способности рассылки промта по моделям
+
+Поднимает локальный OpenAI-совместимый сервер (mock_server) и измеряет
+запросы в секунду, задержку p50/p95/p99 и пиковую память процесса в
+зависимости от:
+  - числа моделей (1-200)
+  - числа параллельных потоков
+  - размера ответа (1 КБ - 1 МБ)
+  - доли ошибок 500
+
+Проверяются два пути:
+  - "fanout": models.send_prompt_to_models (задержка - время от начала
+    рассылки до получения результата модели)
+  - "send_request": network.send_request из пула потоков (задержка -
+    время одного запроса)
+
+Каждый сценарий выполняется в отдельном процессе с временной базой данных
+(CHATLIST_DATA_DIR), поэтому пиковая память не накапливается между
+сценариями, а пользовательская база не затрагивается. Кэш ответов,
+повторы и ограничение частоты запросов на время замера отключаются.
+
+Результаты пишутся в JSON; с --compare они сравниваются с прошлым
+запуском, а регрессии сверх порога выводятся и дают код возврата 1.
+
+Запуск:
+    python bench_fanout.py --quick --output bench.json
+    python bench_fanout.py --models 1,50,200 --sizes 1024,1048576 --output new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows: пиковая память не измеряется
+    resource = None
+
+
+# Параметры по умолчанию
+DEFAULT_MODELS = "1,10,50,200"
+DEFAULT_CONCURRENCY = "8,32"
+DEFAULT_SIZES = "1024,102400,1048576"
+DEFAULT_ERROR_RATES = "0,0.1"
+DEFAULT_TARGETS = "fanout,send_request"
+DEFAULT_THRESHOLD = 0.15
+
+# Сокращенная сетка для быстрой проверки
+QUICK_GRID = {
+    "models": "1,20",
+    "concurrency": "8",
+    "sizes": "1024,102400",
+    "error_rates": "0,0.1",
+}
+
+# Поля, по которым сценарии сопоставляются при сравнении
+SCENARIO_KEYS = ("target", "models", "concurrency", "response_size", "error_rate")
+
+# Метрики для сравнения: (поле, True - чем больше, тем лучше)
+COMPARED_METRICS = (
+    ("rps", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+    ("peak_rss_mb", False),
+)
+
+BENCH_KEY_ENV = "CHATLIST_BENCH_KEY"
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """Перцентиль по методу ближайшего ранга (None для пустого списка)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(-(-percent * len(ordered) // 100)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковая память текущего процесса в МБ (None, если недоступно)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS - байты
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def parse_list(value: str, cast) -> List:
+    """Разбирает список значений через запятую"""
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def run_scenario(scenario: Dict) -> Dict:
+    """
+    Выполняет один сценарий в текущем процессе
+    
+    Вызывается в дочернем процессе: база данных уже указана через
+    CHATLIST_DATA_DIR.
+    
+    Args:
+        scenario: Параметры сценария (url, target, models, concurrency,
+            response_size, error_rate, latency, iterations, timeout)
+    
+    Returns:
+        Словарь с измерениями
+    """
+    import logging
+    import db
+    import models
+    import network
+    
+    # Журнал каждого запроса искажает замер
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    concurrency = scenario["concurrency"]
+    db.init_db()
+    for key, value in {
+        "cache_enabled": "0",
+        "metrics_enabled": "0",
+        "hedging_enabled": "0",
+        "daily_budget": "0",
+        "retry_max_attempts": "1",
+        "rate_limit_rps": "1000000",
+        "rate_limit_burst": "1000000",
+        "rate_limit_max_in_flight": str(concurrency),
+        "max_concurrent_requests": str(concurrency),
+    }.items():
+        db.save_setting(key, value)
+    network.reload_settings()
+    
+    os.environ.setdefault(BENCH_KEY_ENV, "bench")
+    query = f"response_size={scenario['response_size']}&rate_500={scenario['error_rate']}"
+    model_ids = [
+        db.add_model(f"bench-{i}", scenario["url"], f"bench-{i}?{query}", BENCH_KEY_ENV, "openai")
+        for i in range(scenario["models"])
+    ]
+    model_infos = [m for m in db.get_active_models() if m["id"] in model_ids]
+    timeout = scenario["timeout"]
+    
+    def fanout(prompt: str) -> List[tuple]:
+        start = time.perf_counter()
+        marks = []
+        
+        def on_result(result):
+            marks.append((time.perf_counter() - start, models._is_error(result)))
+        
+        models.send_prompt_to_models(prompt, model_ids, max_workers=concurrency,
+                                     model_timeout=timeout, run_timeout=timeout * 2,
+                                     on_result=on_result, use_cache=False)
+        return marks
+    
+    def send_requests(prompt: str) -> List[tuple]:
+        def one(model_info):
+            start = time.perf_counter()
+            response = network.send_request(model_info, prompt, timeout=timeout,
+                                            use_cache=False, coalesce=False)
+            return time.perf_counter() - start, not response or response.startswith("Ошибка:")
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(one, model_infos))
+    
+    run = fanout if scenario["target"] == "fanout" else send_requests
+    
+    # Прогрев: соединения и шаблоны запросов
+    run("warmup")
+    
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for iteration in range(scenario["iterations"]):
+        for latency, failed in run(f"bench {iteration}"):
+            latencies.append(latency)
+            errors += failed
+    wall = time.perf_counter() - start
+    network.reset_sessions()
+    
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+    
+    rss = peak_rss_mb()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "peak_rss_mb": round(rss, 1) if rss is not None else None,
+    }
+
+
+def run_in_subprocess(scenario: Dict) -> Dict:
+    """Запускает сценарий в отдельном процессе с временной базой данных"""
+    with tempfile.TemporaryDirectory(prefix="chatlist-bench-") as data_dir:
+        env = dict(os.environ, CHATLIST_DATA_DIR=data_dir)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(scenario)],
+            env=env, capture_output=True, text=True
+        )
+    if completed.returncode != 0:
+        return {"failed": completed.stderr.strip().splitlines()[-1:] or ["неизвестная ошибка"]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def get_commit() -> Optional[str]:
+    """Текущий коммит git (None вне репозитория)"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenario_key(result: Dict) -> tuple:
+    return tuple(result[key] for key in SCENARIO_KEYS)
+
+
+def compare(results: List[Dict], baseline: Dict, threshold: float) -> List[str]:
+    """
+    Сравнивает результаты с прошлым запуском
+    
+    Args:
+        results: Текущие результаты
+        baseline: Содержимое JSON прошлого запуска
+        threshold: Допустимое ухудшение (доля, например 0.15 = 15%)
+    
+    Returns:
+        Список описаний регрессий (пустой, если их нет)
+    """
+    previous = {scenario_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get(scenario_key(result))
+        if old is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            new_value, old_value = result.get(metric), old.get(metric)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if (-change if higher_is_better else change) > threshold:
+                name = ", ".join(f"{key}={result[key]}" for key in SCENARIO_KEYS)
+                regressions.append(f"{name}: {metric} {old_value} -> {new_value} ({change:+.0%})")
+    return regressions
+
+
+def format_result(result: Dict) -> str:
+    """Строка с результатом сценария для консоли"""
+    name = (f"{result['target']:12} моделей: {result['models']:4} потоков: {result['concurrency']:3} "
+            f"ответ: {result['response_size']:8} ошибок: {result['error_rate']:<4}")
+    if "failed" in result:
+        return f"{name}  сбой: {result['failed'][0]}"
+    rss = f"{result['peak_rss_mb']:.1f} МБ" if result["peak_rss_mb"] is not None else "-"
+    return (f"{name}  rps: {result['rps']:8.1f}  p50: {result['p50_ms']:8.1f}  "
+            f"p95: {result['p95_ms']:8.1f}  p99: {result['p99_ms']:8.1f} мс  память: {rss}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пропускной способности рассылки по моделям")
+    parser.add_argument("--models", default=DEFAULT_MODELS, help="Числа моделей через запятую")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="Числа потоков через запятую")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Размеры ответа в символах через запятую")
+    parser.add_argument("--error-rates", default=DEFAULT_ERROR_RATES, help="Доли ошибок 500 через запятую")
+    parser.add_argument("--targets", default=DEFAULT_TARGETS, help="Пути: fanout, send_request")
+    parser.add_argument("--latency", default="0.02", help="Задержка сервера (формат mock_server --latency)")
+    parser.add_argument("--iterations", type=int, default=3, help="Число рассылок в каждом сценарии")
+    parser.add_argument("--timeout", type=float, default=30, help="Таймаут запроса, с")
+    parser.add_argument("--quick", action="store_true", help="Сокращенная сетка параметров")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно генератора ошибок сервера")
+    parser.add_argument("--output", help="Файл для результатов в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для поиска регрессий")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Допустимое ухудшение метрики (доля)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        print(json.dumps(run_scenario(json.loads(args.worker))))
+        return
+    
+    if args.quick:
+        for name, value in QUICK_GRID.items():
+            setattr(args, name, value)
+    
+    from mock_server import MockConfig, MockServer
+    
+    results = []
+    with MockServer(MockConfig(latency=args.latency), seed=args.seed) as server:
+        for target in parse_list(args.targets, str):
+            for model_count in parse_list(args.models, int):
+                for concurrency in parse_list(args.concurrency, int):
+                    for size in parse_list(args.sizes, int):
+                        for error_rate in parse_list(args.error_rates, float):
+                            scenario = {
+                                "target": target,
+                                "models": model_count,
+                                "concurrency": concurrency,
+                                "response_size": size,
+                                "error_rate": error_rate,
+                            }
+                            measured = run_in_subprocess(dict(
+                                scenario, url=server.url, latency=args.latency,
+                                iterations=args.iterations, timeout=args.timeout
+                            ))
+                            result = dict(scenario, **measured)
+                            results.append(result)
+                            print(format_result(result), flush=True)
+    
+    report = {
+        "commit": get_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "latency": args.latency,
+        "iterations": args.iterations,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены: {args.output}")
+    
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print("-" * 60)
+        if regressions:
+            print(f"Регрессии относительно {baseline.get('commit') or args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"Регрессий относительно {baseline.get('commit') or args.compare} нет")
+
+
+if __name__ == "__main__":
+    main()
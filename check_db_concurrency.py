@@ -0,0 +1,130 @@
+"""
+Проверка одновременной работы с базой данных из нескольких процессов
+
+Запускает несколько процессов-писателей, которые сохраняют результаты и
+метрики запросов во временную базу (CHATLIST_DATA_DIR), пока основной
+процесс читает список результатов, как окно истории. Выводит число записей
+в секунду, максимальное время чтения и ошибки ("database is locked" и др.).
+Код возврата 1 - были ошибки или потерянные записи.
+
+Запуск:
+    python check_db_concurrency.py
+    python check_db_concurrency.py --writers 8 --rows 500 --batch 10
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from typing import Dict
+
+
+def writer(index: int, rows: int, batch: int, queue):
+    """
+    Процесс-писатель: сохраняет rows результатов транзакциями по batch штук
+    
+    Args:
+        index: Номер писателя
+        rows: Сколько результатов сохранить
+        batch: Сколько результатов в одной транзакции
+        queue: Очередь для отчета {"written": ..., "errors": [...]}
+    """
+    import db
+    written = 0
+    errors = []
+    for start in range(0, rows, batch):
+        count = min(batch, rows - start)
+        try:
+            with db.transaction():
+                for n in range(start, start + count):
+                    db.save_result(None, None, f"Ответ {index}-{n} " + "x" * 2000, f"Промт {index}")
+                db.add_request_metrics([
+                    (None, time.time(), 0, 10, 20, 100, 2000, 200, 0, "ok", None, None, None, 0)
+                ])
+            written += count
+        except Exception as e:
+            errors.append(str(e))
+    queue.put({"written": written, "errors": errors})
+
+
+def run(writers: int, rows: int, batch: int) -> Dict:
+    """
+    Запускает писателей и читает результаты, пока они работают
+    
+    Args:
+        writers: Число процессов-писателей
+        rows: Сколько результатов сохраняет каждый писатель
+        batch: Размер транзакции писателя
+    
+    Returns:
+        Словарь с written, expected, rows_per_second, reads, max_read_ms, errors
+    """
+    import db
+    db.init_db()
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer, args=(i, rows, batch, queue))
+                 for i in range(writers)]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    
+    reads = 0
+    max_read = 0.0
+    errors = []
+    while any(process.is_alive() for process in processes):
+        read_started = time.perf_counter()
+        try:
+            db.get_results_page()
+            reads += 1
+        except Exception as e:
+            errors.append(f"Чтение: {e}")
+        max_read = max(max_read, time.perf_counter() - read_started)
+        time.sleep(0.01)
+    
+    reports = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+    
+    written = sum(report["written"] for report in reports)
+    for report in reports:
+        errors.extend(report["errors"])
+    stored = len(db.get_results())
+    if stored != written:
+        errors.append(f"В базе {stored} результатов, записано {written}")
+    return {
+        "written": written,
+        "expected": writers * rows,
+        "rows_per_second": written / elapsed if elapsed else 0.0,
+        "reads": reads,
+        "max_read_ms": max_read * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка одновременной записи в базу из нескольких процессов")
+    parser.add_argument("--writers", type=int, default=4, help="Число процессов-писателей")
+    parser.add_argument("--rows", type=int, default=200, help="Результатов на писателя")
+    parser.add_argument("--batch", type=int, default=1, help="Результатов в одной транзакции")
+    args = parser.parse_args()
+    
+    # Временная база, пользовательские данные не затрагиваются
+    os.environ["CHATLIST_DATA_DIR"] = tempfile.mkdtemp(prefix="chatlist_dbcheck_")
+    result = run(args.writers, args.rows, args.batch)
+    
+    print(f"Писателей: {args.writers}, записано {result['written']} из {result['expected']} "
+          f"({result['rows_per_second']:.0f} в секунду)")
+    print(f"Чтений: {result['reads']}, максимальное время чтения: {result['max_read_ms']:.1f} мс")
+    if result["errors"]:
+        print(f"Ошибок: {len(result['errors'])}")
+        for error in result["errors"][:10]:
+            print(f"  {error}")
+    ok = not result["errors"] and result["written"] == result["expected"]
+    print("OK" if ok else "Ошибка: есть сбои при одновременной работе с базой")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
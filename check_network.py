@@ -0,0 +1,413 @@
+"""
+Проверка сетевого слоя на локальном сервере (mock_server)
+
+Каждая проверка поднимает свой MockServer и работает с временной базой
+(CHATLIST_DATA_DIR), пользовательские данные не затрагиваются. Выводит
+результат каждой проверки; код возврата 1 - хотя бы одна не прошла.
+
+Проверки:
+  sse           - разбор потока SSE (iter_sse_deltas): строки, разрезанные
+                  между фрагментами сети, комментарии, [DONE], usage
+  retry         - число попыток при ответах 429 и 500 (RetryPolicy)
+  cancel        - CancelToken обрывает поток ответа посреди тела
+  coalesce      - одновременные одинаковые запросы уходят на сервер одним
+                  (SingleFlight), ошибка передается всем ожидающим
+  first_n       - send_prompt_to_models(first_n=...) возвращается после
+                  первых ответов и обрывает остальные запросы
+  pool          - потоки запросов (и их соединения с базой) переиспользуются
+                  между запусками
+  hedge         - дублирующий запрос обрывает проигравший запрос и
+                  освобождает его соединение и слот ограничителя
+
+Запуск:
+    python check_network.py
+    python check_network.py --only sse,retry
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+
+CHECK_KEY_ENV = "CHATLIST_CHECK_KEY"
+
+# Зерно сервера, при котором первый запрос с latency=uniform:0:3 ждет ~2.9 с,
+# а второй ~0.03 с (дубль гарантированно выигрывает у основного запроса)
+HEDGE_SEED = 15
+
+
+class CheckFailed(Exception):
+    """Проверка не прошла"""
+
+
+def expect(condition: bool, message: str):
+    """Завершает проверку с ошибкой message, если условие не выполнено"""
+    if not condition:
+        raise CheckFailed(message)
+
+
+def add_model(server, name: str, params: str = "") -> Dict:
+    """Добавляет в базу модель на сервере server (params - параметры MockConfig)"""
+    import db
+    api_id = f"{name}?{params}" if params else name
+    model_id = db.add_model(name, server.url, api_id, CHECK_KEY_ENV, "openai")
+    return db.get_model_by_id(model_id)
+
+
+def free_slots(server) -> Tuple[int, int]:
+    """(свободно, всего) слотов max_in_flight ограничителя запросов к серверу"""
+    import network
+    governor = network.get_governor(server.url, f"Bearer {os.environ[CHECK_KEY_ENV]}")
+    return governor.in_flight._value, governor.in_flight._initial_value
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 1.0) -> bool:
+    """Ждет, пока condition() не станет истинным, не дольше timeout секунд"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+class ChunkedRaw:
+    """Тело ответа, которое приходит заданными кусками (как из сети)"""
+    def __init__(self, pieces: List[bytes]):
+        self.pieces = pieces
+    
+    def stream(self, chunk_size=None, decode_content=True):
+        yield from self.pieces
+    
+    def close(self):
+        pass
+
+
+def fake_stream_response(body: bytes, piece_size: int):
+    """Ответ requests с телом body, разрезанным на куски по piece_size байт"""
+    import requests
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = ChunkedRaw([body[i:i + piece_size] for i in range(0, len(body), piece_size)])
+    return response
+
+
+def check_sse():
+    """Фрагменты и usage разбираются одинаково при любой нарезке тела на куски"""
+    import network
+    from mock_server import MockConfig, MockServer
+    
+    def event(content: str) -> str:
+        return "data: " + json.dumps({"choices": [{"delta": {"content": content}}]},
+                                     ensure_ascii=False) + "\n\n"
+    
+    body = (": OPENROUTER PROCESSING\n\n"
+            + event("Привет")
+            + "data: " + json.dumps({"choices": [{"delta": {"role": "assistant"}}]}) + "\r\n\r\n"
+            + event(", мир")
+            + "data: " + json.dumps({"choices": [], "usage": {"prompt_tokens": 3,
+                                                              "completion_tokens": 5}}) + "\n\n"
+            + "data: [DONE]\n\n"
+            + event("после DONE")).encode("utf-8")
+    # Куски по 1-7 байт режут и "data:", и двухбайтовые символы UTF-8
+    for piece_size in (1, 2, 3, 7, len(body)):
+        usage: Dict = {}
+        deltas = list(network.iter_sse_deltas(fake_stream_response(body, piece_size), usage))
+        expect(deltas == ["Привет", ", мир"], f"куски по {piece_size} байт: фрагменты {deltas}")
+        expect(usage == {"prompt_tokens": 3, "completion_tokens": 5},
+               f"куски по {piece_size} байт: usage {usage}")
+    
+    error_body = b'data: {"error": {"message": "overloaded"}}\n\n'
+    try:
+        list(network.iter_sse_deltas(fake_stream_response(error_body, 5)))
+    except ValueError as e:
+        expect("overloaded" in str(e), f"текст ошибки потока: {e}")
+    else:
+        expect(False, "ошибка в потоке не выброшена")
+    
+    # Тот же разбор на настоящем chunked-потоке сервера (с комментарием в начале)
+    with MockServer(MockConfig(response_size=500, stream_chunk_size=7)) as server:
+        model = add_model(server, "sse")
+        deltas = []
+        stats: Dict = {}
+        response = network.send_request(model, "ping", stream=True, on_delta=deltas.append,
+                                         use_cache=False, coalesce=False, stats=stats)
+        expect(response is not None and len(response) == 500, f"длина ответа {len(response or '')}")
+        expect("".join(deltas) == response and len(deltas) == 72,
+               f"получено фрагментов {len(deltas)} вместо 72")
+        expect(stats.get("completion_tokens") == 125, f"usage потока: {stats.get('completion_tokens')}")
+
+
+def check_retry():
+    """429 и 500 повторяются до retry_max_attempts попыток, успешный ответ - нет"""
+    import network
+    from mock_server import MockConfig, MockServer
+    
+    attempts = network.RetryPolicy.from_settings().max_attempts
+    for name, params, status in (("r429", "rate_429=1&retry_after=0", "429"),
+                                 ("r500", "rate_500=1", "500"),
+                                 ("ok", "", "ok")):
+        with MockServer(MockConfig()) as server:
+            model = add_model(server, name, params)
+            stats: Dict = {}
+            response = network.send_request(model, "ping", use_cache=False, coalesce=False,
+                                            stats=stats)
+            requests_sent = server.stats.snapshot()[status]
+            expected = 1 if status == "ok" else attempts
+            expect(requests_sent == expected,
+                   f"{name}: запросов на сервер {requests_sent}, ожидалось {expected}")
+            expect(stats.get("retries") == expected - 1, f"{name}: retries = {stats.get('retries')}")
+            expect((status == "ok") != response.startswith("Ошибка:"), f"{name}: ответ {response[:80]}")
+            expect(free_slots(server)[0] == free_slots(server)[1], f"{name}: слот ограничителя занят")
+
+
+def check_cancel():
+    """Отмена посреди потока (сервер отдавал бы его ~10 с) обрывает соединение сразу"""
+    import network
+    from mock_server import MockConfig, MockServer
+    
+    with MockServer(MockConfig(response_size=2000, stream_chunk_size=20, drip_delay=0.1)) as server:
+        model = add_model(server, "cancel")
+        cancel = network.CancelToken()
+        deltas = []
+        result = {}
+        
+        def run():
+            result["response"] = network.send_request(model, "ping", stream=True,
+                                                      on_delta=deltas.append, use_cache=False,
+                                                      coalesce=False, cancel=cancel)
+        
+        thread = threading.Thread(target=run)
+        thread.start()
+        expect(wait_for(lambda: len(deltas) >= 3, timeout=5), "поток не начался")
+        cancelled_at = time.monotonic()
+        cancel.cancel()
+        thread.join(timeout=2)
+        expect(not thread.is_alive(), "запрос не завершился после отмены")
+        expect(time.monotonic() - cancelled_at < 0.5,
+               f"отмена заняла {time.monotonic() - cancelled_at:.2f} с")
+        expect(result.get("response") == network.CANCELLED_RESPONSE,
+               f"ответ отмененного запроса: {str(result.get('response'))[:80]}")
+        received = len(deltas)
+        expect(received < 100, "поток прочитан целиком")
+        expect(wait_for(lambda: server.stats.snapshot()["stream_aborted"] == 1),
+               "сервер не увидел обрыв потока")
+        expect(len(deltas) == received, "фрагменты приходят после отмены")
+        expect(free_slots(server)[0] == free_slots(server)[1], "слот ограничителя занят")
+
+
+def check_coalesce():
+    """Три одновременных одинаковых запроса - один запрос к серверу и один общий ответ"""
+    import network
+    from mock_server import MockConfig, MockServer
+    
+    with MockServer(MockConfig(latency="0.3")) as server:
+        model = add_model(server, "coalesce")
+        before = network.get_coalescing_stats()
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(
+            network.send_request(model, "ping", use_cache=False))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        after = network.get_coalescing_stats()
+        expect(server.stats.snapshot()["requests"] == 1,
+               f"запросов на сервер: {server.stats.snapshot()['requests']}")
+        expect(len(set(responses)) == 1 and not responses[0].startswith("Ошибка:"),
+               "ожидавшие вызовы получили другой ответ")
+        expect(after["coalesced"] - before["coalesced"] == 2,
+               f"объединено вызовов: {after['coalesced'] - before['coalesced']}")
+    
+    # Исключение первого вызова получают и ожидавшие его
+    flight = network.SingleFlight()
+    errors = []
+    
+    def failing():
+        time.sleep(0.2)
+        raise RuntimeError("сбой")
+    
+    def call():
+        try:
+            flight.do("key", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+    
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expect(errors == ["сбой"] * 3, f"ошибки вызовов: {errors}")
+    expect(flight.get_stats() == {"leaders": 1, "coalesced": 2}, f"счетчики: {flight.get_stats()}")
+
+
+def check_first_n():
+    """first_n=2: возврат после двух быстрых моделей, медленная (3 с) обрывается"""
+    import models
+    from mock_server import MockConfig, MockServer
+    
+    with MockServer(MockConfig()) as server:
+        model_ids = [add_model(server, name, params)["id"]
+                     for name, params in (("fast1", "latency=0.05"), ("fast2", "latency=0.1"),
+                                          ("slow", "latency=3"))]
+        for stream in (False, True):
+            started = time.monotonic()
+            results = models.send_prompt_to_models("ping", model_ids, stream=stream,
+                                                   on_delta=lambda name, delta: None,
+                                                   use_cache=False, first_n=2)
+            elapsed = time.monotonic() - started
+            mode = "потоковый" if stream else "обычный"
+            expect(elapsed < 1.0, f"{mode}: возврат через {elapsed:.2f} с")
+            expect(sorted(result.model_name for result in results) == ["fast1", "fast2"],
+                   f"{mode}: результаты {[result.model_name for result in results]}")
+            expect(wait_for(lambda: free_slots(server)[0] == free_slots(server)[1]),
+                   f"{mode}: запрос к медленной модели не оборван")
+            expect(wait_for(lambda: models.get_worker_stats()["fanout"]["busy"] == 0),
+                   f"{mode}: запрос к медленной модели еще занимает поток пула")
+
+
+def check_pool():
+    """Повторные запуски по 8 моделям не создают новых потоков и соединений с базой"""
+    import db
+    import models
+    from mock_server import MockConfig, MockServer
+    
+    opened = []
+    open_connection = db._open_connection
+    
+    def counting_open(*args, **kwargs):
+        opened.append(threading.current_thread().name)
+        return open_connection(*args, **kwargs)
+    
+    with MockServer(MockConfig(latency="0.05")) as server:
+        model_ids = [add_model(server, f"pool{n}")["id"] for n in range(8)]
+        db._open_connection = counting_open
+        try:
+            for run in range(3):
+                opened.clear()
+                results = models.send_prompt_to_models("ping", model_ids, use_cache=False,
+                                                       max_workers=8)
+                expect(len(results) == 8 and not any(result.response.startswith("Ошибка:")
+                                                     for result in results),
+                       f"запуск {run + 1}: ответов без ошибок {len(results)}")
+                if run:
+                    expect(not opened, f"запуск {run + 1}: открыто соединений с базой: {len(opened)}")
+        finally:
+            db._open_connection = open_connection
+        expect(models.get_worker_stats()["fanout"]["size"] >= 8, "пул меньше max_workers")
+
+
+def check_hedge():
+    """Дубль выигрывает, основной запрос (сервер ответил бы через ~2.9 с) обрывается, доля дублей ограничена"""
+    import db
+    import models
+    import network
+    from mock_server import MockConfig, MockServer
+    
+    # Доля считается по всем учтенным запросам, а не по одному запуску
+    budget = models.HedgeBudget(0.2)
+    allowed = []
+    for _ in range(10):
+        budget.count_request()
+        allowed.append(budget.try_acquire())
+    expect(allowed == [False] * 4 + [True] + [False] * 4 + [True],
+           f"дубли разрешены после запросов: {[n + 1 for n, ok in enumerate(allowed) if ok]}")
+    
+    for stream in (False, True):
+        with MockServer(MockConfig(latency="uniform:0:3"), seed=HEDGE_SEED) as server:
+            model = add_model(server, f"hedge-{'stream' if stream else 'plain'}")
+            for _ in range(10):
+                db.add_model_latency(model["id"], 0.2)
+            deltas = []
+            hedge_won = models.get_hedge_stats()["won"]
+            
+            started = time.monotonic()
+            result = models.request_model_hedged(
+                model, "ping", timeout=10, budget=models.HedgeBudget(1.0),
+                percentile=90, min_samples=10, stream=stream,
+                on_delta=lambda name, delta: deltas.append(delta), use_cache=False
+            )
+            elapsed = time.monotonic() - started
+            
+            mode = "потоковый" if stream else "обычный"
+            expect(not result.response.startswith("Ошибка:"),
+                   f"{mode}: ошибка вместо ответа: {result.response}")
+            expect(elapsed < 1.5, f"{mode}: ответ через {elapsed:.2f} с, дубль не помог")
+            expect(models.get_hedge_stats()["won"] == hedge_won + 1, f"{mode}: дубль не выиграл")
+            if stream:
+                expect("".join(deltas) == result.response,
+                       f"{mode}: фрагменты не совпадают с ответом")
+            # Проигравший запрос не ждет ответа сервера (~2.9 с), а обрывается сразу
+            expect(wait_for(lambda: free_slots(server)[0] == free_slots(server)[1]),
+                   f"{mode}: слот ограничителя проигравшего запроса не освобожден")
+            expect(wait_for(lambda: models.get_worker_stats()["hedge"]["busy"] == 0),
+                   f"{mode}: проигравший запрос еще занимает поток пула")
+            # Дубль отмечен в метриках, а проигравший запрос - в итогах запуска
+            expect(result.hedged and wait_for(lambda: result.hedge_loser is not None),
+                   f"{mode}: результат проигравшего запроса не сохранен")
+            network.flush_metrics()
+            hedges = db.get_connection().execute(
+                "SELECT COUNT(*), SUM(hedge) FROM request_metrics WHERE model_id = ?", (model["id"],)
+            ).fetchone()
+            expect(tuple(hedges) == (2, 1), f"{mode}: метрики (запросов, дублей): {tuple(hedges)}")
+            expect(models.summarize_usage([result])["hedges"] == 1, f"{mode}: дубль не учтен в итогах")
+
+
+CHECKS: List[Tuple[str, Callable[[], None]]] = [
+    ("sse", check_sse),
+    ("retry", check_retry),
+    ("cancel", check_cancel),
+    ("coalesce", check_coalesce),
+    ("first_n", check_first_n),
+    ("pool", check_pool),
+    ("hedge", check_hedge),
+]
+
+
+def setup():
+    """Временная база и настройки: без кэша ответов, с короткими паузами повторов"""
+    os.environ["CHATLIST_DATA_DIR"] = tempfile.mkdtemp(prefix="chatlist_netcheck_")
+    os.environ.setdefault(CHECK_KEY_ENV, "check-key")
+    import logging
+    import db
+    import network
+    db.init_db()
+    for key, value in (("cache_enabled", "0"), ("prewarm_connections", "0"),
+                       ("adaptive_timeouts", "0"), ("retry_base_delay", "0.05")):
+        db.save_setting(key, value)
+    network.reload_settings()
+    # Журнал каждого запроса мешает читать результат проверок
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка сетевого слоя на локальном сервере")
+    parser.add_argument("--only", help="Имена проверок через запятую: "
+                        + ", ".join(name for name, _ in CHECKS))
+    args = parser.parse_args()
+    
+    selected = [item.strip() for item in args.only.split(",")] if args.only else None
+    setup()
+    failed = 0
+    for name, check in CHECKS:
+        if selected and name not in selected:
+            continue
+        started = time.monotonic()
+        try:
+            check()
+        except CheckFailed as e:
+            failed += 1
+            print(f"{name}: Ошибка: {e}")
+            continue
+        print(f"{name}: OK ({time.monotonic() - started:.2f} с)")
+    print("OK" if not failed else f"Ошибка: не прошло проверок: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
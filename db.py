@@ -3,19 +3,158 @@
 """
 import sqlite3
 import os
+import hashlib
+import logging
+import lzma
+import math
+import re
+import time
+import threading
+import unicodedata
+import urllib.parse
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from app_paths import get_db_path
 
 
-def get_connection():
-    """Создает и возвращает соединение с базой данных"""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
+logger = logging.getLogger(__name__)
+
+# Соединения с базой по потокам: объекты sqlite3 нельзя передавать между
+# потоками, поэтому у каждого потока (главного, QThread, пула запросов) свое
+_local = threading.local()
+
+# Параметры соединения: ожидание блокировки по умолчанию (мс; переопределяется
+# настройкой db_busy_timeout), кэш страниц (КБ) и размер отображения файла в память
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16384
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def _open_connection(db_path: str, read_only: bool = False) -> sqlite3.Connection:
+    """
+    Открывает соединение и настраивает его
+    
+    База переводится в режим WAL: читатели не блокируют писателя и наоборот,
+    поэтому GUI, скрипты и параллельные записи результатов работают с одним
+    файлом без "database is locked". synchronous=NORMAL в WAL сохраняет
+    целостность базы, а при сбое питания теряются лишь последние транзакции.
+    
+    Args:
+        db_path: Путь к файлу базы данных
+        read_only: Открыть только для чтения
+        
+    Returns:
+        Соединение с row_factory = sqlite3.Row
+    """
+    if read_only:
+        uri = "file:" + urllib.parse.quote(os.path.abspath(db_path)) + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=DEFAULT_BUSY_TIMEOUT_MS / 1000)
+    else:
+        conn = sqlite3.connect(db_path, timeout=DEFAULT_BUSY_TIMEOUT_MS / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
     conn.row_factory = sqlite3.Row
+    # Распаковка ответов в SQL (представление results_text, поиск через LIKE)
+    conn.create_function("response_text", 2, decode_response, deterministic=True)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    try:
+        row = conn.execute("SELECT value FROM settings WHERE key = 'db_busy_timeout'").fetchone()
+    except sqlite3.OperationalError:
+        # Таблиц еще нет (первый запуск до init_db)
+        row = None
+    if row and str(row["value"]).isdigit():
+        conn.execute(f"PRAGMA busy_timeout={int(row['value'])}")
     return conn
 
 
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение с базой данных для текущего потока
+    
+    Соединение открывается при первом обращении из потока и затем
+    переиспользуется, сохраняя кэш подготовленных запросов и страниц.
+    Закрывать его не нужно: оно закрывается вместе с потоком или через
+    close_connection(). Изменения делаются внутри transaction().
+    """
+    db_path = get_db_path()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.db_path != db_path:
+        # Папка данных сменилась (CHATLIST_DATA_DIR) - открываем новую базу
+        close_connection()
+        conn = None
+    if conn is None:
+        conn = _open_connection(db_path)
+        _local.conn = conn
+        _local.db_path = db_path
+        _local.depth = 0
+    return conn
+
+
+def get_read_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение текущего потока только для чтения
+    
+    Используется функциями чтения (списки промтов, моделей, результатов):
+    в WAL оно читает последний зафиксированный снимок и не ждет долгих
+    записей. Внутри transaction() возвращается пишущее соединение, чтобы
+    чтение видело еще не зафиксированные изменения этой транзакции.
+    """
+    conn = get_connection()
+    if _local.depth:
+        return conn
+    read_conn = getattr(_local, "read_conn", None)
+    if read_conn is None:
+        try:
+            read_conn = _open_connection(_local.db_path, read_only=True)
+        except sqlite3.OperationalError:
+            # Файла базы еще нет - читаем через пишущее соединение
+            return conn
+        _local.read_conn = read_conn
+    return read_conn
+
+
+def close_connection():
+    """Закрывает соединения текущего потока (следующий вызов откроет новые)"""
+    for name in ("conn", "read_conn"):
+        conn = getattr(_local, name, None)
+        if conn is not None:
+            setattr(_local, name, None)
+            conn.close()
+
+
+@contextmanager
+def transaction():
+    """
+    Транзакция на соединении текущего потока
+    
+    При выходе без ошибок изменения фиксируются, при исключении откатываются.
+    Вложенные вызовы входят во внешнюю транзакцию: фиксирует ее только
+    внешний блок, поэтому несколько вызовов функций модуля можно объединить
+    в одну транзакцию.
+    
+    Yields:
+        Курсор соединения
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    _local.depth += 1
+    try:
+        yield cursor
+    except BaseException:
+        if _local.depth == 1:
+            conn.rollback()
+        raise
+    else:
+        if _local.depth == 1:
+            conn.commit()
+    finally:
+        _local.depth -= 1
+        cursor.close()
+
+
 def init_db():
     """Инициализация базы данных - создание всех таблиц"""
     conn = get_connection()
@@ -27,9 +166,11 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             date TEXT NOT NULL,
             prompt TEXT NOT NULL,
-            tags TEXT
+            tags TEXT,
+            content_hash TEXT
         )
     """)
+    _add_missing_columns(cursor, "prompts", {"content_hash": "TEXT"})
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_prompts_date ON prompts(date)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_prompts_tags ON prompts(tags)")
     
@@ -42,9 +183,12 @@ def init_db():
             api_id TEXT NOT NULL,
             api_key_env TEXT NOT NULL,
             is_active INTEGER NOT NULL DEFAULT 1,
-            model_type TEXT NOT NULL
+            model_type TEXT NOT NULL,
+            timeout_override REAL
         )
     """)
+    # Ручной таймаут модели появился позже - добавляем колонку в старые базы
+    _add_missing_columns(cursor, "models", {"timeout_override": "REAL"})
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_models_name ON models(name)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_models_is_active ON models(is_active)")
     
@@ -57,14 +201,95 @@ def init_db():
             response TEXT NOT NULL,
             date TEXT NOT NULL,
             prompt_text TEXT NOT NULL,
+            response_format TEXT NOT NULL DEFAULT 'text',
+            response_preview TEXT,
+            response_length INTEGER,
             FOREIGN KEY (prompt_id) REFERENCES prompts(id) ON DELETE SET NULL,
             FOREIGN KEY (model_id) REFERENCES models(id) ON DELETE SET NULL
         )
     """)
+    added = _add_missing_columns(cursor, "results", {
+        "response_format": "TEXT NOT NULL DEFAULT 'text'",
+        "response_preview": "TEXT",
+        "response_length": "INTEGER",
+    })
+    if "response_format" in added:
+        # Старая база: сжимаем уже сохраненные большие ответы. Прежний триггер
+        # индекса записал бы в него сжатые данные; индекс все равно
+        # перестраивается в _init_search_index
+        cursor.execute("DROP TRIGGER IF EXISTS results_fts_au")
+        _compress_results(cursor, DEFAULT_COMPRESSION, DEFAULT_COMPRESSION_THRESHOLD)
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_prompt_id ON results(prompt_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_model_id ON results(model_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_date ON results(date)")
     
+    # Полнотекстовый индекс промтов и результатов
+    _init_search_index(cursor)
+    
+    # Создание таблицы response_cache (кэш ответов моделей)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache(last_access)")
+    
+    # Создание таблицы model_latency (история времени ответа моделей)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS model_latency (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model_id INTEGER NOT NULL,
+            latency REAL NOT NULL,
+            created_at REAL NOT NULL,
+            FOREIGN KEY (model_id) REFERENCES models(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_model_latency_model_id ON model_latency(model_id, id)")
+    
+    # Создание таблицы request_metrics (метрики каждого HTTP-запроса к моделям)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS request_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model_id INTEGER,
+            created_at REAL NOT NULL,
+            connect_ms REAL,
+            ttfb_ms REAL,
+            total_ms REAL NOT NULL,
+            bytes_out INTEGER,
+            bytes_in INTEGER,
+            status INTEGER,
+            retries INTEGER NOT NULL DEFAULT 0,
+            outcome TEXT NOT NULL,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            cost REAL,
+            hedge INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (model_id) REFERENCES models(id) ON DELETE SET NULL
+        )
+    """)
+    # Колонки расхода токенов и отметка дублей появились позже - добавляем их в старые базы
+    _add_missing_columns(cursor, "request_metrics", {
+        "prompt_tokens": "INTEGER",
+        "completion_tokens": "INTEGER",
+        "cost": "REAL",
+        "hedge": "INTEGER NOT NULL DEFAULT 0",
+    })
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_request_metrics_model_id ON request_metrics(model_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_request_metrics_created_at ON request_metrics(created_at)")
+    
+    # Создание таблицы model_prices (цены моделей за 1M токенов, в долларах)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS model_prices (
+            model_id INTEGER PRIMARY KEY,
+            prompt_price REAL NOT NULL DEFAULT 0,
+            completion_price REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (model_id) REFERENCES models(id) ON DELETE CASCADE
+        )
+    """)
+    
     # Создание таблицы settings
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS settings (
@@ -78,6 +303,35 @@ def init_db():
     # Установка значений по умолчанию для настроек
     default_settings = [
         ("timeout", "30"),
+        ("max_concurrent_requests", "8"),
+        ("run_timeout", "120"),
+        ("stream_responses", "1"),
+        ("retry_max_attempts", "3"),
+        ("retry_base_delay", "1"),
+        ("retry_max_delay", "30"),
+        ("rate_limit_rps", "5"),
+        ("rate_limit_burst", "8"),
+        ("rate_limit_max_in_flight", "8"),
+        ("cache_enabled", "1"),
+        ("cache_ttl", "86400"),
+        ("cache_max_entries", "1000"),
+        ("metrics_enabled", "1"),
+        ("metrics_retention_days", "30"),
+        ("daily_budget", "0"),
+        ("hedging_enabled", "0"),
+        ("hedge_percentile", "90"),
+        ("hedge_max_ratio", "0.2"),
+        ("hedge_min_samples", "10"),
+        ("adaptive_timeouts", "1"),
+        ("adaptive_timeout_percentile", "99"),
+        ("adaptive_timeout_factor", "1.5"),
+        ("adaptive_timeout_min", "5"),
+        ("adaptive_timeout_max", "120"),
+        ("adaptive_timeout_min_samples", "20"),
+        ("prewarm_connections", "1"),
+        ("db_busy_timeout", str(DEFAULT_BUSY_TIMEOUT_MS)),
+        ("response_compression", DEFAULT_COMPRESSION),
+        ("response_compression_threshold", str(DEFAULT_COMPRESSION_THRESHOLD)),
         ("log_level", "INFO"),
         ("default_export_format", "markdown")
     ]
@@ -86,6 +340,11 @@ def init_db():
             INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)
         """, (key, value))
     
+    # Хэши промтов для поиска дубликатов (старые базы: заполнение, пересчет
+    # после смены нормализации и слияние дублей; версия хэшей - в settings)
+    _backfill_prompt_hashes(cursor)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_prompts_content_hash ON prompts(content_hash)")
+    
     conn.commit()
     
     # Проверяем, есть ли уже модели в базе
@@ -96,8 +355,207 @@ def init_db():
     if model_count == 0:
         init_default_models(cursor)
         conn.commit()
+
+
+def _add_missing_columns(cursor, table: str, columns: Dict[str, str]) -> List[str]:
+    """Добавляет в таблицу колонки, которых в ней еще нет (миграция старых баз), возвращает их имена"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    added = []
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+            added.append(name)
+    return added
+
+
+
+def _backfill_prompt_hashes(cursor) -> None:
+    """
+    Заполняет и пересчитывает content_hash промтов и объединяет дубликаты
+    
+    Выполняется, если у каких-то промтов нет хэша (старая база, запись
+    другой программой) или хэши посчитаны прежней версией normalize_prompt
+    (настройка prompt_hash_version). Из промтов с одинаковым нормализованным
+    текстом остается самый ранний: результаты переносятся на него, теги
+    берутся у дубликата, если у самого промта их нет. Каждое объединение
+    записывается в лог.
+    """
+    cursor.execute("SELECT value FROM settings WHERE key = 'prompt_hash_version'")
+    row = cursor.fetchone()
+    if row and row["value"] == PROMPT_HASH_VERSION:
+        cursor.execute("SELECT COUNT(*) FROM prompts WHERE content_hash IS NULL")
+        if not cursor.fetchone()[0]:
+            return
+    
+    cursor.execute("SELECT id, prompt, tags, content_hash FROM prompts ORDER BY id")
+    groups: Dict[str, List] = {}
+    for row in cursor.fetchall():
+        groups.setdefault(prompt_hash(row["prompt"]), []).append(row)
+    
+    # Устаревшие хэши сначала сбрасываются: новый хэш одного промта может
+    # совпасть со старым хэшем другого (уникальный индекс допускает NULL)
+    stale = [(row["id"],) for content_hash, rows in groups.items()
+             for row in rows if row["content_hash"] != content_hash]
+    cursor.executemany("UPDATE prompts SET content_hash = NULL WHERE id = ?", stale)
+    
+    for content_hash, rows in groups.items():
+        keep = rows[0]
+        duplicate_ids = [row["id"] for row in rows[1:]]
+        if duplicate_ids:
+            logger.warning("Промты %s совпадают с промтом %d и объединены с ним: %r",
+                           duplicate_ids, keep["id"], keep["prompt"][:80])
+            placeholders = ", ".join("?" * len(duplicate_ids))
+            cursor.execute(f"UPDATE results SET prompt_id = ? WHERE prompt_id IN ({placeholders})",
+                           (keep["id"], *duplicate_ids))
+            cursor.execute(f"DELETE FROM prompts WHERE id IN ({placeholders})", duplicate_ids)
+            tags = keep["tags"] or next((row["tags"] for row in rows if row["tags"]), None)
+            if tags != keep["tags"]:
+                cursor.execute("UPDATE prompts SET tags = ? WHERE id = ?", (tags, keep["id"]))
+        if keep["content_hash"] != content_hash:
+            cursor.execute("UPDATE prompts SET content_hash = ? WHERE id = ?", (content_hash, keep["id"]))
+    cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('prompt_hash_version', ?)",
+                   (PROMPT_HASH_VERSION,))
+
+# ========== Полнотекстовый поиск (FTS5) ==========
+
+# Индексируемые колонки: таблица FTS -> (исходная таблица, источник текста
+# для FTS, колонки, условие для строки {row}, при котором ее индексируют
+# триггеры). Триггеры написаны на чистом SQL, чтобы базу могли менять и
+# другие программы (sqlite3, test-db.py); сжатые ответы в results они
+# распаковать не могут - такие строки индексирует сам модуль (_index_results)
+SEARCH_INDEXES = {
+    "prompts_fts": ("prompts", "prompts", ("prompt", "tags"), None),
+    "results_fts": ("results", "results_text", ("response", "prompt_text"),
+                    "{row}.response_format = 'text'"),
+}
+
+# Маркеры найденных слов во фрагментах snippet() (управляющие символы,
+# которых нет в тексте; окна заменяют их на выделение)
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+
+def _init_search_index(cursor) -> None:
+    """
+    Создает FTS5-таблицы и триггеры, синхронизирующие их с prompts и results
+    
+    FTS-таблицы хранят только индекс (content=источник текста), текст
+    берется из исходной таблицы (для results - из представления results_text
+    с распакованными ответами). Если таблица создается впервые (старая
+    база) или у нее сменился источник текста, индекс заполняется по
+    существующим записям; триггеры прежних версий пересоздаются.
+    Если SQLite собран без FTS5, поиск работает через LIKE.
+    """
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS results_text AS
+        SELECT id, response_text(response, response_format) AS response, prompt_text FROM results
+    """)
+    for fts_table, (table, content, columns, condition) in SEARCH_INDEXES.items():
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,))
+        row = cursor.fetchone()
+        exists = row is not None and f"content='{content}'" in row["sql"]
+        if row is not None and not exists:
+            # Индекс прежней версии: пересоздаем вместе с триггерами
+            for suffix in ("ai", "ad", "au"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+            cursor.execute(f"DROP TABLE {fts_table}")
+        try:
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                    {", ".join(columns)}, content='{content}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            """)
+        except sqlite3.OperationalError:
+            # Нет модуля fts5
+            return
+        
+        column_list = ", ".join(columns)
+        
+        def values(row: str) -> str:
+            where = f" WHERE {condition.format(row=row)}" if condition else ""
+            return f"{row}.id, {', '.join(f'{row}.{column}' for column in columns)}{where}"
+        
+        insert = f"INSERT INTO {fts_table}(rowid, {column_list}) SELECT {values('new')};"
+        delete = (f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) "
+                  f"SELECT 'delete', {values('old')};")
+        triggers = {
+            "ai": f"AFTER INSERT ON {table} BEGIN {insert} END",
+            "ad": f"AFTER DELETE ON {table} BEGIN {delete} END",
+            "au": f"AFTER UPDATE ON {table} BEGIN {delete} {insert} END",
+        }
+        for suffix, body in triggers.items():
+            trigger = f"{fts_table}_{suffix}"
+            sql = f"CREATE TRIGGER {trigger} {body}"
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (trigger,))
+            row = cursor.fetchone()
+            if row is not None and row["sql"] != sql:
+                cursor.execute(f"DROP TRIGGER {trigger}")
+                row = None
+            if row is None:
+                cursor.execute(sql)
+        
+        if not exists:
+            cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
+
+def rebuild_search_index() -> None:
+    """Перестраивает полнотекстовый индекс промтов и результатов по исходным таблицам"""
+    with transaction() as cursor:
+        for fts_table in SEARCH_INDEXES:
+            if _has_search_index(cursor, fts_table):
+                cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
+
+def _index_results(cursor, rows: List[Tuple[int, str, str]], delete: bool = False) -> None:
+    """
+    Добавляет в индекс results_fts (или удаляет из него) сжатые ответы
+    
+    Триггеры индексируют только несжатые ответы, поэтому функции модуля,
+    записывающие сжатые ответы, вызывают эту функцию сами.
     
-    conn.close()
+    Args:
+        cursor: Курсор транзакции
+        rows: Тройки (ID результата, текст ответа, текст промта)
+        delete: Удалить строки из индекса (для удаления нужны прежние значения)
+    """
+    if not rows or not _has_search_index(cursor, "results_fts"):
+        return
+    if delete:
+        cursor.executemany("""
+            INSERT INTO results_fts(results_fts, rowid, response, prompt_text)
+            VALUES ('delete', ?, ?, ?)
+        """, rows)
+    else:
+        cursor.executemany("INSERT INTO results_fts(rowid, response, prompt_text) VALUES (?, ?, ?)",
+                           rows)
+
+
+def _has_search_index(cursor, fts_table: str) -> bool:
+    """Проверяет, есть ли в базе FTS-таблица"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,))
+    return cursor.fetchone() is not None
+
+
+def build_search_query(query: str) -> Optional[str]:
+    """
+    Преобразует введенный текст в запрос FTS5
+    
+    Каждое слово ищется как префикс (поиск по мере ввода), все слова
+    должны встретиться. Слова берутся в кавычки, поэтому операторы и
+    спецсимволы FTS5 в тексте пользователя не вызывают ошибок.
+    
+    Args:
+        query: Текст из поля поиска
+        
+    Returns:
+        Запрос для MATCH или None, если в тексте нет слов
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
 
 
 def init_default_models(cursor):
@@ -171,20 +629,105 @@ def init_default_models(cursor):
 
 # ========== Функции для работы с таблицей prompts ==========
 
+# Версия normalize_prompt: при ее смене хэши промтов пересчитываются в init_db
+PROMPT_HASH_VERSION = "2"
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Нормализует текст промта для сравнения: NFC, единые переводы строк, без крайних пробелов
+    
+    Пробелы и переводы строк внутри текста сохраняются: промты, которые
+    отличаются только разметкой (код, списки, markdown), - разные промты.
+    """
+    text = unicodedata.normalize("NFC", prompt)
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def prompt_hash(prompt: str) -> str:
+    """Хэш нормализованного текста промта (SHA-256, hex) для колонки content_hash"""
+    return hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+
+
+def upsert_prompt(prompt: str, tags: Optional[str] = None) -> int:
+    """
+    Добавляет промт, если такого еще нет, и возвращает его ID
+    
+    Промты сравниваются по хэшу нормализованного текста (уникальный индекс
+    idx_prompts_content_hash), поэтому поиск не зависит от числа промтов.
+    Если промт уже есть и у него нет тегов, записываются переданные теги.
+    
+    Args:
+        prompt: Текст промта
+        tags: Теги через запятую
+        
+    Returns:
+        ID нового или существующего промта
+    """
+    content_hash = prompt_hash(prompt)
+    with transaction() as cursor:
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute("""
+            INSERT OR IGNORE INTO prompts (date, prompt, tags, content_hash) VALUES (?, ?, ?, ?)
+        """, (date, prompt, tags, content_hash))
+        if cursor.rowcount:
+            return cursor.lastrowid
+        
+        cursor.execute("SELECT id, tags FROM prompts WHERE content_hash = ?", (content_hash,))
+        row = cursor.fetchone()
+        if tags and not row["tags"]:
+            cursor.execute("UPDATE prompts SET tags = ? WHERE id = ?", (tags, row["id"]))
+    return row["id"]
+
+
 def add_prompt(prompt: str, tags: Optional[str] = None) -> int:
-    """Добавляет новый промт в базу данных"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("""
-        INSERT INTO prompts (date, prompt, tags) VALUES (?, ?, ?)
-    """, (date, prompt, tags))
-    prompt_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    """
+    Добавляет новый промт в базу данных
+    
+    Args:
+        prompt: Текст промта
+        tags: Теги через запятую
+        
+    Returns:
+        ID нового промта
+        
+    Raises:
+        ValueError: Такой промт уже есть в базе (ничего не меняется)
+    """
+    with transaction() as cursor:
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute("""
+            INSERT OR IGNORE INTO prompts (date, prompt, tags, content_hash) VALUES (?, ?, ?, ?)
+        """, (date, prompt, tags, prompt_hash(prompt)))
+        if not cursor.rowcount:
+            cursor.execute("SELECT id FROM prompts WHERE content_hash = ?", (prompt_hash(prompt),))
+            raise ValueError(f"Такой промт уже есть (ID {cursor.fetchone()['id']})")
+        prompt_id = cursor.lastrowid
     return prompt_id
 
 
+def import_prompts(prompts: List[Tuple[str, Optional[str]]]) -> int:
+    """
+    Добавляет промты одной транзакцией, пропуская уже существующие
+    
+    Дубликаты (в базе и внутри списка) отсеиваются уникальным индексом
+    по content_hash.
+    
+    Args:
+        prompts: Пары (текст промта, теги или None)
+        
+    Returns:
+        Число добавленных промтов
+    """
+    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = [(date, prompt, tags, prompt_hash(prompt)) for prompt, tags in prompts if prompt.strip()]
+    with transaction() as cursor:
+        cursor.executemany("""
+            INSERT OR IGNORE INTO prompts (date, prompt, tags, content_hash) VALUES (?, ?, ?, ?)
+        """, rows)
+        added = cursor.rowcount
+    return added
+
+
 def get_prompts(sort_by: str = "date", order: str = "DESC") -> List[Dict]:
     """Получает список всех промтов"""
     valid_sort = {"date", "prompt", "tags"}
@@ -195,24 +738,47 @@ def get_prompts(sort_by: str = "date", order: str = "DESC") -> List[Dict]:
     if order not in valid_order:
         order = "DESC"
     
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute(f"""
         SELECT id, date, prompt, tags FROM prompts 
         ORDER BY {sort_by} {order}
     """)
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
 def search_prompts(query: str, search_in: str = "all") -> List[Dict]:
-    """Поиск промтов по тексту"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    """
+    Поиск промтов по тексту
+    
+    Через полнотекстовый индекс ищутся промты, содержащие все слова
+    запроса (слова - как префиксы), от наиболее релевантных (bm25).
+    Без индекса или если в запросе нет слов - поиск подстроки через LIKE.
     
-    if search_in == "prompt":
+    Args:
+        query: Текст для поиска
+        search_in: Где искать: "prompt", "tags" или "all"
+        
+    Returns:
+        Список промтов; при поиске по индексу у каждого есть "snippet" -
+        фрагмент промта с найденными словами между SNIPPET_START и SNIPPET_END
+    """
+    cursor = get_read_connection().cursor()
+    
+    match = build_search_query(query)
+    if match and _has_search_index(cursor, "prompts_fts"):
+        if search_in in ("prompt", "tags"):
+            match = f"{search_in} : ({match})"
+        cursor.execute("""
+            SELECT p.id, p.date, p.prompt, p.tags,
+                   snippet(prompts_fts, 0, ?, ?, '...', 24) as snippet
+            FROM prompts_fts
+            JOIN prompts p ON p.id = prompts_fts.rowid
+            WHERE prompts_fts MATCH ?
+            ORDER BY bm25(prompts_fts), p.date DESC
+        """, (SNIPPET_START, SNIPPET_END, match))
+    elif search_in == "prompt":
         cursor.execute("""
             SELECT id, date, prompt, tags FROM prompts 
             WHERE prompt LIKE ?
@@ -232,30 +798,66 @@ def search_prompts(query: str, search_in: str = "all") -> List[Dict]:
         """, (f"%{query}%", f"%{query}%"))
     
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
 def get_prompt_by_id(prompt_id: int) -> Optional[Dict]:
     """Получает промт по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("SELECT id, date, prompt, tags FROM prompts WHERE id = ?", (prompt_id,))
     row = cursor.fetchone()
-    conn.close()
     
     return dict(row) if row else None
 
 
+def get_prompt_by_text(prompt: str) -> Optional[Dict]:
+    """Получает промт с таким же нормализованным текстом, None - если его нет"""
+    cursor = get_read_connection().cursor()
+    cursor.execute("SELECT id, date, prompt, tags FROM prompts WHERE content_hash = ?",
+                   (prompt_hash(prompt),))
+    row = cursor.fetchone()
+    
+    return dict(row) if row else None
+
+
+def update_prompt(prompt_id: int, prompt: str, tags: Optional[str] = None) -> bool:
+    """
+    Изменяет текст и теги промта, сохраняя его ID и связанные результаты
+    
+    content_hash пересчитывается в той же транзакции. Если такой же
+    (после нормализации) текст уже есть у другого промта, ничего не меняется.
+    
+    Args:
+        prompt_id: ID промта
+        prompt: Новый текст промта
+        tags: Теги через запятую
+    
+    Returns:
+        True, если промт обновлен; False, если промта с таким ID нет
+    
+    Raises:
+        ValueError: Такой промт уже есть в базе под другим ID
+    """
+    content_hash = prompt_hash(prompt)
+    with transaction() as cursor:
+        cursor.execute("SELECT id FROM prompts WHERE content_hash = ? AND id != ?",
+                       (content_hash, prompt_id))
+        row = cursor.fetchone()
+        if row:
+            raise ValueError(f"Такой промт уже есть (ID {row['id']})")
+        
+        cursor.execute("UPDATE prompts SET prompt = ?, tags = ?, content_hash = ? WHERE id = ?",
+                       (prompt, tags, content_hash, prompt_id))
+        updated = cursor.rowcount > 0
+    return updated
+
+
 def delete_prompt(prompt_id: int) -> bool:
     """Удаляет промт по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM prompts WHERE id = ?", (prompt_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM prompts WHERE id = ?", (prompt_id,))
+        deleted = cursor.rowcount > 0
     return deleted
 
 
@@ -264,15 +866,12 @@ def delete_prompt(prompt_id: int) -> bool:
 def add_model(name: str, api_url: str, api_id: str, api_key_env: str, 
               model_type: str, is_active: int = 1) -> int:
     """Добавляет новую модель в базу данных"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO models (name, api_url, api_id, api_key_env, is_active, model_type)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (name, api_url, api_id, api_key_env, is_active, model_type))
-    model_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("""
+            INSERT INTO models (name, api_url, api_id, api_key_env, is_active, model_type)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (name, api_url, api_id, api_key_env, is_active, model_type))
+        model_id = cursor.lastrowid
     return model_id
 
 
@@ -286,56 +885,47 @@ def get_models(sort_by: str = "name", order: str = "ASC") -> List[Dict]:
     if order not in valid_order:
         order = "ASC"
     
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute(f"""
-        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type 
+        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type, timeout_override
         FROM models 
         ORDER BY {sort_by} {order}
     """)
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
 def get_active_models() -> List[Dict]:
     """Получает список активных моделей"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("""
-        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type 
+        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type, timeout_override
         FROM models 
         WHERE is_active = 1
         ORDER BY name
     """)
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
 def update_model_status(model_id: int, is_active: int) -> bool:
     """Обновляет статус активности модели"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE models SET is_active = ? WHERE id = ?", (is_active, model_id))
-    updated = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("UPDATE models SET is_active = ? WHERE id = ?", (is_active, model_id))
+        updated = cursor.rowcount > 0
     return updated
 
 
 def get_model_by_id(model_id: int) -> Optional[Dict]:
     """Получает модель по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("""
-        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type 
+        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type, timeout_override
         FROM models WHERE id = ?
     """, (model_id,))
     row = cursor.fetchone()
-    conn.close()
     
     return dict(row) if row else None
 
@@ -343,65 +933,267 @@ def get_model_by_id(model_id: int) -> Optional[Dict]:
 def update_model(model_id: int, name: str, api_url: str, api_id: str, 
                  api_key_env: str, model_type: str, is_active: int) -> bool:
     """Обновляет информацию о модели"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE models 
-        SET name = ?, api_url = ?, api_id = ?, api_key_env = ?, 
-            model_type = ?, is_active = ?
-        WHERE id = ?
-    """, (name, api_url, api_id, api_key_env, model_type, is_active, model_id))
-    updated = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("""
+            UPDATE models 
+            SET name = ?, api_url = ?, api_id = ?, api_key_env = ?, 
+                model_type = ?, is_active = ?
+            WHERE id = ?
+        """, (name, api_url, api_id, api_key_env, model_type, is_active, model_id))
+        updated = cursor.rowcount > 0
+    return updated
+
+
+def set_model_timeout(model_id: int, timeout: Optional[float]) -> bool:
+    """Задает ручной таймаут модели в секундах (None или 0 - рассчитывать автоматически)"""
+    with transaction() as cursor:
+        cursor.execute("UPDATE models SET timeout_override = ? WHERE id = ?",
+                       (timeout or None, model_id))
+        updated = cursor.rowcount > 0
     return updated
 
 
 def delete_model(model_id: int) -> bool:
     """Удаляет модель по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM models WHERE id = ?", (model_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM models WHERE id = ?", (model_id,))
+        deleted = cursor.rowcount > 0
+        cursor.execute("DELETE FROM model_prices WHERE model_id = ?", (model_id,))
+        cursor.execute("DELETE FROM model_latency WHERE model_id = ?", (model_id,))
     return deleted
 
 
 def search_models(query: str) -> List[Dict]:
     """Поиск моделей по названию или типу"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("""
-        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type 
+        SELECT id, name, api_url, api_id, api_key_env, is_active, model_type, timeout_override
         FROM models 
         WHERE name LIKE ? OR model_type LIKE ?
         ORDER BY name
     """, (f"%{query}%", f"%{query}%"))
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
+# ========== Сжатие ответов в таблице results ==========
+
+# Форматы хранения ответа (колонка response_format): "text" - текст как есть,
+# "zlib" и "lzma" - сжатый UTF-8 в BLOB
+COMPRESSION_METHODS = ("zlib", "lzma")
+DEFAULT_COMPRESSION = "zlib"
+# Ответы короче порога (в байтах UTF-8) хранятся без сжатия
+DEFAULT_COMPRESSION_THRESHOLD = 4096
+
+
+def encode_response(response: str, method: str = DEFAULT_COMPRESSION,
+                    threshold: int = DEFAULT_COMPRESSION_THRESHOLD) -> Tuple[object, str]:
+    """
+    Готовит ответ к записи в results.response
+    
+    Args:
+        response: Текст ответа
+        method: "zlib", "lzma" или "none" (без сжатия)
+        threshold: Сжимать ответы не короче стольких байт UTF-8
+        
+    Returns:
+        (значение для колонки response, формат для response_format); если
+        сжатие выключено, ответ короткий или не сжимается - (текст, "text")
+    """
+    data = response.encode("utf-8")
+    if method not in COMPRESSION_METHODS or len(data) < threshold:
+        return response, "text"
+    packed = zlib.compress(data, 6) if method == "zlib" else lzma.compress(data)
+    if len(packed) >= len(data):
+        return response, "text"
+    return packed, method
+
+
+def decode_response(stored, response_format: Optional[str]) -> Optional[str]:
+    """
+    Возвращает текст ответа по значению results.response и его формату
+    
+    Функция вызывается и внутри SQL (response_text), где исключение ломает
+    весь запрос, поэтому поврежденное значение (например, сжатый ответ,
+    измененный другой программой) не вызывает ошибку: текст возвращается
+    как есть, а нераспаковываемые байты - как None.
+    """
+    if response_format not in COMPRESSION_METHODS:
+        return stored
+    try:
+        data = zlib.decompress(stored) if response_format == "zlib" else lzma.decompress(stored)
+        return data.decode("utf-8")
+    except (TypeError, zlib.error, lzma.LZMAError, UnicodeDecodeError):
+        return stored if isinstance(stored, str) else None
+
+
+def _pack_result_response(response: str, method: str, threshold: int) -> Tuple:
+    """
+    Возвращает (response, response_format, response_preview, response_length) для записи
+    
+    У сжатых ответов начало текста и длина хранятся отдельно, чтобы список
+    результатов не распаковывал ответы; у несжатых они берутся из самого ответа.
+    """
+    stored, response_format = encode_response(response, method, threshold)
+    if response_format == "text":
+        return stored, response_format, None, None
+    return stored, response_format, response[:RESULT_PREVIEW_CHARS], len(response)
+
+
+def _get_compression_settings(cursor) -> Tuple[str, int]:
+    """Читает метод и порог сжатия ответов из настроек (или значения по умолчанию)"""
+    cursor.execute("""
+        SELECT key, value FROM settings
+        WHERE key IN ('response_compression', 'response_compression_threshold')
+    """)
+    values = {row["key"]: row["value"] for row in cursor.fetchall()}
+    threshold = values.get("response_compression_threshold", "")
+    return (values.get("response_compression", DEFAULT_COMPRESSION),
+            int(threshold) if threshold.isdigit() else DEFAULT_COMPRESSION_THRESHOLD)
+
+
+def _compress_results(cursor, method: str, threshold: int, batch_size: int = 200) -> Dict:
+    """
+    Сжимает несжатые ответы не короче threshold байт (постранично по id)
+    
+    Триггер удаляет прежний текст из индекса results_fts, а сжатый ответ
+    добавляется в индекс здесь же.
+    
+    Returns:
+        Словарь: rows (сжато ответов), bytes_before, bytes_after (размер этих ответов)
+    """
+    stats = {"rows": 0, "bytes_before": 0, "bytes_after": 0}
+    if method not in COMPRESSION_METHODS:
+        return stats
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, response, prompt_text FROM results
+            WHERE response_format = 'text' AND id > ?
+            ORDER BY id LIMIT ?
+        """, (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return stats
+        last_id = rows[-1]["id"]
+        updates = []
+        indexed = []
+        for row in rows:
+            packed = _pack_result_response(row["response"], method, threshold)
+            if packed[1] != "text":
+                updates.append((*packed, row["id"]))
+                indexed.append((row["id"], row["response"], row["prompt_text"]))
+                stats["bytes_before"] += len(row["response"].encode("utf-8"))
+                stats["bytes_after"] += len(packed[0])
+        cursor.executemany("""
+            UPDATE results
+            SET response = ?, response_format = ?, response_preview = ?, response_length = ?
+            WHERE id = ?
+        """, updates)
+        _index_results(cursor, indexed)
+        stats["rows"] += len(updates)
+
+
+def compress_results(method: Optional[str] = None, threshold: Optional[int] = None) -> Dict:
+    """
+    Сжимает уже сохраненные большие ответы (например, после изменения настроек)
+    
+    Файл базы при этом не уменьшается: освободившиеся страницы занимают
+    новые записи; уменьшить файл сразу можно командой VACUUM.
+    
+    Args:
+        method: "zlib" или "lzma" (None - из настройки response_compression)
+        threshold: Порог в байтах (None - из настройки response_compression_threshold)
+        
+    Returns:
+        Словарь: rows (сжато ответов), bytes_before, bytes_after
+    """
+    with transaction() as cursor:
+        default_method, default_threshold = _get_compression_settings(cursor)
+        return _compress_results(cursor, method or default_method,
+                                 threshold if threshold is not None else default_threshold)
+
+
 # ========== Функции для работы с таблицей results ==========
 
 def save_result(prompt_id: Optional[int], model_id: Optional[int], 
                 response: str, prompt_text: str) -> int:
     """Сохраняет результат в базу данных"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("""
-        INSERT INTO results (prompt_id, model_id, response, date, prompt_text)
-        VALUES (?, ?, ?, ?, ?)
-    """, (prompt_id, model_id, response, date, prompt_text))
-    result_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        packed = _pack_result_response(response, *_get_compression_settings(cursor))
+        cursor.execute("""
+            INSERT INTO results (prompt_id, model_id, response, response_format,
+                                 response_preview, response_length, date, prompt_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (prompt_id, model_id, *packed, date, prompt_text))
+        result_id = cursor.lastrowid
+        if packed[1] != "text":
+            _index_results(cursor, [(result_id, response, prompt_text)])
     return result_id
 
 
+def save_results(prompt_id: Optional[int], prompt_text: str,
+                 results: List[Dict]) -> Tuple[int, List[str]]:
+    """
+    Сохраняет несколько результатов одной транзакцией
+    
+    Модель берется по model_id, а если его нет (или модель с таким ID уже
+    удалена) - по model_name; ID и имена проверяются одним запросом.
+    Результаты моделей, которых нет в базе, не сохраняются.
+    
+    Args:
+        prompt_id: ID промта (None - промт не сохранен)
+        prompt_text: Текст промта на момент сохранения
+        results: Словари с response и model_id и/или model_name
+        
+    Returns:
+        (число сохраненных результатов, имена моделей, не найденных в базе)
+    """
+    ids = {result["model_id"] for result in results if result.get("model_id")}
+    names = {result["model_name"] for result in results if result.get("model_name")}
+    with transaction() as cursor:
+        known_ids = set()
+        ids_by_name: Dict[str, int] = {}
+        if ids or names:
+            cursor.execute(f"""
+                SELECT id, name FROM models
+                WHERE id IN ({", ".join("?" * len(ids))}) OR name IN ({", ".join("?" * len(names))})
+            """, (*ids, *names))
+            for row in cursor.fetchall():
+                known_ids.add(row["id"])
+                ids_by_name[row["name"]] = row["id"]
+        
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        method, threshold = _get_compression_settings(cursor)
+        rows = []
+        responses = []
+        missing = []
+        for result in results:
+            model_id = result.get("model_id")
+            if model_id not in known_ids:
+                model_id = ids_by_name.get(result.get("model_name"))
+            if not model_id:
+                missing.append(result.get("model_name") or "")
+                continue
+            packed = _pack_result_response(result["response"], method, threshold)
+            rows.append((prompt_id, model_id, *packed, date, prompt_text))
+            responses.append(result["response"])
+        # По строке, а не executemany: ID сжатых ответов нужны для индекса
+        indexed = []
+        for row, response in zip(rows, responses):
+            cursor.execute("""
+                INSERT INTO results (prompt_id, model_id, response, response_format,
+                                     response_preview, response_length, date, prompt_text)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, row)
+            if row[3] != "text":
+                indexed.append((cursor.lastrowid, response, prompt_text))
+        _index_results(cursor, indexed)
+    return len(rows), missing
+
+
 def get_results(sort_by: str = "date", order: str = "DESC", 
                 limit: Optional[int] = None) -> List[Dict]:
     """Получает список сохраненных результатов"""
@@ -413,16 +1205,15 @@ def get_results(sort_by: str = "date", order: str = "DESC",
     if order not in valid_order:
         order = "DESC"
     
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     
     query = f"""
-        SELECT r.id, r.prompt_id, r.model_id, r.response, r.date, r.prompt_text,
-               m.name as model_name, p.prompt as prompt_text_full
+        SELECT r.id, r.prompt_id, r.model_id, response_text(r.response, r.response_format) as response,
+               r.date, r.prompt_text, m.name as model_name, p.prompt as prompt_text_full
         FROM results r
         LEFT JOIN models m ON r.model_id = m.id
         LEFT JOIN prompts p ON r.prompt_id = p.id
-        ORDER BY r.{sort_by} {order}
+        ORDER BY {"response" if sort_by == "response" else "r." + sort_by} {order}
     """
     
     if limit:
@@ -430,91 +1221,415 @@ def get_results(sort_by: str = "date", order: str = "DESC",
     
     cursor.execute(query)
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
+# Размер страницы результатов и длина сокращенных текстов в ней (символов)
+RESULTS_PAGE_SIZE = 100
+RESULT_PREVIEW_CHARS = 300
+PROMPT_PREVIEW_CHARS = 200
+
+
+def get_results_page(after: Optional[Tuple] = None, limit: int = RESULTS_PAGE_SIZE,
+                     query: Optional[str] = None) -> Tuple[List[Dict], Optional[Tuple]]:
+    """
+    Получает страницу результатов (постраничная выборка по ключу, без OFFSET)
+    
+    Без запроса результаты идут от новых к старым по (date, id); с запросом -
+    найденные через полнотекстовый индекс, от наиболее релевантных (bm25, id).
+    Следующая страница выбирается условием "после ключа последней строки",
+    поэтому ее стоимость не растет с номером страницы. Полные тексты не
+    загружаются: ответ и промт сокращаются, полный ответ - get_result_by_id().
+    
+    Args:
+        after: Ключ, возвращенный предыдущим вызовом (None - первая страница)
+        limit: Число строк на странице
+        query: Текст для поиска (None или пустая строка - все результаты)
+        
+    Returns:
+        (строки, ключ следующей страницы или None, если страниц больше нет).
+        Строки содержат id, prompt_id, model_id, date, model_name, prompt_text
+        и response_preview (сокращенные), response_length, а при поиске по
+        индексу - snippet с найденными словами между SNIPPET_START и SNIPPET_END
+    """
+    cursor = get_read_connection().cursor()
+    columns = f"""
+        r.id, r.prompt_id, r.model_id, r.date, m.name as model_name,
+        substr(r.prompt_text, 1, {PROMPT_PREVIEW_CHARS}) as prompt_text,
+        COALESCE(r.response_preview, substr(r.response, 1, {RESULT_PREVIEW_CHARS})) as response_preview,
+        COALESCE(r.response_length, length(r.response)) as response_length
+    """
+    
+    match = build_search_query(query) if query else None
+    if match and _has_search_index(cursor, "results_fts"):
+        cursor.execute(f"""
+            SELECT * FROM (
+                SELECT {columns}, bm25(results_fts, 1.0, 0.5) as score
+                FROM results_fts
+                JOIN results r ON r.id = results_fts.rowid
+                LEFT JOIN models m ON r.model_id = m.id
+                WHERE results_fts MATCH ?
+            )
+            WHERE (score, id) > (?, ?)
+            ORDER BY score, id
+            LIMIT ?
+        """, (match, *(after or (float("-inf"), 0)), limit + 1))
+        key_columns = ("score", "id")
+        rows = [dict(row) for row in cursor.fetchall()]
+        # snippet() читает (и распаковывает) весь ответ, поэтому фрагменты
+        # строятся только для строк страницы, а не для всех совпадений
+        if rows:
+            cursor.execute(f"""
+                SELECT rowid, snippet(results_fts, 0, ?, ?, '...', 32) as snippet
+                FROM results_fts
+                WHERE results_fts MATCH ? AND rowid IN ({", ".join("?" * len(rows))})
+            """, (SNIPPET_START, SNIPPET_END, match, *(row["id"] for row in rows)))
+            snippets = {row["rowid"]: row["snippet"] for row in cursor.fetchall()}
+            for row in rows:
+                row["snippet"] = snippets.get(row["id"])
+    else:
+        conditions = []
+        params = []
+        if query:
+            conditions.append("(response_text(r.response, r.response_format) LIKE ? OR r.prompt_text LIKE ?)")
+            params += [f"%{query}%", f"%{query}%"]
+        if after:
+            conditions.append("(r.date, r.id) < (?, ?)")
+            params += list(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(f"""
+            SELECT {columns}
+            FROM results r
+            LEFT JOIN models m ON r.model_id = m.id
+            {where}
+            ORDER BY r.date DESC, r.id DESC
+            LIMIT ?
+        """, (*params, limit + 1))
+        key_columns = ("date", "id")
+        rows = [dict(row) for row in cursor.fetchall()]
+    
+    # Лишняя строка показывает, что есть следующая страница
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, tuple(rows[-1][column] for column in key_columns)
+
+
 def get_result_by_id(result_id: int) -> Optional[Dict]:
     """Получает результат по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("""
-        SELECT r.id, r.prompt_id, r.model_id, r.response, r.date, r.prompt_text,
-               m.name as model_name, p.prompt as prompt_text_full
+        SELECT r.id, r.prompt_id, r.model_id, response_text(r.response, r.response_format) as response,
+               r.date, r.prompt_text, m.name as model_name, p.prompt as prompt_text_full
         FROM results r
         LEFT JOIN models m ON r.model_id = m.id
         LEFT JOIN prompts p ON r.prompt_id = p.id
         WHERE r.id = ?
     """, (result_id,))
     row = cursor.fetchone()
-    conn.close()
     
     return dict(row) if row else None
 
 
 def search_results(query: str) -> List[Dict]:
-    """Поиск результатов по тексту"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT r.id, r.prompt_id, r.model_id, r.response, r.date, r.prompt_text,
-               m.name as model_name, p.prompt as prompt_text_full
-        FROM results r
-        LEFT JOIN models m ON r.model_id = m.id
-        LEFT JOIN prompts p ON r.prompt_id = p.id
-        WHERE r.response LIKE ? OR r.prompt_text LIKE ?
-        ORDER BY r.date DESC
-    """, (f"%{query}%", f"%{query}%"))
+    """
+    Поиск результатов по тексту ответа и промта
+    
+    Через полнотекстовый индекс ищутся результаты, содержащие все слова
+    запроса (слова - как префиксы), от наиболее релевантных (bm25;
+    совпадения в ответе весят больше, чем в промте). Без индекса или если
+    в запросе нет слов - поиск подстроки через LIKE.
+    
+    Returns:
+        Список результатов; при поиске по индексу у каждого есть "snippet" -
+        фрагмент ответа с найденными словами между SNIPPET_START и SNIPPET_END
+    """
+    cursor = get_read_connection().cursor()
+    
+    match = build_search_query(query)
+    if match and _has_search_index(cursor, "results_fts"):
+        cursor.execute("""
+            SELECT r.id, r.prompt_id, r.model_id, response_text(r.response, r.response_format) as response,
+                   r.date, r.prompt_text, m.name as model_name, p.prompt as prompt_text_full,
+                   snippet(results_fts, 0, ?, ?, '...', 32) as snippet
+            FROM results_fts
+            JOIN results r ON r.id = results_fts.rowid
+            LEFT JOIN models m ON r.model_id = m.id
+            LEFT JOIN prompts p ON r.prompt_id = p.id
+            WHERE results_fts MATCH ?
+            ORDER BY bm25(results_fts, 1.0, 0.5), r.date DESC
+        """, (SNIPPET_START, SNIPPET_END, match))
+    else:
+        cursor.execute("""
+            SELECT r.id, r.prompt_id, r.model_id, response_text(r.response, r.response_format) as response,
+                   r.date, r.prompt_text, m.name as model_name, p.prompt as prompt_text_full
+            FROM results r
+            LEFT JOIN models m ON r.model_id = m.id
+            LEFT JOIN prompts p ON r.prompt_id = p.id
+            WHERE response_text(r.response, r.response_format) LIKE ? OR r.prompt_text LIKE ?
+            ORDER BY r.date DESC
+        """, (f"%{query}%", f"%{query}%"))
     rows = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in rows]
 
 
 def delete_result(result_id: int) -> bool:
     """Удаляет результат по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM results WHERE id = ?", (result_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("SELECT response, response_format, prompt_text FROM results WHERE id = ?",
+                       (result_id,))
+        row = cursor.fetchone()
+        if row and row["response_format"] != "text":
+            # Сжатый ответ триггер из индекса не удаляет
+            _index_results(cursor, [(result_id, decode_response(row["response"], row["response_format"]),
+                                     row["prompt_text"])], delete=True)
+        cursor.execute("DELETE FROM results WHERE id = ?", (result_id,))
+        deleted = cursor.rowcount > 0
+    return deleted
+
+
+# ========== Функции для работы с таблицей response_cache ==========
+
+def get_cached_response(key: str, ttl: float) -> Optional[str]:
+    """
+    Получает ответ из кэша по ключу запроса
+    
+    Устаревшая (старше ttl секунд) запись удаляется. При попадании
+    обновляется время последнего обращения (для LRU-вытеснения).
+    """
+    with transaction() as cursor:
+        now = time.time()
+        cursor.execute("SELECT response, created_at FROM response_cache WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        
+        response = None
+        if row:
+            if now - row["created_at"] > ttl:
+                cursor.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            else:
+                cursor.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+                response = row["response"]
+    return response
+
+
+def save_cached_response(key: str, response: str, max_entries: int) -> None:
+    """Сохраняет ответ в кэш, вытесняя давно не использованные записи сверх max_entries"""
+    with transaction() as cursor:
+        now = time.time()
+        cursor.execute("""
+            INSERT OR REPLACE INTO response_cache (key, response, created_at, last_access)
+            VALUES (?, ?, ?, ?)
+        """, (key, response, now, now))
+        cursor.execute("""
+            DELETE FROM response_cache WHERE key IN (
+                SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+        """, (max(0, max_entries),))
+
+
+def clear_response_cache() -> int:
+    """Очищает кэш ответов, возвращает число удаленных записей"""
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM response_cache")
+        deleted = cursor.rowcount
     return deleted
 
 
+# ========== Функции для работы с таблицей model_latency ==========
+
+# Сколько последних замеров хранить для каждой модели
+LATENCY_HISTORY_SIZE = 200
+
+
+def add_model_latency(model_id: int, latency: float) -> None:
+    """Сохраняет время ответа модели (в секундах), удаляя замеры сверх LATENCY_HISTORY_SIZE"""
+    with transaction() as cursor:
+        cursor.execute("""
+            INSERT INTO model_latency (model_id, latency, created_at) VALUES (?, ?, ?)
+        """, (model_id, latency, time.time()))
+        cursor.execute("""
+            DELETE FROM model_latency WHERE model_id = ? AND id IN (
+                SELECT id FROM model_latency WHERE model_id = ?
+                ORDER BY id DESC LIMIT -1 OFFSET ?
+            )
+        """, (model_id, model_id, LATENCY_HISTORY_SIZE))
+
+
+def get_model_latencies(model_id: int, limit: int = LATENCY_HISTORY_SIZE) -> List[float]:
+    """Получает последние замеры времени ответа модели (в секундах), от новых к старым"""
+    cursor = get_read_connection().cursor()
+    cursor.execute("""
+        SELECT latency FROM model_latency WHERE model_id = ?
+        ORDER BY id DESC LIMIT ?
+    """, (model_id, limit))
+    rows = cursor.fetchall()
+    
+    return [row["latency"] for row in rows]
+
+
+def get_model_latency_percentile(model_id: int, percentile: float,
+                                 min_samples: int = 1) -> Optional[float]:
+    """
+    Вычисляет перцентиль времени ответа модели по истории замеров
+    
+    Args:
+        model_id: ID модели
+        percentile: Перцентиль от 0 до 100 (например, 90 для p90)
+        min_samples: Минимальное число замеров для расчета
+        
+    Returns:
+        Время в секундах или None, если замеров недостаточно
+    """
+    latencies = sorted(get_model_latencies(model_id))
+    if not latencies or len(latencies) < min_samples:
+        return None
+    # Метод ближайшего ранга
+    rank = max(1, math.ceil(percentile / 100 * len(latencies)))
+    return latencies[min(rank, len(latencies)) - 1]
+
+
+# ========== Функции для работы с таблицей request_metrics ==========
+
+def add_request_metrics(rows: List[Tuple]) -> None:
+    """
+    Сохраняет метрики запросов одной транзакцией
+    
+    Args:
+        rows: Кортежи (model_id, created_at, connect_ms, ttfb_ms, total_ms,
+              bytes_out, bytes_in, status, retries, outcome,
+              prompt_tokens, completion_tokens, cost, hedge)
+    """
+    with transaction() as cursor:
+        cursor.executemany("""
+            INSERT INTO request_metrics
+                (model_id, created_at, connect_ms, ttfb_ms, total_ms,
+                 bytes_out, bytes_in, status, retries, outcome,
+                 prompt_tokens, completion_tokens, cost, hedge)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+
+def get_request_metrics_summary(since: Optional[float] = None) -> List[Dict]:
+    """
+    Сводка метрик запросов по моделям, от самых медленных к быстрым
+    
+    Args:
+        since: Учитывать запросы начиная с этого времени (Unix time; None - все)
+        
+    Returns:
+        Список словарей: model_id, model_name, requests, errors, retries,
+        hedges (из них дублирующих запросов), avg_connect_ms, avg_ttfb_ms, avg_total_ms, max_total_ms, bytes_in, bytes_out,
+        prompt_tokens, completion_tokens, cost, tokens_per_second
+    """
+    cursor = get_read_connection().cursor()
+    cursor.execute("""
+        SELECT rm.model_id, m.name as model_name,
+               COUNT(*) as requests,
+               SUM(rm.outcome != 'ok') as errors,
+               SUM(rm.retries) as retries,
+               SUM(rm.hedge) as hedges,
+               AVG(rm.connect_ms) as avg_connect_ms,
+               AVG(rm.ttfb_ms) as avg_ttfb_ms,
+               AVG(rm.total_ms) as avg_total_ms,
+               MAX(rm.total_ms) as max_total_ms,
+               SUM(rm.bytes_in) as bytes_in,
+               SUM(rm.bytes_out) as bytes_out,
+               SUM(rm.prompt_tokens) as prompt_tokens,
+               SUM(rm.completion_tokens) as completion_tokens,
+               SUM(rm.cost) as cost,
+               SUM(rm.completion_tokens) * 1000.0 / SUM(
+                   CASE WHEN rm.completion_tokens IS NOT NULL THEN rm.total_ms END
+               ) as tokens_per_second
+        FROM request_metrics rm
+        LEFT JOIN models m ON rm.model_id = m.id
+        WHERE rm.created_at >= ?
+        GROUP BY rm.model_id
+        ORDER BY avg_total_ms DESC
+    """, (since if since is not None else 0,))
+    rows = cursor.fetchall()
+    
+    return [dict(row) for row in rows]
+
+
+def get_cost_since(timestamp: float) -> float:
+    """Сумма стоимости запросов начиная с timestamp (Unix time), в долларах"""
+    cursor = get_read_connection().cursor()
+    cursor.execute("SELECT COALESCE(SUM(cost), 0) FROM request_metrics WHERE created_at >= ?",
+                   (timestamp,))
+    total = cursor.fetchone()[0]
+    return total
+
+
+def get_avg_completion_tokens(model_id: int, limit: int = 50) -> Optional[float]:
+    """Среднее число токенов ответа модели по последним limit запросам (None - нет данных)"""
+    cursor = get_read_connection().cursor()
+    cursor.execute("""
+        SELECT AVG(completion_tokens) FROM (
+            SELECT completion_tokens FROM request_metrics
+            WHERE model_id = ? AND completion_tokens IS NOT NULL
+            ORDER BY id DESC LIMIT ?
+        )
+    """, (model_id, limit))
+    avg = cursor.fetchone()[0]
+    return avg
+
+
+def delete_request_metrics_before(timestamp: float) -> int:
+    """Удаляет метрики запросов старше timestamp (Unix time), возвращает число удаленных"""
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM request_metrics WHERE created_at < ?", (timestamp,))
+        deleted = cursor.rowcount
+    return deleted
+
+
+# ========== Функции для работы с таблицей model_prices ==========
+
+def set_model_price(model_id: int, prompt_price: float, completion_price: float) -> bool:
+    """Сохраняет цены модели в долларах за 1M токенов промта и ответа"""
+    with transaction() as cursor:
+        cursor.execute("""
+            INSERT OR REPLACE INTO model_prices (model_id, prompt_price, completion_price)
+            VALUES (?, ?, ?)
+        """, (model_id, prompt_price, completion_price))
+    return True
+
+
+def get_model_price(model_id: int) -> Optional[Dict]:
+    """Получает цены модели (prompt_price, completion_price) или None, если не заданы"""
+    cursor = get_read_connection().cursor()
+    cursor.execute("SELECT * FROM model_prices WHERE model_id = ?", (model_id,))
+    row = cursor.fetchone()
+    
+    return dict(row) if row else None
+
+
 # ========== Функции для работы с таблицей settings ==========
 
 def save_setting(key: str, value: str) -> bool:
     """Сохраняет настройку"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)
-    """, (key, value))
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("""
+            INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)
+        """, (key, value))
     return True
 
 
 def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     """Получает значение настройки"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
     row = cursor.fetchone()
-    conn.close()
     
     return row["value"] if row else default
 
 
 def get_all_settings() -> Dict[str, str]:
     """Получает все настройки"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    cursor = get_read_connection().cursor()
     cursor.execute("SELECT key, value FROM settings")
     rows = cursor.fetchall()
-    conn.close()
     
     return {row["key"]: row["value"] for row in rows}
 
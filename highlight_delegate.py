@@ -0,0 +1,58 @@
+"""
+Отображение фрагментов поиска с выделенными словами в таблицах
+"""
+import html
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionViewItem, QStyle, QApplication
+from PyQt5.QtGui import QTextDocument, QAbstractTextDocumentLayout, QPalette
+from PyQt5.QtCore import QSize
+from db import SNIPPET_START, SNIPPET_END
+
+
+def snippet_to_html(snippet: str) -> str:
+    """Переводит фрагмент из db.search_* в HTML с подсвеченными найденными словами"""
+    text = html.escape(snippet).replace("\n", "<br>")
+    return (text.replace(SNIPPET_START, '<span style="background-color: #ffe57f; font-weight: bold;">')
+                .replace(SNIPPET_END, "</span>"))
+
+
+class HighlightDelegate(QStyledItemDelegate):
+    """Рисует ячейки с маркерами SNIPPET_START/SNIPPET_END как HTML, остальные - как обычно"""
+    
+    def make_document(self, option, index):
+        """Возвращает (настройки ячейки, документ с HTML) или (None, None) для обычной ячейки"""
+        text = index.data()
+        if not isinstance(text, str) or SNIPPET_START not in text:
+            return None, None
+        options = QStyleOptionViewItem(option)
+        self.initStyleOption(options, index)
+        document = QTextDocument()
+        document.setDefaultFont(options.font)
+        document.setHtml(snippet_to_html(text))
+        document.setTextWidth(options.rect.width())
+        return options, document
+    
+    def paint(self, painter, option, index):
+        options, document = self.make_document(option, index)
+        if document is None:
+            super().paint(painter, option, index)
+            return
+        
+        # Фон и выделение строки рисует стиль, текст - документ
+        options.text = ""
+        style = options.widget.style() if options.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, options, painter, options.widget)
+        
+        context = QAbstractTextDocumentLayout.PaintContext()
+        if options.state & QStyle.State_Selected:
+            context.palette.setColor(QPalette.Text, options.palette.color(QPalette.HighlightedText))
+        painter.save()
+        painter.translate(options.rect.topLeft())
+        painter.setClipRect(options.rect.translated(-options.rect.topLeft()))
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+    
+    def sizeHint(self, option, index):
+        options, document = self.make_document(option, index)
+        if document is None:
+            return super().sizeHint(option, index)
+        return QSize(int(document.idealWidth()), int(document.size().height()))
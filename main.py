@@ -3,21 +3,24 @@
 Графический интерфейс для сравнения ответов нейросетей
 """
 import sys
+import time
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QTextEdit, QTableWidget, QTableWidgetItem, QComboBox,
     QLabel, QCheckBox, QMessageBox, QHeaderView, QLineEdit, QDialog,
-    QDialogButtonBox, QFormLayout, QMenuBar, QFileDialog
+    QDialogButtonBox, QFormLayout, QMenuBar, QFileDialog, QSpinBox
 )
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QFont, QIcon
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
 import db
 import models
+import network
 import export
 from models_dialog import ModelsDialog
 from prompts_dialog import PromptsDialog
 from results_dialog import ResultsDialog
+from stats_dialog import StatsDialog
 from markdown_viewer import MarkdownViewerDialog
 from prompt_improver import improve_prompt
 from prompt_improver_dialog import PromptImproverDialog
@@ -29,16 +32,46 @@ from version import __version__
 class WorkerThread(QThread):
     """Поток для выполнения запросов к API в фоновом режиме"""
     finished = pyqtSignal(list)
+    result_ready = pyqtSignal(object)
+    delta_received = pyqtSignal(str, str)
     error = pyqtSignal(str)
     
-    def __init__(self, prompt: str):
+    def __init__(self, prompt: str, stream: bool = False, use_cache: bool = True,
+                 first_n: int = 0, finish_rest: bool = False):
         super().__init__()
         self.prompt = prompt
+        self.stream = stream
+        self.use_cache = use_cache
+        self.first_n = first_n
+        self.finish_rest = finish_rest
+        self.cancel_token = models.CancelToken()
+    
+    def cancel(self):
+        """Отменяет запуск: обрывает отправленные запросы и не отправляет остальные"""
+        self.cancel_token.cancel()
+    
+    def is_cancelled(self) -> bool:
+        return self.cancel_token.cancelled
+    
+    def on_delta(self, model_name: str, delta: str):
+        # Прерванные запросы могут успеть прислать фрагмент уже после отмены
+        if not self.cancel_token.cancelled:
+            self.delta_received.emit(model_name, delta)
     
     def run(self):
         """Выполняет запросы к моделям"""
         try:
-            results = models.send_prompt_to_models(self.prompt)
+            results = models.send_prompt_to_models(
+                self.prompt,
+                concurrent=True,
+                on_result=self.result_ready.emit,
+                stream=self.stream,
+                on_delta=self.on_delta,
+                use_cache=self.use_cache,
+                cancel=self.cancel_token,
+                first_n=self.first_n,
+                finish_rest=self.finish_rest
+            )
             self.finished.emit(results)
         except Exception as e:
             self.error.emit(str(e))
@@ -63,6 +96,20 @@ class ImprovePromptThread(QThread):
             self.error.emit(str(e))
 
 
+class PrewarmThread(QThread):
+    """Поток для подготовки соединений к хостам активных моделей при запуске"""
+    finished = pyqtSignal(dict)
+    
+    def run(self):
+        """Открывает соединения (ошибки не мешают работе - запросы откроют их сами)"""
+        try:
+            api_urls = [model["api_url"] for model in db.get_active_models()]
+            self.finished.emit(network.prewarm_connections(api_urls))
+        except Exception as e:
+            network.logger.warning(f"Не удалось подготовить соединения: {e}")
+            self.finished.emit({})
+
+
 class SavePromptDialog(QDialog):
     """Диалог для сохранения промта"""
     def __init__(self, prompt_text: str, parent=None):
@@ -115,13 +162,44 @@ class MainWindow(QMainWindow):
         
         # Поток для выполнения запросов
         self.worker_thread: Optional[WorkerThread] = None
+        # Строки таблицы, в которые сейчас приходят потоковые ответы (имя модели -> строка)
+        self.streaming_rows: Dict[str, int] = {}
+        # Модели, у которых уже есть окончательный результат (их фрагменты больше не принимаются)
+        self.finished_models: Set[str] = set()
+        # Принимать ли фрагменты: после завершения запуска - только в режиме "Дописывать остальные"
+        self.accept_deltas = False
+        self.received_count = 0
+        self.run_started_at = 0.0
+        self.first_token_info = ""
         # Поток для улучшения промта
         self.improve_thread: Optional[ImprovePromptThread] = None
+        # Поток подготовки соединений к хостам моделей
+        self.prewarm_thread: Optional[PrewarmThread] = None
         
         self.init_ui()
         self.load_prompts()
         self.create_menu()
         self.apply_settings()
+        self.start_prewarm()
+    
+    def start_prewarm(self):
+        """Открывает соединения к хостам активных моделей в фоне, не задерживая запуск"""
+        if db.get_setting("prewarm_connections", "1") != "1":
+            return
+        self.prewarm_thread = PrewarmThread()
+        self.prewarm_thread.finished.connect(self.on_prewarm_finished)
+        self.prewarm_thread.start()
+    
+    def on_prewarm_finished(self, stats: Dict):
+        """Показывает в строке состояния, сколько времени сэкономит первый запрос"""
+        warmed = {host: info for host, info in stats.items() if info.get("connections")}
+        if not warmed:
+            return
+        saved_ms = max(info["connect_ms"] for info in warmed.values())
+        self.statusBar().showMessage(
+            f"Соединения подготовлены: хостов {len(warmed)}, "
+            f"первый запрос быстрее примерно на {saved_ms:.0f} мс", 10000
+        )
     
     def create_menu(self):
         """Создает меню приложения"""
@@ -139,6 +217,9 @@ class MainWindow(QMainWindow):
         results_action = manage_menu.addAction("Результаты...")
         results_action.triggered.connect(self.on_view_results)
         
+        stats_action = manage_menu.addAction("Статистика моделей...")
+        stats_action.triggered.connect(self.on_view_stats)
+        
         # Меню "Экспорт"
         export_menu = menubar.addMenu("Экспорт")
         
@@ -224,11 +305,39 @@ class MainWindow(QMainWindow):
         prompt_layout.addWidget(self.prompt_edit)
         
         # Кнопка "Отправить запрос"
+        send_layout = QHBoxLayout()
         self.send_btn = QPushButton("Отправить запрос")
         self.send_btn.setFont(QFont("Arial", 10, QFont.Bold))
         self.send_btn.clicked.connect(self.on_send_request)
         self.send_btn.setMinimumHeight(40)
-        prompt_layout.addWidget(self.send_btn)
+        send_layout.addWidget(self.send_btn)
+        
+        # Кнопка "Отменить" - прерывает выполняющийся запуск
+        self.cancel_btn = QPushButton("Отменить")
+        self.cancel_btn.clicked.connect(self.on_cancel_request)
+        self.cancel_btn.setMinimumHeight(40)
+        self.cancel_btn.setEnabled(False)
+        send_layout.addWidget(self.cancel_btn)
+        
+        # Флажок "Без кэша" - отправить запросы, не используя сохраненные ответы
+        self.bypass_cache_check = QCheckBox("Без кэша")
+        self.bypass_cache_check.setToolTip("Не брать ответы из кэша для этого запуска")
+        send_layout.addWidget(self.bypass_cache_check)
+        
+        # Режим "первые N": вернуть результаты после N успешных ответов
+        send_layout.addWidget(QLabel("Первые ответы:"))
+        self.first_n_spin = QSpinBox()
+        self.first_n_spin.setRange(0, 100)
+        self.first_n_spin.setSpecialValueText("все")
+        self.first_n_spin.setToolTip("Закончить запуск после стольких успешных ответов (0 - ждать все модели)")
+        send_layout.addWidget(self.first_n_spin)
+        
+        self.finish_rest_check = QCheckBox("Дописывать остальные")
+        self.finish_rest_check.setToolTip(
+            "Не отменять оставшиеся запросы: их ответы добавятся в таблицу позже"
+        )
+        send_layout.addWidget(self.finish_rest_check)
+        prompt_layout.addLayout(send_layout)
         
         main_layout.addWidget(prompt_group)
         
@@ -320,7 +429,11 @@ class MainWindow(QMainWindow):
         dialog = SavePromptDialog(prompt_text, self)
         if dialog.exec_() == QDialog.Accepted:
             tags = dialog.get_tags().strip()
-            db.add_prompt(prompt_text, tags if tags else None)
+            try:
+                db.add_prompt(prompt_text, tags if tags else None)
+            except ValueError as e:
+                QMessageBox.warning(self, "Предупреждение", f"Промт не сохранен: {e}")
+                return
             self.load_prompts()
             QMessageBox.information(self, "Успех", "Промт сохранен")
     
@@ -348,40 +461,144 @@ class MainWindow(QMainWindow):
         self.temp_results = []
         self.results_table.setRowCount(0)
         self.save_results_btn.setEnabled(False)
+        self.streaming_rows = {}
+        self.finished_models = set()
+        self.accept_deltas = True
+        self.received_count = 0
+        self.run_started_at = time.monotonic()
+        self.first_token_info = ""
         
         # Блокируем кнопку отправки
         self.send_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(True)
         self.loading_label.show()
         
         # Создаем и запускаем поток для выполнения запросов
-        self.worker_thread = WorkerThread(prompt_text)
+        stream = db.get_setting("stream_responses", "1") == "1"
+        use_cache = not self.bypass_cache_check.isChecked()
+        self.worker_thread = WorkerThread(prompt_text, stream=stream, use_cache=use_cache,
+                                          first_n=self.first_n_spin.value(),
+                                          finish_rest=self.finish_rest_check.isChecked())
+        self.worker_thread.result_ready.connect(self.on_result_received)
+        self.worker_thread.delta_received.connect(self.on_delta_received)
         self.worker_thread.finished.connect(self.on_requests_finished)
         self.worker_thread.error.connect(self.on_requests_error)
         self.worker_thread.start()
     
+    def on_cancel_request(self):
+        """Обработчик кнопки 'Отменить' (полученные ответы остаются в таблице)"""
+        if self.worker_thread is None or not self.worker_thread.isRunning():
+            return
+        self.worker_thread.cancel()
+        self.cancel_btn.setEnabled(False)
+        self.loading_label.setText("Отмена запросов...")
+    
+    def on_delta_received(self, model_name: str, delta: str):
+        """Обработчик фрагмента потокового ответа (дописывает текст в строку модели)"""
+        if self.sender() is not self.worker_thread:
+            # Запоздавший фрагмент предыдущего запуска
+            return
+        if not self.accept_deltas or model_name in self.finished_models:
+            # Фрагмент прерванного запроса: у модели уже есть результат (например,
+            # ошибка таймаута) или запуск завершен - строку не заводим
+            return
+        if not self.first_token_info:
+            elapsed = time.monotonic() - self.run_started_at
+            self.first_token_info = f"первый фрагмент: {model_name} через {elapsed:.2f} с"
+            self.update_loading_label()
+        
+        row = self.streaming_rows.get(model_name)
+        if row is None:
+            # Первый фрагмент от модели - заводим для нее строку
+            self.temp_results.append({"model_name": model_name, "response": "", "selected": False})
+            row = len(self.temp_results) - 1
+            self.streaming_rows[model_name] = row
+            self.results_table.setRowCount(len(self.temp_results))
+            self.add_result_row(row, self.temp_results[row])
+        
+        result = self.temp_results[row]
+        result["response"] += delta
+        response_item = self.results_table.item(row, 2)
+        if response_item:
+            response_item.setText(result["response"])
+    
+    def on_result_received(self, result: models.ModelResult):
+        """Обработчик очередного ответа модели (добавляет строку в таблицу)"""
+        if self.sender() is not self.worker_thread:
+            # Запоздавший ответ предыдущего запуска (режим "Дописывать остальные")
+            return
+        self.finished_models.add(result.model_name)
+        row = self.streaming_rows.pop(result.model_name, None)
+        if row is None:
+            self.temp_results.append(result.to_dict())
+            row = len(self.temp_results) - 1
+            self.results_table.setRowCount(len(self.temp_results))
+        else:
+            # Строка уже создана потоковым ответом - заменяем текст окончательным
+            self.temp_results[row] = result.to_dict()
+        self.add_result_row(row, self.temp_results[row])
+        self.export_btn.setEnabled(True)
+        self.received_count += 1
+        self.update_loading_label()
+    
+    def update_loading_label(self):
+        """Показывает ход выполнения запросов в индикаторе загрузки"""
+        if self.worker_thread is not None and self.worker_thread.is_cancelled():
+            return
+        text = f"Отправка запросов... получено ответов: {self.received_count}"
+        if self.first_token_info:
+            text += f" ({self.first_token_info})"
+        self.loading_label.setText(text)
+    
     def on_requests_finished(self, results: List[models.ModelResult]):
         """Обработчик завершения запросов"""
         self.loading_label.hide()
+        self.loading_label.setText("Отправка запросов...")
         self.send_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
+        
+        worker = self.worker_thread
+        cancelled = worker is not None and worker.is_cancelled()
+        # В режиме "Дописывать остальные" ответы оставшихся моделей еще придут
+        finishing = worker is not None and worker.first_n > 0 and worker.finish_rest and not cancelled
+        self.accept_deltas = finishing
+        
+        if self.streaming_rows and not finishing:
+            # Недописанные потоковые ответы прерванных запросов убираем из таблицы
+            incomplete = set(self.streaming_rows.values())
+            self.temp_results = [result for row, result in enumerate(self.temp_results)
+                                 if row not in incomplete]
+            self.streaming_rows = {}
+            self.update_results_table()
+        
+        if cancelled:
+            if results:
+                self.save_results_btn.setEnabled(True)
+                self.export_btn.setEnabled(True)
+            usage_text = self.format_usage(models.summarize_usage(results))
+            usage_text = f"\n\nРасход запуска: {usage_text}" if usage_text else ""
+            QMessageBox.information(self, "Запуск отменен",
+                                    f"Получено ответов до отмены: {len(results)}" + usage_text)
+            return
         
-        # Сохраняем результаты во временную таблицу
-        self.temp_results = [result.to_dict() for result in results]
-        
-        # Обновляем таблицу
-        self.update_results_table()
-        
+        # Строки уже добавлены по мере получения ответов в on_result_received
         if results:
             self.save_results_btn.setEnabled(True)
             self.export_btn.setEnabled(True)
             success_count = sum(1 for r in results if "Ошибка" not in r.response)
+            usage_text = self.format_usage(models.summarize_usage(results))
+            usage_text = f"\n\nРасход запуска: {usage_text}" if usage_text else ""
+            if finishing:
+                usage_text += "\n\nОтветы остальных моделей будут добавлены по мере получения."
             if success_count < len(results):
                 QMessageBox.warning(
                     self, "Частичный успех", 
                     f"Получено ответов: {success_count} из {len(results)}. "
-                    "Некоторые модели вернули ошибки."
+                    "Некоторые модели вернули ошибки." + usage_text
                 )
             else:
-                QMessageBox.information(self, "Готово", f"Получено ответов: {len(results)}")
+                QMessageBox.information(self, "Готово",
+                                        f"Получено ответов: {len(results)}" + usage_text)
         else:
             QMessageBox.warning(self, "Предупреждение", "Не получено ни одного ответа")
     
@@ -389,6 +606,7 @@ class MainWindow(QMainWindow):
         """Обработчик ошибки при выполнении запросов"""
         self.loading_label.hide()
         self.send_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
         QMessageBox.critical(self, "Ошибка", f"Ошибка при отправке запросов: {error_msg}")
     
     def update_results_table(self):
@@ -396,54 +614,71 @@ class MainWindow(QMainWindow):
         self.results_table.setRowCount(len(self.temp_results))
         
         for row, result in enumerate(self.temp_results):
-            # Чекбокс
-            checkbox = QCheckBox()
-            is_selected = result.get("selected", False)
-            checkbox.setChecked(is_selected)
-            # Используем замыкание для правильного захвата переменных
-            def make_checkbox_handler(r, res):
-                def handler(state):
-                    res["selected"] = (state == Qt.Checked)
-                return handler
-            checkbox.stateChanged.connect(make_checkbox_handler(row, result))
-            self.results_table.setCellWidget(row, 0, checkbox)
-            
-            # Название модели
-            model_item = QTableWidgetItem(result.get("model_name", "Unknown"))
-            model_item.setFlags(model_item.flags() & ~Qt.ItemIsEditable)
-            self.results_table.setItem(row, 1, model_item)
-            
-            # Ответ
-            response_item = QTableWidgetItem(result.get("response", ""))
-            response_item.setFlags(response_item.flags() & ~Qt.ItemIsEditable)
-            response_item.setTextAlignment(Qt.AlignTop | Qt.AlignLeft)
-            # Включаем перенос текста для многострочного отображения
-            response_text = result.get("response", "")
-            response_item.setData(Qt.UserRole, response_text)  # Сохраняем полный текст
-            response_item.setToolTip(response_text)  # Полный текст в подсказке при наведении
-            self.results_table.setItem(row, 2, response_item)
-            
-            # Кнопка "Открыть" для просмотра в markdown
-            open_btn = QPushButton("Открыть")
-            open_btn.clicked.connect(lambda checked, r=row: self.on_open_response(r))
-            self.results_table.setCellWidget(row, 3, open_btn)
+            self.add_result_row(row, result)
+    
+    def add_result_row(self, row: int, result: Dict):
+        """Заполняет строку таблицы результатов"""
+        # Чекбокс
+        checkbox = QCheckBox()
+        is_selected = result.get("selected", False)
+        checkbox.setChecked(is_selected)
+        # Используем замыкание для правильного захвата переменных
+        def make_checkbox_handler(r, res):
+            def handler(state):
+                res["selected"] = (state == Qt.Checked)
+            return handler
+        checkbox.stateChanged.connect(make_checkbox_handler(row, result))
+        self.results_table.setCellWidget(row, 0, checkbox)
+        
+        # Название модели и расход токенов
+        model_text = result.get("model_name", "Unknown")
+        usage_text = self.format_usage(result)
+        if usage_text:
+            model_text += "\n" + usage_text
+        model_item = QTableWidgetItem(model_text)
+        model_item.setFlags(model_item.flags() & ~Qt.ItemIsEditable)
+        self.results_table.setItem(row, 1, model_item)
+        
+        # Ответ
+        response_item = QTableWidgetItem(result.get("response", ""))
+        response_item.setFlags(response_item.flags() & ~Qt.ItemIsEditable)
+        response_item.setTextAlignment(Qt.AlignTop | Qt.AlignLeft)
+        # Включаем перенос текста для многострочного отображения
+        response_text = result.get("response", "")
+        response_item.setData(Qt.UserRole, response_text)  # Сохраняем полный текст
+        response_item.setToolTip(response_text)  # Полный текст в подсказке при наведении
+        self.results_table.setItem(row, 2, response_item)
+        
+        # Кнопка "Открыть" для просмотра в markdown
+        open_btn = QPushButton("Открыть")
+        open_btn.clicked.connect(lambda checked, r=row: self.on_open_response(r))
+        self.results_table.setCellWidget(row, 3, open_btn)
         
         # Настраиваем ширину колонок
         self.results_table.resizeColumnToContents(0)  # Чекбокс
         self.results_table.resizeColumnToContents(1)  # Название модели
         # Колонка с ответом уже настроена на Stretch
         
-        # Автоматически подстраиваем высоту строк с учетом многострочного текста
-        self.results_table.resizeRowsToContents()
+        # Автоматически подстраиваем высоту строки с учетом многострочного текста
+        self.results_table.resizeRowToContents(row)
         
-        # Устанавливаем минимальную высоту строк для лучшей читаемости длинных ответов
-        for row in range(self.results_table.rowCount()):
-            current_height = self.results_table.rowHeight(row)
-            # Минимальная высота 150px для комфортного чтения, но если текст длиннее - увеличиваем
-            min_height = max(150, current_height)
-            # Максимальная высота 500px, чтобы не было слишком длинных строк
-            max_height = min(500, min_height)
-            self.results_table.setRowHeight(row, max_height)
+        # Минимальная высота 150px для комфортного чтения, но если текст длиннее - увеличиваем
+        min_height = max(150, self.results_table.rowHeight(row))
+        # Максимальная высота 500px, чтобы не было слишком длинных строк
+        self.results_table.setRowHeight(row, min(500, min_height))
+    
+    def format_usage(self, usage: Dict) -> str:
+        """Формирует строку о расходе токенов, скорости и стоимости (пустую, если данных нет)"""
+        parts = []
+        if usage.get("completion_tokens"):
+            parts.append(f"{usage.get('prompt_tokens') or 0} + {usage['completion_tokens']} ток.")
+        if usage.get("tokens_per_second"):
+            parts.append(f"{usage['tokens_per_second']:.1f} ток/с")
+        if usage.get("cost") is not None:
+            parts.append(f"${usage['cost']:.4f}")
+        if usage.get("hedges"):
+            parts.append(f"дублей: {usage['hedges']}")
+        return ", ".join(parts)
     
     def on_checkbox_changed(self, row: int, state: int, result: Dict = None):
         """Обработчик изменения состояния чекбокса"""
@@ -473,53 +708,31 @@ class MainWindow(QMainWindow):
         # Получаем текст промта
         prompt_text = self.prompt_edit.toPlainText().strip()
         
-        # Сохраняем промт, если его еще нет в БД
+        # Сохраняем промт, если его еще нет в БД (иначе берем ID существующего)
         prompt_id = None
         if prompt_text:
-            # Проверяем, есть ли уже такой промт
-            existing_prompts = db.search_prompts(prompt_text, "prompt")
-            if existing_prompts:
-                prompt_id = existing_prompts[0]["id"]
-            else:
-                try:
-                    prompt_id = db.add_prompt(prompt_text)
-                except Exception as e:
-                    QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить промт: {e}")
-                    return
+            try:
+                prompt_id = db.upsert_prompt(prompt_text)
+            except Exception as e:
+                QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить промт: {e}")
+                return
         
-        # Сохраняем каждый выбранный результат
-        saved_count = 0
+        # Сохраняем выбранные результаты одной транзакцией (ID модели приходит
+        # вместе с результатом, по имени ищутся только строки без него)
         errors = []
+        to_save = []
         for result in selected_results:
-            model_name = result.get("model_name", "")
-            response_text = result.get("response", "")
-            
-            if not response_text:
-                errors.append(f"Пустой ответ от модели {model_name}")
-                continue
-            
-            # Находим ID модели по имени
-            all_models = db.get_models()
-            model_id = None
-            for model in all_models:
-                if model["name"] == model_name:
-                    model_id = model["id"]
-                    break
-            
-            if not model_id:
-                errors.append(f"Модель '{model_name}' не найдена в базе данных")
-                continue
-            
-            try:
-                db.save_result(
-                    prompt_id=prompt_id,
-                    model_id=model_id,
-                    response=response_text,
-                    prompt_text=prompt_text
-                )
-                saved_count += 1
-            except Exception as e:
-                errors.append(f"Ошибка при сохранении результата от {model_name}: {e}")
+            if result.get("response"):
+                to_save.append(result)
+            else:
+                errors.append(f"Пустой ответ от модели {result.get('model_name', '')}")
+        
+        saved_count = 0
+        try:
+            saved_count, missing = db.save_results(prompt_id, prompt_text, to_save)
+            errors.extend(f"Модель '{name}' не найдена в базе данных" for name in missing)
+        except Exception as e:
+            errors.append(f"Ошибка при сохранении результатов: {e}")
         
         # Очищаем временную таблицу
         self.temp_results = []
@@ -559,6 +772,14 @@ class MainWindow(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось открыть диалог результатов: {e}")
     
+    def on_view_stats(self):
+        """Открывает диалог статистики моделей"""
+        try:
+            dialog = StatsDialog(self)
+            dialog.exec_()
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось открыть статистику моделей: {e}")
+    
     def on_export(self, format_type: str):
         """Экспорт текущих результатов в файл"""
         if not self.temp_results:
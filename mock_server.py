@@ -0,0 +1,417 @@
+"""
+Локальный OpenAI-совместимый сервер для нагрузочного тестирования
+
+Отвечает на POST .../chat/completions обычным JSON или потоком SSE
+(при "stream": true) и умеет имитировать проблемы реальных провайдеров:
+  - задержку ответа с заданным распределением
+  - ошибки 429 (с Retry-After), 500 и HTML-страницы вместо JSON
+  - медленную отдачу тела ответа ("по капле")
+  - большие ответы
+
+Параметры задаются при запуске и могут переопределяться для отдельной
+модели через ее API ID: "mock?latency=lognormal:0.5:1&rate_429=0.2"
+(все, что после "?", - параметры MockConfig). Так в одной базе можно
+завести быстрые, медленные и "сбоящие" модели на одном сервере.
+
+GET /stats возвращает счетчики запросов и соединений в JSON,
+POST /stats/reset обнуляет их.
+
+Запуск:
+    python mock_server.py [--port 8800] [--latency lognormal:0.5:0.8]
+                          [--rate-429 0.1] [--rate-500 0.05] [--rate-html 0.02]
+                          [--drip-delay 0.05] [--response-size 2000] [--seed 1]
+
+В коде:
+    with MockServer(MockConfig(latency="0.2")) as server:
+        send_request({... "api_url": server.url ...}, "ping")
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qsl
+
+
+HTML_ERROR_PAGE = (
+    "<!DOCTYPE html><html><head><title>502 Bad Gateway</title></head>"
+    "<body><h1>Bad Gateway</h1><p>The proxy server received an invalid response.</p>"
+    "</body></html>"
+)
+
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit")
+
+
+class LatencyDistribution:
+    """
+    Распределение задержки ответа, задается строкой:
+      "0.2"                 - всегда 0.2 с
+      "uniform:0.1:0.5"     - равномерно от 0.1 до 0.5 с
+      "normal:0.5:0.1"      - нормальное (среднее, отклонение), не меньше 0
+      "lognormal:0.5:1.0"   - логнормальное (медиана, sigma): длинный хвост, как у
+                              бесплатных моделей, у которых p99 в разы больше медианы
+      "exp:0.3"             - экспоненциальное со средним 0.3 с
+    """
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "exp")
+    
+    def __init__(self, spec: str):
+        parts = str(spec).split(":")
+        if parts[0] in self.KINDS:
+            self.kind, args = parts[0], [float(p) for p in parts[1:]]
+        else:
+            self.kind, args = "fixed", [float(parts[0])]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}[self.kind]
+        if len(args) != expected:
+            raise ValueError(f"Распределение {self.kind} ожидает {expected} параметра(ов): {spec}")
+        self.spec = spec
+        self.args = args
+    
+    def sample(self, rng: random.Random) -> float:
+        """Возвращает случайную задержку в секундах"""
+        a = self.args
+        if self.kind == "uniform":
+            value = rng.uniform(a[0], a[1])
+        elif self.kind == "normal":
+            value = rng.gauss(a[0], a[1])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(a[0]), a[1]) if a[0] > 0 else 0.0
+        elif self.kind == "exp":
+            value = rng.expovariate(1 / a[0]) if a[0] > 0 else 0.0
+        else:
+            value = a[0]
+        return max(0.0, value)
+
+
+class MockConfig:
+    """Поведение сервера (доли ошибок - вероятности от 0 до 1)"""
+    # Параметр: (тип, значение по умолчанию)
+    FIELDS = {
+        "latency": (str, "0"),          # задержка до заголовков ответа (LatencyDistribution)
+        "rate_429": (float, 0.0),       # доля ответов 429 Too Many Requests
+        "rate_500": (float, 0.0),       # доля ответов 500 Internal Server Error
+        "rate_html": (float, 0.0),      # доля HTML-страниц вместо JSON (как от прокси)
+        "retry_after": (float, 1.0),    # значение Retry-After в ответах 429, с
+        "drip_delay": (float, 0.0),     # пауза между фрагментами тела ответа, с
+        "drip_chunks": (int, 10),       # на сколько фрагментов делить обычный ответ при drip_delay
+        "response_size": (int, 200),    # длина текста ответа в символах
+        "stream_chunk_size": (int, 20), # символов в одном SSE-фрагменте
+    }
+    
+    def __init__(self, **kwargs):
+        for name, (_, default) in self.FIELDS.items():
+            setattr(self, name, kwargs.pop(name, default))
+        if kwargs:
+            raise TypeError(f"Неизвестные параметры: {', '.join(kwargs)}")
+        LatencyDistribution(self.latency)
+    
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    def with_overrides(self, query: str) -> "MockConfig":
+        """Возвращает копию с параметрами из строки вида "latency=1&rate_429=0.5" """
+        values = self.to_dict()
+        for key, value in parse_qsl(query):
+            if key in self.FIELDS:
+                values[key] = self.FIELDS[key][0](value)
+        return MockConfig(**values)
+
+
+class MockStats:
+    """Счетчики сервера (потокобезопасные)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.data = {"connections": 0, "requests": 0, "stream_requests": 0,
+                         "ok": 0, "429": 0, "500": 0, "html": 0, "bytes_out": 0,
+                         "stream_aborted": 0}
+    
+    def add(self, key: str, value: int = 1):
+        with self._lock:
+            self.data[key] += value
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.data)
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    """HTTP-сервер с конфигурацией, генератором случайных чисел и счетчиками"""
+    daemon_threads = True
+    
+    def __init__(self, address, config: MockConfig, seed: Optional[int] = None):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stats = MockStats()
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+    
+    def process_request(self, request, client_address):
+        self.stats.add("connections")
+        super().process_request(request, client_address)
+    
+    def handle_error(self, request, client_address):
+        # Клиент закрыл keep-alive соединение или прервал ответ - это не ошибка сервера
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+    
+    def random(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+    
+    def sample_latency(self, distribution: LatencyDistribution) -> float:
+        with self.rng_lock:
+            return distribution.sample(self.rng)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Обработчик /chat/completions и /stats"""
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят отдельными send(): без TCP_NODELAY небольшие
+    # ответы ждут delayed ACK клиента (~40 мс)
+    disable_nagle_algorithm = True
+    server: MockHTTPServer
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(200, self.server.stats.snapshot(), count=False)
+        else:
+            self.send_json(404, {"error": {"message": "Not found"}}, count=False)
+    
+    def do_HEAD(self):
+        # Как у реальных API: пустой ответ без закрытия соединения
+        # (network.prewarm_connections открывает так соединения заранее)
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        
+        if self.path.rstrip("/") == "/stats/reset":
+            self.server.stats.reset()
+            self.send_json(200, {"ok": True}, count=False)
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found"}}, count=False)
+            return
+        
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+        
+        model = str(body.get("model", "mock"))
+        config = self.server.config
+        if "?" in model:
+            try:
+                config = config.with_overrides(model.split("?", 1)[1])
+            except ValueError as e:
+                self.send_json(400, {"error": {"message": f"Invalid mock parameters: {e}"}})
+                return
+        
+        stream = bool(body.get("stream"))
+        self.server.stats.add("requests")
+        if stream:
+            self.server.stats.add("stream_requests")
+        
+        time.sleep(self.server.sample_latency(LatencyDistribution(config.latency)))
+        
+        # Ошибки выбираются по очереди по одному случайному числу
+        roll = self.server.random()
+        if roll < config.rate_429:
+            self.server.stats.add("429")
+            self.send_json(429, {"error": {"message": "Rate limit exceeded", "code": 429}},
+                           headers={"Retry-After": f"{config.retry_after:g}"})
+            return
+        roll -= config.rate_429
+        if roll < config.rate_500:
+            self.server.stats.add("500")
+            self.send_json(500, {"error": {"message": "Internal server error"}})
+            return
+        roll -= config.rate_500
+        if roll < config.rate_html:
+            self.server.stats.add("html")
+            self.send_body(200, HTML_ERROR_PAGE.encode("utf-8"), "text/html; charset=utf-8",
+                           config)
+            return
+        
+        self.server.stats.add("ok")
+        text = self.make_text(config.response_size)
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        usage = {"prompt_tokens": max(1, len(prompt) // 4),
+                 "completion_tokens": max(1, len(text) // 4)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        
+        if stream:
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            self.send_stream(model, text, usage if include_usage else None, config)
+        else:
+            self.send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }, config=config)
+    
+    def make_text(self, size: int) -> str:
+        """Текст ответа заданной длины"""
+        words = []
+        length = 0
+        while length < size:
+            word = WORDS[len(words) % len(WORDS)]
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:size]
+    
+    def send_json(self, status: int, data: Dict, headers: Optional[Dict] = None,
+                  config: Optional[MockConfig] = None, count: bool = True):
+        self.send_body(status, json.dumps(data).encode("utf-8"), "application/json",
+                       config, headers, count)
+    
+    def send_body(self, status: int, body: bytes, content_type: str,
+                  config: Optional[MockConfig] = None, headers: Optional[Dict] = None,
+                  count: bool = True):
+        """Отправляет тело целиком или по частям с паузами (drip_delay)"""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if count:
+            self.server.stats.add("bytes_out", len(body))
+        
+        if config is None or config.drip_delay <= 0:
+            self.wfile.write(body)
+            return
+        step = max(1, math.ceil(len(body) / max(1, config.drip_chunks)))
+        for offset in range(0, len(body), step):
+            self.wfile.write(body[offset:offset + step])
+            self.wfile.flush()
+            time.sleep(config.drip_delay)
+    
+    def send_stream(self, model: str, text: str, usage: Optional[Dict], config: MockConfig):
+        """Отправляет ответ потоком SSE (chunked), как OpenAI-совместимые API"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        
+        def event(data: str):
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+            self.wfile.flush()
+            self.server.stats.add("bytes_out", len(payload))
+        
+        try:
+            # Комментарий, как ": OPENROUTER PROCESSING" у OpenRouter
+            comment = b": MOCK PROCESSING\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(comment), comment))
+            size = max(1, config.stream_chunk_size)
+            for offset in range(0, len(text), size):
+                event(json.dumps({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                    "choices": [{"index": 0, "delta": {"content": text[offset:offset + size]},
+                                 "finish_reason": None}],
+                }))
+                if config.drip_delay > 0:
+                    time.sleep(config.drip_delay)
+            if usage:
+                event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                                  "model": model, "choices": [], "usage": usage}))
+            event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент прервал поток (например, отмененный дублирующий запрос)
+            self.server.stats.add("stream_aborted")
+            self.close_connection = True
+
+
+class MockServer:
+    """
+    Запускает MockHTTPServer в фоновом потоке
+    
+    Используется как контекстный менеджер; url - адрес /v1/chat/completions.
+    """
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1",
+                 port: int = 0, seed: Optional[int] = None):
+        self.config = config or MockConfig()
+        self.httpd = MockHTTPServer((host, port), self.config, seed)
+        self.thread: Optional[threading.Thread] = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+    
+    @property
+    def stats(self) -> MockStats:
+        return self.httpd.stats
+    
+    def start(self) -> "MockServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server",
+                                       daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def __enter__(self) -> "MockServer":
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер с имитацией сбоев")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", default="0",
+                        help="Распределение задержки: 0.2, uniform:A:B, normal:M:S, lognormal:MED:SIGMA, exp:MEAN")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--rate-html", type=float, default=0.0, help="Доля HTML-страниц вместо JSON")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After в ответах 429, с")
+    parser.add_argument("--drip-delay", type=float, default=0.0, help="Пауза между фрагментами ответа, с")
+    parser.add_argument("--response-size", type=int, default=200, help="Длина ответа в символах")
+    parser.add_argument("--seed", type=int, default=None, help="Зерно генератора случайных чисел")
+    args = parser.parse_args()
+    
+    config = MockConfig(latency=args.latency, rate_429=args.rate_429, rate_500=args.rate_500,
+                        rate_html=args.rate_html, retry_after=args.retry_after,
+                        drip_delay=args.drip_delay, response_size=args.response_size)
+    server = MockServer(config, args.host, args.port, args.seed)
+    print(f"Mock-сервер: {server.url}")
+    print("Добавьте модель с этим API URL, любым API ID и переменной ключа с любым значением.")
+    print("Параметры для отдельной модели: API ID вида mock?latency=exp:2&rate_500=0.1")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,87 @@
 """
 Модуль для работы с моделями нейросетей
 """
-from typing import List, Dict, Optional
-from db import get_active_models
-from network import send_request
+import math
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from datetime import datetime
+from db import (get_active_models, get_setting, add_model_latency,
+                get_model_latency_percentile, get_model_price, get_avg_completion_tokens,
+                get_cost_since)
+from network import (CancelToken, RequestCancelled, calculate_cost, flush_metrics,
+                     log_event, send_request)
+
+
+# Значения по умолчанию для параллельной отправки запросов
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MODEL_TIMEOUT = 30
+DEFAULT_RUN_TIMEOUT = 120
+# Запас времени, чтобы сетевой таймаут requests успел сработать раньше нашего
+MODEL_DEADLINE_GRACE = 0.5
+# Как часто проверять таймауты моделей, пока ждем ответы
+FANOUT_POLL_INTERVAL = 0.25
+# Значения по умолчанию для дублирующих (hedge) запросов
+DEFAULT_HEDGE_PERCENTILE = 90
+DEFAULT_HEDGE_MAX_RATIO = 0.2
+DEFAULT_HEDGE_MIN_SAMPLES = 10
+# Значения по умолчанию для таймаутов по истории времени ответа модели
+DEFAULT_ADAPTIVE_TIMEOUT_PERCENTILE = 99
+DEFAULT_ADAPTIVE_TIMEOUT_FACTOR = 1.5
+DEFAULT_ADAPTIVE_TIMEOUT_MIN = 5
+DEFAULT_ADAPTIVE_TIMEOUT_MAX = 120
+DEFAULT_ADAPTIVE_TIMEOUT_MIN_SAMPLES = 20
+# Для оценки стоимости запуска: сколько токенов ответа ждать от модели без
+# истории запросов и сколько символов промта приходится на токен
+DEFAULT_EXPECTED_COMPLETION_TOKENS = 512
+CHARS_PER_TOKEN = 4
 
 
 class ModelResult:
     """Класс для представления результата запроса к модели"""
-    def __init__(self, model_name: str, response: str, selected: bool = False):
+    def __init__(self, model_name: str, response: str, selected: bool = False,
+                 model_id: Optional[int] = None):
         self.model_name = model_name
         self.response = response
         self.selected = selected
+        # ID модели в БД (для сохранения результата без поиска модели по имени)
+        self.model_id = model_id
+        # Расход по данным API (None - API не сообщил или ответ из кэша)
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cost: Optional[float] = None
+        self.elapsed: Optional[float] = None
+        # Для модели отправлялся дублирующий запрос; результат проигравшего
+        # запроса (его токены и стоимость тоже оплачены, см. summarize_usage)
+        self.hedged = False
+        self.hedge_loser: Optional["ModelResult"] = None
+    
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Скорость генерации ответа (токенов ответа в секунду)"""
+        if not self.completion_tokens or not self.elapsed:
+            return None
+        return self.completion_tokens / self.elapsed
     
     def to_dict(self) -> Dict:
         """Преобразует объект в словарь"""
         return {
+            "model_id": self.model_id,
             "model_name": self.model_name,
             "response": self.response,
-            "selected": self.selected
+            "selected": self.selected,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": self.cost,
+            "tokens_per_second": self.tokens_per_second
         }
 
 
+class BudgetExceededError(Exception):
+    """Запуск отклонен: оценка его стоимости превышает остаток дневного бюджета"""
+
+
 def get_active_models_list() -> List[Dict]:
     """
     Получает список активных моделей из базы данных
@@ -32,51 +92,733 @@ def get_active_models_list() -> List[Dict]:
     return get_active_models()
 
 
-def send_prompt_to_models(prompt: str, model_ids: Optional[List[int]] = None) -> List[ModelResult]:
+def _get_int_setting(key: str, default: int) -> int:
+    """Получает целочисленную настройку из БД (default при ошибке)"""
+    try:
+        return int(get_setting(key, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _get_float_setting(key: str, default: float) -> float:
+    """Получает дробную настройку из БД (default при ошибке)"""
+    try:
+        return float(get_setting(key, str(default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _is_error(result: ModelResult) -> bool:
+    """Проверяет, содержит ли результат сообщение об ошибке вместо ответа"""
+    return result.response.startswith("Ошибка:")
+
+
+def _record_latency(model: Dict, latency: float):
+    """Сохраняет время ответа модели в историю (ошибки записи не мешают запросу)"""
+    if model.get("id") is None:
+        return
+    try:
+        add_model_latency(model["id"], latency)
+    except Exception:
+        pass
+
+
+def get_model_timeouts(models: List[Dict], default: float) -> List[float]:
     """
-    Отправляет промт во все активные модели (или указанные модели)
+    Определяет таймауты запросов к моделям
+    
+    Ручной таймаут модели (колонка timeout_override) важнее всего. Иначе,
+    если включена настройка adaptive_timeouts и в истории model_latency
+    достаточно замеров, таймаут равен перцентилю времени ответа,
+    умноженному на adaptive_timeout_factor, в пределах adaptive_timeout_min
+    и adaptive_timeout_max. В остальных случаях используется default.
+    
+    Args:
+        models: Список моделей из БД
+        default: Общий таймаут (настройка timeout)
+        
+    Returns:
+        Таймауты в секундах в порядке списка моделей
+    """
+    adaptive = get_setting("adaptive_timeouts", "1") == "1"
+    if adaptive:
+        percentile = _get_float_setting("adaptive_timeout_percentile",
+                                        DEFAULT_ADAPTIVE_TIMEOUT_PERCENTILE)
+        min_samples = _get_int_setting("adaptive_timeout_min_samples",
+                                       DEFAULT_ADAPTIVE_TIMEOUT_MIN_SAMPLES)
+        factor = _get_float_setting("adaptive_timeout_factor", DEFAULT_ADAPTIVE_TIMEOUT_FACTOR)
+        low = _get_float_setting("adaptive_timeout_min", DEFAULT_ADAPTIVE_TIMEOUT_MIN)
+        high = _get_float_setting("adaptive_timeout_max", DEFAULT_ADAPTIVE_TIMEOUT_MAX)
+    
+    timeouts = []
+    for model in models:
+        if model.get("timeout_override"):
+            timeouts.append(float(model["timeout_override"]))
+            continue
+        latency = None
+        if adaptive and model.get("id") is not None:
+            try:
+                latency = get_model_latency_percentile(model["id"], percentile, min_samples)
+            except Exception:
+                latency = None
+        if latency is None:
+            timeouts.append(default)
+        else:
+            timeouts.append(round(max(low, min(high, latency * factor)), 1))
+    return timeouts
+
+
+def request_model(model: Dict, prompt: str, timeout: Optional[float] = None,
+                  stream: bool = False,
+                  on_delta: Optional[Callable[[str, str], None]] = None,
+                  use_cache: bool = True, coalesce: bool = True,
+                  cancel: Optional[CancelToken] = None, hedge: bool = False) -> ModelResult:
+    """
+    Отправляет промт в одну модель и оборачивает ответ в ModelResult
     
     Args:
+        model: Словарь с информацией о модели из БД
         prompt: Текст промта
-        model_ids: Список ID моделей для отправки (если None, то все активные)
+        timeout: Таймаут запроса в секундах (если None, берется из настроек)
+        stream: Получать ответ потоком
+        on_delta: Функция (имя модели, фрагмент текста), вызываемая при потоковом ответе
+        use_cache: Разрешить ответ из кэша (False - всегда отправлять запрос)
+        coalesce: Объединять с одновременным таким же запросом (см. network.send_request)
+        cancel: Признак отмены запуска
+        hedge: Запрос - дубль (отмечается в метриках request_metrics)
         
     Returns:
-        Список объектов ModelResult с результатами запросов
+        Объект ModelResult (с текстом ошибки, если запрос не удался)
+    """
+    model_name = model.get("name", "Unknown")
+    
+    def model_on_delta(delta: str):
+        # После отмены фрагменты не передаются, а поток ответа прерывается
+        if cancel is not None and cancel.cancelled:
+            raise RequestCancelled()
+        on_delta(model_name, delta)
+    try:
+        stats: Dict = {}
+        start = time.monotonic()
+        response = send_request(model, prompt, timeout=timeout, stream=stream,
+                                on_delta=model_on_delta if stream and on_delta else None,
+                                use_cache=use_cache, stats=stats,
+                                coalesce=coalesce, cancel=cancel, hedge=hedge)
+        if response:
+            # В историю времени ответа попадают только реальные успешные запросы
+            elapsed = time.monotonic() - start
+            if (not stats.get("cached") and not stats.get("coalesced")
+                    and not response.startswith("Ошибка:")):
+                _record_latency(model, elapsed)
+            result = ModelResult(model_name, response, False, model.get("id"))
+            result.prompt_tokens = stats.get("prompt_tokens")
+            result.completion_tokens = stats.get("completion_tokens")
+            result.cost = stats.get("cost")
+            result.elapsed = elapsed
+            return result
+        # Если запрос не удался, возвращаем результат с сообщением об ошибке
+        return ModelResult(
+            model_name,
+            "Ошибка: не удалось получить ответ от модели",
+            False,
+            model.get("id")
+        )
+    except Exception as e:
+        return ModelResult(
+            model_name,
+            f"Ошибка: {str(e)}",
+            False,
+            model.get("id")
+        )
+
+
+class WorkerPool:
+    """
+    Общий пул потоков для запросов к моделям, живущий между запусками
+    
+    Потоки не создаются заново на каждый запуск, поэтому их соединения с
+    базой (db.get_connection) и другие данные потока переиспользуются.
+    Пул только растет: если нужно больше потоков (изменилась настройка
+    max_concurrent_requests), создается пул большего размера, а прежний
+    завершается после уже отправленных в него задач.
     """
-    results = []
+    def __init__(self, name: str):
+        self.name = name
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._size = 0
+        self._busy = 0
+        self._lock = threading.Lock()
     
-    # Получаем список моделей
+    def reserve(self, size: int):
+        """Увеличивает пул до size потоков (если он меньше)"""
+        with self._lock:
+            if self._executor is None or size > self._size:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._size = max(1, size, self._size)
+                self._executor = ThreadPoolExecutor(max_workers=self._size,
+                                                    thread_name_prefix=self.name)
+    
+    def submit(self, fn: Callable, *args) -> Future:
+        """Отправляет fn(*args) в пул"""
+        self.reserve(1)
+        with self._lock:
+            self._busy += 1
+            future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._task_done)
+        return future
+    
+    def _task_done(self, future: Future):
+        with self._lock:
+            self._busy -= 1
+    
+    def stats(self) -> Dict[str, int]:
+        """Размер пула и число задач, которые выполняются или ждут потока"""
+        with self._lock:
+            return {"size": self._size, "busy": self._busy}
+
+
+# Пулы для запросов к моделям и для дублирующих запросов (раздельные: задача
+# первого пула ждет задачи второго, и в общем пуле они могли бы занять все потоки)
+_fanout_pool = WorkerPool("chatlist-fanout")
+_hedge_pool = WorkerPool("chatlist-hedge")
+
+
+def get_worker_stats() -> Dict[str, Dict[str, int]]:
+    """Возвращает размер и загрузку общих пулов потоков (fanout и hedge)"""
+    return {"fanout": _fanout_pool.stats(), "hedge": _hedge_pool.stats()}
+
+
+class HedgeBudget:
+    """
+    Ограничивает долю дублирующих (hedge) запросов среди всех запросов
+    
+    Дубль разрешается, только если и с ним дублей будет не больше max_ratio
+    от числа запросов, учтенных этим лимитом, чтобы медленный провайдер не
+    удваивал нагрузку и расход токенов. Общий лимит программы
+    (_hedge_budget) учитывает запросы всех запусков, поэтому маленькие
+    запуски (1-4 модели) не получают по дублю каждый.
+    """
+    def __init__(self, max_ratio: float):
+        self.max_ratio = max_ratio
+        self.requests = 0
+        self.fired = 0
+        self._lock = threading.Lock()
+    
+    def count_request(self):
+        """Учитывает один основной запрос, который можно было бы дублировать"""
+        with self._lock:
+            self.requests += 1
+    
+    def try_acquire(self) -> bool:
+        """Занимает место под дублирующий запрос, False - доля дублей была бы больше max_ratio"""
+        with self._lock:
+            # Запас на погрешность float: 5 * 0.2 должно разрешать ровно один дубль
+            if self.max_ratio <= 0 or self.fired + 1 > self.requests * self.max_ratio + 1e-9:
+                return False
+            self.fired += 1
+            return True
+
+
+# Общий для всех запусков лимит дублей (доля - из настройки hedge_max_ratio)
+_hedge_budget = HedgeBudget(DEFAULT_HEDGE_MAX_RATIO)
+
+
+# Счетчики дублирующих запросов за время работы программы
+_hedge_stats = {"fired": 0, "won": 0}
+_hedge_stats_lock = threading.Lock()
+
+
+def get_hedge_stats() -> Dict[str, int]:
+    """
+    Возвращает счетчики дублирующих запросов
+    
+    Returns:
+        Словарь: requests - запросов с дублированием через общий лимит,
+        fired - отправлено дублей (каждый - лишний запрос к провайдеру),
+        won - сколько раз дубль ответил раньше основного запроса
+    """
+    with _hedge_stats_lock:
+        return {"requests": _hedge_budget.requests, **_hedge_stats}
+
+
+def _record_hedge(model: Dict, hedge_delay: float, winner: str, elapsed: float):
+    """Учитывает стоимость дублирующего запроса в счетчиках и логе"""
+    with _hedge_stats_lock:
+        _hedge_stats["fired"] += 1
+        if winner == "hedge":
+            _hedge_stats["won"] += 1
+    log_event("hedge", model=model.get("name", "Unknown"), hedge_delay=round(hedge_delay, 3),
+              winner=winner, elapsed=round(elapsed, 3), extra_requests=1)
+
+
+def _attach_hedge_loser(result: ModelResult, future: Future):
+    """Сохраняет в result результат проигравшего запроса (если тот выполнялся)"""
+    if not future.cancelled() and future.exception() is None:
+        result.hedge_loser = future.result()
+
+
+def request_model_hedged(model: Dict, prompt: str, timeout: float,
+                         budget: Optional[HedgeBudget] = None,
+                         percentile: float = DEFAULT_HEDGE_PERCENTILE,
+                         min_samples: int = DEFAULT_HEDGE_MIN_SAMPLES,
+                         stream: bool = False,
+                         on_delta: Optional[Callable[[str, str], None]] = None,
+                         use_cache: bool = True,
+                         cancel: Optional[CancelToken] = None) -> ModelResult:
+    """
+    Отправляет промт в модель, дублируя запрос, если модель отвечает дольше обычного
+    
+    Если модель не ответила за percentile-перцентиль своего времени ответа
+    (по истории model_latency), отправляется второй такой же запрос, и
+    используется ответ, пришедший первым. У каждого запроса свой признак
+    отмены (дочерний к cancel): проигравший запрос обрывается, как только
+    другой успешно ответил (при потоковом ответе - как только другой начал
+    отвечать), и не занимает соединение и лимиты провайдера.
+    
+    Args:
+        model: Словарь с информацией о модели из БД
+        prompt: Текст промта
+        timeout: Таймаут запроса в секундах
+        budget: Лимит доли дублирующих запросов (None - общий лимит программы)
+        percentile: Перцентиль времени ответа, после которого отправляется дубль
+        min_samples: Минимум замеров в истории, без них дубль не отправляется
+        stream: Получать ответ потоком
+        on_delta: Функция (имя модели, фрагмент текста), вызываемая при потоковом ответе
+        use_cache: Разрешить ответ из кэша
+        cancel: Признак отмены запуска (прерывает оба запроса)
+        
+    Returns:
+        Объект ModelResult; если дубль отправлялся, у него hedged = True, а
+        в hedge_loser - результат проигравшего запроса (когда тот завершится)
+    """
+    if budget is None:
+        budget = _hedge_budget
+    budget.count_request()
+    hedge_delay = None
+    if model.get("id") is not None:
+        try:
+            hedge_delay = get_model_latency_percentile(model["id"], percentile, min_samples)
+        except Exception:
+            hedge_delay = None
+    if hedge_delay is None or hedge_delay >= timeout:
+        return request_model(model, prompt, timeout, stream, on_delta, use_cache, cancel=cancel)
+    
+    attempt_cancels = {"primary": CancelToken(cancel), "hedge": CancelToken(cancel)}
+    
+    def cancel_others(winner: str):
+        """Обрывает запросы, проигравшие winner"""
+        for attempt, attempt_cancel in attempt_cancels.items():
+            if attempt != winner:
+                attempt_cancel.cancel()
+    
+    # Фрагменты потокового ответа передаются только от запроса, начавшего
+    # отвечать первым; второй запрос при этом прерывается
+    owner: List[str] = []
+    owner_lock = threading.Lock()
+    
+    def attempt_on_delta(attempt: str) -> Optional[Callable[[str, str], None]]:
+        if not (stream and on_delta):
+            return None
+        
+        def forward(model_name: str, delta: str):
+            with owner_lock:
+                first = not owner
+                if first:
+                    owner.append(attempt)
+                is_owner = owner[0] == attempt
+            if first:
+                cancel_others(attempt)
+            if not is_owner:
+                raise RequestCancelled()
+            on_delta(model_name, delta)
+        return forward
+    
+    start = time.monotonic()
+    futures: List[Future] = []
+    _hedge_pool.reserve(2)
+    try:
+        primary = _hedge_pool.submit(request_model, model, prompt, timeout, stream,
+                                     attempt_on_delta("primary"), use_cache, True,
+                                     attempt_cancels["primary"])
+        futures.append(primary)
+        done, _ = wait([primary], timeout=hedge_delay)
+        cancelled = cancel is not None and cancel.cancelled
+        if done or owner or cancelled or not budget.try_acquire():
+            return primary.result()
+        
+        # Кэш уже проверен основным запросом, а объединение с ним же сделало
+        # бы дубль бесполезным - дубль идет сразу в сеть
+        remaining = max(1.0, timeout - (time.monotonic() - start))
+        hedge = _hedge_pool.submit(request_model, model, prompt, remaining, stream,
+                                   attempt_on_delta("hedge"), False, False,
+                                   attempt_cancels["hedge"], True)
+        futures.append(hedge)
+        attempts = {primary: "primary", hedge: "hedge"}
+        result, winner = None, "primary"
+        for future in as_completed(attempts):
+            result, winner = future.result(), attempts[future]
+            if not _is_error(result):
+                # Проигравший запрос обрываем: его ответ уже не нужен
+                cancel_others(winner)
+                break
+        result.hedged = True
+        # Проигравший запрос тоже оплачен: его расход учитывается в итогах
+        # запуска, как только он завершится (обычно сразу после отмены)
+        loser = hedge if winner == "primary" else primary
+        loser.add_done_callback(lambda future: _attach_hedge_loser(result, future))
+        _record_hedge(model, hedge_delay, winner, time.monotonic() - start)
+        return result
+    finally:
+        # Не ждем проигравший запрос: он оборван или уже завершился; еще не
+        # начатый запрос (пул занят) не отправляется
+        for future in futures:
+            future.cancel()
+
+
+def _iter_concurrently(models: List[Dict],
+                       run_one: Callable[[Dict, float, CancelToken], ModelResult],
+                       max_workers: int, timeouts: List[float],
+                       run_timeout: float,
+                       cancel: Optional[CancelToken] = None) -> Iterator[Tuple[int, ModelResult]]:
+    """
+    Параллельно выполняет run_one(модель, таймаут, признак отмены) для каждой модели через пул потоков
+    
+    Запросы выполняются в общем пуле (_fanout_pool), одновременно - не
+    больше max_workers запросов этого запуска. Выдает пары (индекс модели в models, ModelResult) по мере готовности
+    ответов. Модель, не уложившаяся в свой таймаут из timeouts с момента
+    начала своего запроса, получает результат с ошибкой таймаута; модели, не успевшие
+    ответить до истечения run_timeout, - ошибку превышения общего времени.
+    У каждой модели свой признак отмены (дочерний к признаку запуска): по
+    истечении таймаута модели или общего времени ее запрос обрывается, а не
+    продолжает занимать поток и соединение до таймаута сервера.
+    После отмены через cancel результаты больше не выдаются, а запросы,
+    ждущие своей очереди в пуле, не отправляются.
+    """
+    # Признак этого запуска: отменяется по общему таймауту, не затрагивая cancel
+    run_cancel = CancelToken(cancel)
+    started: Dict[int, float] = {}
+    model_cancels: Dict[int, CancelToken] = {}
+    
+    def task(index: int) -> ModelResult:
+        model_cancels[index] = CancelToken(run_cancel)
+        started[index] = time.monotonic()
+        return run_one(models[index], timeouts[index], model_cancels[index])
+    
+    window = max(1, min(max_workers, len(models)))
+    futures: Dict[Future, int] = {}
+    pending = set()
+    next_index = 0
+    
+    def submit_more():
+        """Отправляет в пул следующие модели, пока запросов меньше window"""
+        nonlocal next_index
+        while next_index < len(models) and len(pending) < window:
+            future = _fanout_pool.submit(task, next_index)
+            futures[future] = next_index
+            pending.add(future)
+            next_index += 1
+    
+    _fanout_pool.reserve(max_workers)
+    run_deadline = time.monotonic() + run_timeout
+    submit_more()
+    
+    try:
+        while pending:
+            if run_cancel.cancelled:
+                return
+            now = time.monotonic()
+            
+            # Снимаем модели, превысившие собственный таймаут, и обрываем их запросы
+            timed_out = []
+            for future in list(pending):
+                index = futures[future]
+                start = started.get(index)
+                if start is not None and now - start > timeouts[index] + MODEL_DEADLINE_GRACE:
+                    pending.discard(future)
+                    model_cancels[index].cancel()
+                    timed_out.append(index)
+            submit_more()
+            for index in timed_out:
+                yield index, ModelResult(
+                    models[index].get("name", "Unknown"),
+                    f"Ошибка: модель не ответила за {timeouts[index]:g} с",
+                    False,
+                    models[index].get("id")
+                )
+            
+            if not pending or now >= run_deadline:
+                break
+            
+            wait_timeout = min(run_deadline - now, FANOUT_POLL_INTERVAL)
+            done, _ = wait(pending, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            if run_cancel.cancelled:
+                return
+            pending -= done
+            submit_more()
+            for future in done:
+                yield futures[future], future.result()
+        
+        if pending:
+            # Общее время вышло: обрываем все незавершенные запросы
+            run_cancel.cancel()
+        unfinished = [futures[future] for future in pending] + list(range(next_index, len(models)))
+        for index in unfinished:
+            yield index, ModelResult(
+                models[index].get("name", "Unknown"),
+                f"Ошибка: превышено общее время выполнения запросов ({run_timeout:g} с)",
+                False,
+                models[index].get("id")
+            )
+    finally:
+        # Результаты оставшихся запросов уже не нужны: обрываем их и не ждем,
+        # а запросы, еще ждущие потока в пуле, не отправляем
+        run_cancel.cancel()
+        for future in futures:
+            future.cancel()
+
+
+def _resolve_models(model_ids: Optional[List[int]]) -> List[Dict]:
+    """Возвращает модели по списку ID (если None, то все активные)"""
     if model_ids:
         from db import get_model_by_id
-        models = [get_model_by_id(mid) for mid in model_ids if get_model_by_id(mid)]
+        return [get_model_by_id(mid) for mid in model_ids if get_model_by_id(mid)]
+    return get_active_models()
+
+
+def estimate_run_cost(prompt: str, models: List[Dict]) -> float:
+    """
+    Оценивает стоимость отправки промта в модели (в долларах)
+    
+    Число токенов промта оценивается по длине текста, число токенов ответа -
+    как среднее по последним запросам к модели. Модели без цен считаются
+    бесплатными.
+    """
+    prompt_tokens = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+    total = 0.0
+    for model in models:
+        if model.get("id") is None:
+            continue
+        price = get_model_price(model["id"])
+        if not price:
+            continue
+        expected = get_avg_completion_tokens(model["id"]) or DEFAULT_EXPECTED_COMPLETION_TOKENS
+        total += calculate_cost(price, prompt_tokens, round(expected)) or 0.0
+    return total
+
+
+def check_daily_budget(prompt: str, models: List[Dict]):
+    """
+    Проверяет, что запуск уложится в дневной бюджет (настройка daily_budget)
+    
+    Raises:
+        BudgetExceededError: если потраченное сегодня вместе с оценкой
+            запуска превышает бюджет
+    """
+    budget = _get_float_setting("daily_budget", 0.0)
+    if budget <= 0:
+        return
+    estimate = estimate_run_cost(prompt, models)
+    if estimate <= 0:
+        return
+    flush_metrics()
+    start_of_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    spent = get_cost_since(start_of_day.timestamp())
+    if spent + estimate > budget:
+        raise BudgetExceededError(
+            f"Превышен дневной бюджет: потрачено сегодня ${spent:.4f} из ${budget:.2f}, "
+            f"оценка стоимости запуска ${estimate:.4f}"
+        )
+
+
+def summarize_usage(results: List[ModelResult]) -> Dict:
+    """
+    Суммирует расход токенов и стоимость по результатам запуска
+    
+    Расход проигравших дублирующих запросов входит в токены и стоимость.
+    
+    Returns:
+        Словарь: prompt_tokens, completion_tokens, cost (None, если ни у одной
+        модели нет цены), tokens_per_second (общая скорость генерации),
+        hedges (сколько моделей получили дублирующий запрос)
+    """
+    summary = {"prompt_tokens": 0, "completion_tokens": 0, "cost": None,
+               "tokens_per_second": None, "hedges": 0}
+    generated_tokens = 0
+    generation_time = 0.0
+    for result in results:
+        summary["hedges"] += result.hedged
+        for paid in (result, result.hedge_loser):
+            if paid is None:
+                continue
+            summary["prompt_tokens"] += paid.prompt_tokens or 0
+            summary["completion_tokens"] += paid.completion_tokens or 0
+            if paid.cost is not None:
+                summary["cost"] = (summary["cost"] or 0.0) + paid.cost
+        # Скорость - по ответам, которые получил пользователь
+        if result.completion_tokens and result.elapsed:
+            generated_tokens += result.completion_tokens
+            generation_time += result.elapsed
+    if generation_time > 0:
+        summary["tokens_per_second"] = generated_tokens / generation_time
+    return summary
+
+
+def _iter_indexed_results(prompt: str, models: List[Dict], concurrent: bool,
+                          max_workers: Optional[int], model_timeout: Optional[float],
+                          run_timeout: Optional[float], stream: bool = False,
+                          on_delta: Optional[Callable[[str, str], None]] = None,
+                          use_cache: bool = True,
+                          hedge: Optional[bool] = None,
+                          cancel: Optional[CancelToken] = None) -> Iterator[Tuple[int, ModelResult]]:
+    """Выдает пары (индекс модели, ModelResult) по мере получения ответов (до отмены cancel)"""
+    check_daily_budget(prompt, models)
+    
+    # Явный model_timeout действует на все модели, иначе у каждой модели свой
+    if model_timeout is None:
+        timeouts = get_model_timeouts(models, _get_int_setting("timeout", DEFAULT_MODEL_TIMEOUT))
+    else:
+        timeouts = [model_timeout] * len(models)
+    
+    if not concurrent:
+        # Отправляем запрос к каждой модели по очереди
+        for index, model in enumerate(models):
+            if cancel is not None and cancel.cancelled:
+                return
+            result = request_model(model, prompt, timeouts[index], stream, on_delta, use_cache,
+                                   cancel=cancel)
+            if cancel is not None and cancel.cancelled:
+                return
+            yield index, result
+        return
+    
+    if max_workers is None:
+        max_workers = _get_int_setting("max_concurrent_requests", DEFAULT_MAX_WORKERS)
+    if run_timeout is None:
+        run_timeout = _get_int_setting("run_timeout", DEFAULT_RUN_TIMEOUT)
+    if hedge is None:
+        hedge = get_setting("hedging_enabled", "0") == "1"
+    
+    if hedge:
+        # Каждый запрос с дублем занимает до двух потоков пула дублей
+        _hedge_pool.reserve(2 * max_workers)
+        _hedge_budget.max_ratio = _get_float_setting("hedge_max_ratio", DEFAULT_HEDGE_MAX_RATIO)
+        percentile = _get_float_setting("hedge_percentile", DEFAULT_HEDGE_PERCENTILE)
+        min_samples = _get_int_setting("hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES)
+        
+        def run_one(model: Dict, timeout: float, model_cancel: CancelToken) -> ModelResult:
+            return request_model_hedged(model, prompt, timeout, None, percentile,
+                                        min_samples, stream, on_delta, use_cache, model_cancel)
     else:
-        models = get_active_models()
+        def run_one(model: Dict, timeout: float, model_cancel: CancelToken) -> ModelResult:
+            return request_model(model, prompt, timeout, stream, on_delta, use_cache,
+                                 cancel=model_cancel)
     
+    yield from _iter_concurrently(models, run_one, max_workers, timeouts, run_timeout, cancel)
+
+
+def iter_prompt_results(prompt: str, model_ids: Optional[List[int]] = None,
+                        concurrent: bool = True, max_workers: Optional[int] = None,
+                        model_timeout: Optional[float] = None,
+                        run_timeout: Optional[float] = None, stream: bool = False,
+                        on_delta: Optional[Callable[[str, str], None]] = None,
+                        use_cache: bool = True,
+                        hedge: Optional[bool] = None,
+                        cancel: Optional[CancelToken] = None) -> Iterator[ModelResult]:
+    """
+    Отправляет промт в модели и выдает результаты по мере их получения
+    
+    Параметры те же, что у send_prompt_to_models. Порядок выдачи
+    соответствует порядку ответов моделей, а не порядку списка моделей.
+    
+    Yields:
+        Объекты ModelResult сразу после завершения запроса к модели
+    """
+    models = _resolve_models(model_ids)
+    for _, result in _iter_indexed_results(prompt, models, concurrent, max_workers,
+                                           model_timeout, run_timeout, stream, on_delta,
+                                           use_cache, hedge, cancel):
+        yield result
+
+
+def send_prompt_to_models(prompt: str, model_ids: Optional[List[int]] = None,
+                          concurrent: bool = True, max_workers: Optional[int] = None,
+                          model_timeout: Optional[float] = None,
+                          run_timeout: Optional[float] = None,
+                          on_result: Optional[Callable[[ModelResult], None]] = None,
+                          stream: bool = False,
+                          on_delta: Optional[Callable[[str, str], None]] = None,
+                          use_cache: bool = True,
+                          hedge: Optional[bool] = None,
+                          cancel: Optional[CancelToken] = None,
+                          first_n: Optional[int] = None,
+                          finish_rest: bool = False) -> List[ModelResult]:
+    """
+    Отправляет промт во все активные модели (или указанные модели)
+    
+    Args:
+        prompt: Текст промта
+        model_ids: Список ID моделей для отправки (если None, то все активные)
+        concurrent: Отправлять запросы параллельно (по умолчанию) или по очереди
+        max_workers: Размер пула потоков (если None, берется из настроек)
+        model_timeout: Таймаут одной модели в секундах (если None, у каждой модели
+            свой, см. get_model_timeouts)
+        run_timeout: Общий таймаут всего запуска в секундах (если None, берется из настроек)
+        on_result: Функция, вызываемая для каждого результата сразу после его получения
+        stream: Получать ответы потоком (server-sent events)
+        on_delta: Функция (имя модели, фрагмент текста), вызываемая при потоковом ответе
+        use_cache: Разрешить ответы из кэша (False - обойти кэш для этого запуска)
+        hedge: Дублировать запросы к моделям, отвечающим дольше обычного
+            (см. request_model_hedged; если None, берется из настроек)
+        cancel: Признак отмены: после cancel.cancel() отправленные запросы
+            обрываются, а ожидающие очереди не отправляются
+        first_n: Вернуться, как только получено first_n успешных ответов
+            (если None или 0 - ждать все модели)
+        finish_rest: При first_n не отменять оставшиеся запросы: они
+            выполняются в фоновом потоке, а их результаты передаются в on_result
+        
+    Returns:
+        Список объектов ModelResult в порядке списка моделей (после отмены или
+        при first_n - только ответы, полученные до возврата)
+        
+    Raises:
+        BudgetExceededError: если запуск не укладывается в дневной бюджет
+    """
+    models = _resolve_models(model_ids)
     if not models:
-        return results
+        return []
     
-    # Отправляем запрос к каждой модели
-    for model in models:
-        model_name = model.get("name", "Unknown")
-        try:
-            response = send_request(model, prompt)
-            if response:
-                results.append(ModelResult(model_name, response, False))
-            else:
-                # Если запрос не удался, добавляем результат с сообщением об ошибке
-                results.append(ModelResult(
-                    model_name, 
-                    "Ошибка: не удалось получить ответ от модели", 
-                    False
-                ))
-        except Exception as e:
-            results.append(ModelResult(
-                model_name,
-                f"Ошибка: {str(e)}",
-                False
-            ))
-    
-    return results
+    # Оставшиеся после first_n ответов запросы отменяются отдельно от всего запуска
+    run_cancel = CancelToken(cancel) if first_n else cancel
+    results: List[Optional[ModelResult]] = [None] * len(models)
+    indexed = _iter_indexed_results(prompt, models, concurrent, max_workers, model_timeout,
+                                    run_timeout, stream, on_delta, use_cache, hedge, run_cancel)
+    succeeded = 0
+    for index, result in indexed:
+        results[index] = result
+        if on_result:
+            on_result(result)
+        if first_n and not _is_error(result):
+            succeeded += 1
+            if succeeded >= first_n:
+                break
+    
+    if first_n and succeeded >= first_n:
+        if finish_rest:
+            threading.Thread(target=_drain_results, args=(indexed, on_result),
+                             name="chatlist-finish-rest", daemon=True).start()
+        else:
+            run_cancel.cancel()
+            indexed.close()
+    return [result for result in results if result is not None]
+
+
+def _drain_results(indexed: Iterator[Tuple[int, ModelResult]],
+                   on_result: Optional[Callable[[ModelResult], None]]):
+    """Дожидается оставшихся ответов запуска, передавая их в on_result"""
+    for _, result in indexed:
+        if on_result:
+            on_result(result)
 
 
 def process_results(results: List[ModelResult]) -> List[Dict]:
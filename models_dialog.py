@@ -4,7 +4,7 @@
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
     QTableWidgetItem, QHeaderView, QMessageBox, QDialogButtonBox,
-    QFormLayout, QLineEdit, QComboBox, QCheckBox, QLabel
+    QFormLayout, QLineEdit, QComboBox, QCheckBox, QLabel, QDoubleSpinBox
 )
 from PyQt5.QtCore import Qt
 import db
@@ -44,6 +44,27 @@ class ModelEditDialog(QDialog):
         self.is_active_checkbox.setChecked(True)
         layout.addRow("Активна:", self.is_active_checkbox)
         
+        # Цены в долларах за 1M токенов (0 - бесплатная модель)
+        self.prompt_price_spin = QDoubleSpinBox()
+        self.prompt_price_spin.setDecimals(4)
+        self.prompt_price_spin.setMaximum(10000)
+        self.prompt_price_spin.setPrefix("$ ")
+        layout.addRow("Цена промта за 1M токенов:", self.prompt_price_spin)
+        
+        self.completion_price_spin = QDoubleSpinBox()
+        self.completion_price_spin.setDecimals(4)
+        self.completion_price_spin.setMaximum(10000)
+        self.completion_price_spin.setPrefix("$ ")
+        layout.addRow("Цена ответа за 1M токенов:", self.completion_price_spin)
+        
+        # Ручной таймаут (0 - по истории ответов модели или общий из настроек)
+        self.timeout_spin = QDoubleSpinBox()
+        self.timeout_spin.setDecimals(1)
+        self.timeout_spin.setMaximum(3600)
+        self.timeout_spin.setSuffix(" с")
+        self.timeout_spin.setSpecialValueText("авто")
+        layout.addRow("Таймаут:", self.timeout_spin)
+        
         # Заполняем поля, если редактируем
         if model_data:
             self.name_edit.setText(model_data.get("name", ""))
@@ -54,6 +75,11 @@ class ModelEditDialog(QDialog):
             if index >= 0:
                 self.model_type_combo.setCurrentIndex(index)
             self.is_active_checkbox.setChecked(model_data.get("is_active", 1) == 1)
+            price = db.get_model_price(model_data["id"]) if model_data.get("id") else None
+            if price:
+                self.prompt_price_spin.setValue(price["prompt_price"])
+                self.completion_price_spin.setValue(price["completion_price"])
+            self.timeout_spin.setValue(model_data.get("timeout_override") or 0)
         
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(self.accept)
@@ -70,7 +96,10 @@ class ModelEditDialog(QDialog):
             "api_id": self.api_id_edit.text().strip(),
             "api_key_env": self.api_key_env_edit.text().strip(),
             "model_type": self.model_type_combo.currentText(),
-            "is_active": 1 if self.is_active_checkbox.isChecked() else 0
+            "is_active": 1 if self.is_active_checkbox.isChecked() else 0,
+            "prompt_price": self.prompt_price_spin.value(),
+            "completion_price": self.completion_price_spin.value(),
+            "timeout_override": self.timeout_spin.value() or None
         }
 
 
@@ -174,7 +203,7 @@ class ModelsDialog(QDialog):
                 return
             
             try:
-                db.add_model(
+                model_id = db.add_model(
                     name=data["name"],
                     api_url=data["api_url"],
                     api_id=data["api_id"],
@@ -182,6 +211,8 @@ class ModelsDialog(QDialog):
                     model_type=data["model_type"],
                     is_active=data["is_active"]
                 )
+                db.set_model_price(model_id, data["prompt_price"], data["completion_price"])
+                db.set_model_timeout(model_id, data["timeout_override"])
                 QMessageBox.information(self, "Успех", "Модель добавлена")
                 self.load_models()
             except Exception as e:
@@ -216,6 +247,8 @@ class ModelsDialog(QDialog):
                     model_type=data["model_type"],
                     is_active=data["is_active"]
                 )
+                db.set_model_price(model_id, data["prompt_price"], data["completion_price"])
+                db.set_model_timeout(model_id, data["timeout_override"])
                 QMessageBox.information(self, "Успех", "Модель обновлена")
                 self.load_models()
             except Exception as e:
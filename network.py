@@ -2,9 +2,25 @@
 Модуль для отправки HTTP-запросов к API нейросетей
 """
 import os
+import re
+import json
+import time
+import queue
+import atexit
+import random
+import socket
+import hashlib
+import threading
 import requests
 import logging
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from dotenv import load_dotenv
 from version import __version__
 from app_paths import get_log_path
@@ -51,7 +67,7 @@ if os.path.exists(user_env_path):
 
 
 def reload_env():
-    """Перезагружает переменные окружения из .env файлов"""
+    """Перезагружает переменные окружения из .env файлов (и сбрасывает HTTP-сессии и шаблоны запросов)"""
     import sys
     
     # Определяем папку приложения
@@ -69,6 +85,10 @@ def reload_env():
     if os.path.exists(user_env_path):
         load_dotenv(user_env_path, override=True)
         logger.info(f"Перезагружен .env из пользовательской папки: {user_env_path}")
+    
+    # Прокси и API ключи могли измениться - сессии и шаблоны создадутся заново
+    reset_sessions()
+    reset_templates()
 
 
 def get_api_key(env_var_name: str) -> Optional[str]:
@@ -91,13 +111,48 @@ def get_api_key(env_var_name: str) -> Optional[str]:
     return api_key
 
 
+# Снимок настроек из БД: читается один раз, а не при каждом запросе
+_settings: Optional[Dict[str, str]] = None
+_settings_lock = threading.Lock()
+
+
+def get_network_setting(key: str, default: str) -> str:
+    """Получает настройку из снимка настроек (БД читается только при первом обращении)"""
+    global _settings
+    settings = _settings
+    if settings is None:
+        with _settings_lock:
+            if _settings is None:
+                try:
+                    import db
+                    _settings = db.get_all_settings()
+                except Exception as e:
+                    # БД еще не создана - работаем на значениях по умолчанию, не запоминая их
+                    logger.warning(f"Не удалось прочитать настройки: {e}")
+            settings = _settings or {}
+    value = settings.get(key)
+    return value if value not in (None, "") else default
+
+
+def reload_settings():
+    """
+    Перечитывает настройки из БД при следующем запросе
+    
+    Также сбрасывает HTTP-сессии и ограничители запросов, так как их
+    параметры зависят от настроек.
+    """
+    global _settings
+    with _settings_lock:
+        _settings = None
+    reset_sessions()
+    reset_governors()
+
+
 def get_timeout() -> int:
     """Получает таймаут для запросов из настроек (по умолчанию 30 секунд)"""
     try:
-        import db
-        timeout_str = db.get_setting("timeout", "30")
-        return int(timeout_str)
-    except Exception:
+        return int(get_network_setting("timeout", "30"))
+    except ValueError:
         return 30
 
 
@@ -121,187 +176,978 @@ def get_proxies():
         return {"http": None, "https": None}
 
 
-def send_openai_request(api_url: str, api_key: str, model_id: str, prompt: str) -> Optional[str]:
+# Параметры генерации, отправляемые вместе с промтом (входят в ключ кэша)
+GENERATION_PARAMS = {"temperature": 0.7}
+
+
+# Общие HTTP-сессии по хостам: соединения переиспользуются (keep-alive),
+# чтобы не платить за TCP/TLS-рукопожатие на каждый запрос
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_pool_size() -> int:
+    """Размер пула соединений к одному хосту - по числу параллельных запросов"""
+    try:
+        return max(1, int(get_network_setting("max_concurrent_requests", "8")))
+    except ValueError:
+        return 8
+
+
+# Счетчики текущего запроса в потоке, для метрик: время установки соединений
+# (TCP + TLS) и байты, прочитанные из потокового ответа
+_request_io = threading.local()
+
+
+def _add_connect_time(seconds: float):
+    _request_io.connect_seconds = getattr(_request_io, "connect_seconds", 0.0) + seconds
+
+
+class RequestCancelled(Exception):
+    """Запрос прерван вызывающей стороной (из on_delta или через CancelToken), его ответ больше не нужен"""
+
+
+# Ответ execute_request для прерванного запроса
+CANCELLED_RESPONSE = "Ошибка: запрос отменен"
+
+# Как часто ожидающие очереди запросы проверяют отмену, с
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class CancelToken:
+    """
+    Признак отмены запуска, общий для всех его запросов
+    
+    cancel() можно вызвать из любого потока. Запросы, ожидающие
+    ограничителя или паузы перед повтором, завершаются сразу, а у уже
+    отправленных обрываются сокеты соединений, так что ожидание ответа
+    прерывается, не дожидаясь таймаута.
+    
+    Признак, созданный с parent, отменяется вместе с ним, но его
+    собственная отмена на parent не влияет (например, отмена оставшихся
+    запросов запуска, уже получившего нужные ответы).
+    """
+    def __init__(self, parent: Optional["CancelToken"] = None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        # Соединения, занятые запросами с этим признаком (по потокам)
+        self._connections: Dict[int, List] = {}
+        self._children: List["CancelToken"] = []
+        if parent is not None:
+            parent._add_child(self)
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+    
+    def cancel(self):
+        """Отменяет запуск и обрывает соединения его запросов"""
+        with self._lock:
+            self._event.set()
+            connections = [conn for conns in self._connections.values() for conn in conns]
+            children = list(self._children)
+        for conn in connections:
+            _abort_connection(conn)
+        for child in children:
+            child.cancel()
+    
+    def _add_child(self, child: "CancelToken"):
+        with self._lock:
+            self._children.append(child)
+            cancelled = self.cancelled
+        if cancelled:
+            child.cancel()
+    
+    def wait(self, timeout: Optional[float]) -> bool:
+        """Ждет отмены не дольше timeout секунд, True - запуск отменен"""
+        return self._event.wait(timeout)
+    
+    def raise_if_cancelled(self):
+        """Выбрасывает RequestCancelled, если запуск отменен"""
+        if self.cancelled:
+            raise RequestCancelled()
+    
+    def attach(self, conn):
+        """Запоминает соединение запроса текущего потока (при уже отмененном запуске обрывает его)"""
+        with self._lock:
+            self._connections.setdefault(threading.get_ident(), []).append(conn)
+            cancelled = self.cancelled
+        if cancelled:
+            _abort_connection(conn)
+    
+    def detach_thread(self):
+        """Забывает соединения текущего потока (запрос завершен, соединения вернулись в пул)"""
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+
+
+def _abort_connection(conn):
+    """Обрывает сокет соединения, чтобы прервать блокирующее чтение в другом потоке"""
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _current_cancel() -> Optional[CancelToken]:
+    """Признак отмены запроса, выполняющегося в текущем потоке"""
+    return getattr(_request_io, "cancel", None)
+
+
+@contextmanager
+def _cancel_scope(cancel: Optional[CancelToken]):
     """
-    Отправляет запрос к OpenAI API
+    Связывает запросы текущего потока с признаком отмены
+    
+    Соединения, занятые внутри блока, обрываются при cancel.cancel(), а
+    любая ошибка после отмены (обычно обрыв соединения) превращается в
+    RequestCancelled. Вложенный блок с тем же признаком ничего не делает.
+    """
+    previous = _current_cancel()
+    if cancel is None or cancel is previous:
+        yield
+        return
+    _request_io.cancel = cancel
+    try:
+        yield
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        if cancel.cancelled:
+            raise RequestCancelled() from e
+        raise
+    finally:
+        _request_io.cancel = previous
+        cancel.detach_thread()
+
+
+def _sleep(seconds: float, cancel: Optional[CancelToken] = None):
+    """Пауза, прерываемая отменой (выбрасывает RequestCancelled)"""
+    if cancel is None:
+        time.sleep(seconds)
+    elif cancel.wait(seconds):
+        raise RequestCancelled()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    """HTTP-соединение, замеряющее время подключения"""
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _add_connect_time(time.monotonic() - start)
+        _check_cancelled_after_connect(self)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS-соединение, замеряющее время подключения вместе с TLS-рукопожатием"""
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _add_connect_time(time.monotonic() - start)
+        _check_cancelled_after_connect(self)
+
+
+def _check_cancelled_after_connect(conn):
+    """Закрывает только что открытое соединение, если запрос отменили во время подключения"""
+    cancel = _current_cancel()
+    if cancel is not None and cancel.cancelled:
+        conn.close()
+        raise RequestCancelled()
+
+
+class _CancellableConnectionPool:
+    """Примесь к пулу urllib3: связывает занятое запросом соединение с его CancelToken"""
+    def _make_request(self, conn, *args, **kwargs):
+        cancel = _current_cancel()
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+            cancel.attach(conn)
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class _TimedHTTPConnectionPool(_CancellableConnectionPool, HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(_CancellableConnectionPool, HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter, чьи соединения замеряют время подключения и обрываются при отмене запроса
+    
+    Соединения через прокси не замеряются (для них время подключения
+    в метриках будет 0).
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def _create_session() -> requests.Session:
+    """Создает сессию с пулом соединений и заранее определенными прокси"""
+    session = requests.Session()
+    pool_size = get_pool_size()
+    adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    
+    # Прокси определяются один раз при создании сессии; системные настройки
+    # прокси не подхватываем, как и раньше (см. get_proxies)
+    session.proxies.update({scheme: url for scheme, url in get_proxies().items() if url})
+    session.trust_env = False
+    return session
+
+
+def get_session(api_url: str) -> requests.Session:
+    """
+    Возвращает общую HTTP-сессию для хоста из api_url
+    
+    Сессии создаются лениво и переиспользуются всеми потоками.
     
     Args:
         api_url: URL API
-        api_key: API ключ
-        model_id: ID модели
-        prompt: Текст промта
         
     Returns:
-        Ответ модели или None в случае ошибки
+        Сессия requests с пулом keep-alive соединений к хосту
     """
-    try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": model_id,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
-        }
+    host = urlsplit(api_url).netloc.lower()
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _create_session()
+            _sessions[host] = session
+        return session
+
+
+def reset_sessions():
+    """Закрывает все HTTP-сессии (например, после изменения прокси или размера пула)"""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def log_event(event: str, **fields):
+    """Пишет в лог структурированное событие (одна строка JSON)"""
+    logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+# Таймаут одного запроса при подготовке соединений, с
+PREWARM_TIMEOUT = 5.0
+PREWARM_MAX_WORKERS = 32
+
+# Итоги последней подготовки соединений (хост -> сведения)
+_prewarm_stats: Dict[str, Dict] = {}
+
+
+def prewarm_connections(api_urls: List[str], timeout: float = PREWARM_TIMEOUT) -> Dict[str, Dict]:
+    """
+    Заранее открывает keep-alive соединения к хостам моделей
+    
+    К корню каждого хоста отправляются HEAD-запросы через общую сессию
+    (см. get_session) - параллельно столько, сколько на хосте моделей, но
+    не больше размера пула. После этого DNS, TCP и TLS уже выполнены, а
+    соединения ждут в пуле первого настоящего запроса. Код ответа (даже
+    404) не важен; ограничитель запросов не задействуется.
+    
+    Args:
+        api_urls: URL API моделей (повторы - несколько моделей на одном хосте)
+        timeout: Таймаут одного запроса в секундах
         
-        logger.info(f"Отправка запроса к OpenAI API: модель {model_id}")
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=data,
-            timeout=get_timeout(),
-            proxies=get_proxies()
+    Returns:
+        Словарь по хостам: connections - открыто соединений, connect_ms -
+        среднее время установки соединения (на столько быстрее станет первый
+        запрос к хосту), error - текст ошибки, если соединение не открылось
+    """
+    counts: Dict[str, int] = {}
+    origins: Dict[str, str] = {}
+    for api_url in api_urls:
+        parts = urlsplit(api_url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            continue
+        host = parts.netloc.lower()
+        counts[host] = counts.get(host, 0) + 1
+        origins[host] = f"{parts.scheme}://{parts.netloc}/"
+    if not counts:
+        return {}
+    
+    def warm(host: str) -> float:
+        _request_io.connect_seconds = 0.0
+        response = get_session(origins[host]).head(origins[host], timeout=timeout,
+                                                   allow_redirects=False)
+        if response.headers.get("Connection", "").lower() == "close":
+            # Сервер закрыл соединение - в пуле ничего не осталось
+            return 0.0
+        return _request_io.connect_seconds
+    
+    pool_size = get_pool_size()
+    tasks = [host for host, count in counts.items() for _ in range(min(count, pool_size))]
+    results: Dict[str, Dict] = {host: {"connections": 0, "connect_ms": None} for host in counts}
+    connect_times: Dict[str, List[float]] = {host: [] for host in counts}
+    with ThreadPoolExecutor(max_workers=min(len(tasks), PREWARM_MAX_WORKERS),
+                            thread_name_prefix="chatlist-prewarm") as executor:
+        futures = {executor.submit(warm, host): host for host in tasks}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                seconds = future.result()
+            except requests.exceptions.RequestException as e:
+                results[host]["error"] = str(e)
+                continue
+            # Соединение могло достаться из пула, если соседний запрос уже закончился
+            if seconds > 0:
+                connect_times[host].append(seconds)
+    
+    for host, times in connect_times.items():
+        if times:
+            results[host]["connections"] = len(times)
+            results[host]["connect_ms"] = round(sum(times) / len(times) * 1000, 1)
+            results[host].pop("error", None)
+        log_event("prewarm", host=host, **results[host])
+    
+    _prewarm_stats.clear()
+    _prewarm_stats.update(results)
+    return results
+
+
+def get_prewarm_stats() -> Dict[str, Dict]:
+    """Возвращает итоги последней подготовки соединений (см. prewarm_connections)"""
+    return {host: dict(stats) for host, stats in _prewarm_stats.items()}
+
+
+class MetricsWriter:
+    """
+    Пакетная запись метрик запросов в таблицу request_metrics
+    
+    record() только кладет строку в очередь; фоновый поток пишет накопленное
+    одной транзакцией раз в FLUSH_INTERVAL секунд или по BATCH_SIZE строк.
+    Если очередь переполнена (БД недоступна), новые метрики отбрасываются,
+    а не замедляют запросы.
+    """
+    FLUSH_INTERVAL = 2.0
+    BATCH_SIZE = 200
+    MAX_QUEUE = 10000
+    
+    def __init__(self):
+        self._queue: "queue.Queue[Tuple]" = queue.Queue(maxsize=self.MAX_QUEUE)
+        self._pending: List[Tuple] = []
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+    
+    def record(self, model_id: Optional[int], stats: Dict):
+        """Ставит метрики одного запроса в очередь на запись"""
+        row = (
+            model_id, time.time(), stats.get("connect_ms"), stats.get("ttfb_ms"),
+            stats.get("total_ms"), stats.get("bytes_out"), stats.get("bytes_in"),
+            stats.get("status"), stats.get("retries", 0), stats.get("outcome", "error"),
+            stats.get("prompt_tokens"), stats.get("completion_tokens"), stats.get("cost"),
+            int(bool(stats.get("hedge")))
         )
-        response.raise_for_status()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self._ensure_thread()
+    
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="chatlist-metrics",
+                                                daemon=True)
+                self._thread.start()
+    
+    def _take(self, row: Tuple):
+        with self._lock:
+            self._pending.append(row)
+    
+    def _run(self):
+        self._prune()
+        while True:
+            self._take(self._queue.get())
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            for _ in range(self.BATCH_SIZE - 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self._take(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_pending()
+    
+    def _prune(self):
+        """Удаляет метрики старше metrics_retention_days (один раз при запуске потока)"""
+        try:
+            days = float(get_network_setting("metrics_retention_days", "30"))
+            if days > 0:
+                import db
+                db.delete_request_metrics_before(time.time() - days * 86400)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить старые метрики запросов: {e}")
+    
+    def flush(self):
+        """Сразу записывает все накопленные метрики (вызывается при выходе)"""
+        while True:
+            try:
+                self._take(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write_pending()
+    
+    def _write_pending(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            import db
+            db.add_request_metrics(rows)
+        except Exception as e:
+            logger.warning(f"Не удалось записать метрики запросов ({len(rows)} шт.): {e}")
+
+
+_metrics_writer = MetricsWriter()
+atexit.register(_metrics_writer.flush)
+
+
+def record_request_metrics(model_id: Optional[int], stats: Dict):
+    """
+    Сохраняет метрики запроса к модели (если включена настройка metrics_enabled)
+    
+    Платные запросы записываются всегда: по ним считается дневной бюджет.
+    """
+    if get_network_setting("metrics_enabled", "1") == "1" or stats.get("cost"):
+        _metrics_writer.record(model_id, stats)
+
+
+def flush_metrics():
+    """Записывает накопленные метрики запросов в БД, не дожидаясь фонового потока"""
+    _metrics_writer.flush()
+
+
+# Цены моделей задаются в долларах за миллион токенов
+PRICE_UNIT_TOKENS = 1_000_000
+
+
+def calculate_cost(price: Optional[Dict], prompt_tokens: Optional[int],
+                   completion_tokens: Optional[int]) -> Optional[float]:
+    """
+    Вычисляет стоимость запроса по ценам модели
+    
+    Args:
+        price: Цены модели (prompt_price, completion_price за 1M токенов) или None
+        prompt_tokens: Число токенов промта
+        completion_tokens: Число токенов ответа
         
-        result = response.json()
-        if "choices" in result and len(result["choices"]) > 0:
-            message = result["choices"][0]["message"]["content"]
-            logger.info(f"Получен ответ от OpenAI API: {len(message)} символов")
-            return message
-        else:
-            logger.error("Неожиданный формат ответа от OpenAI API")
-            return None
+    Returns:
+        Стоимость в долларах или None, если цена или число токенов неизвестны
+    """
+    if not price or (prompt_tokens is None and completion_tokens is None):
+        return None
+    return ((prompt_tokens or 0) * price["prompt_price"]
+            + (completion_tokens or 0) * price["completion_price"]) / PRICE_UNIT_TOKENS
+
+
+class RetryPolicy:
+    """
+    Политика повторных попыток запроса
+    
+    Повторяет запросы с кодами из retry_statuses, а также таймауты и
+    обрывы соединения. Пауза между попытками растет экспоненциально
+    (base_delay * 2^n, не больше max_delay) со случайным джиттером.
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+    
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        """Создает политику по настройкам из БД"""
+        try:
+            return cls(
+                max_attempts=int(get_network_setting("retry_max_attempts", "3")),
+                base_delay=float(get_network_setting("retry_base_delay", "1")),
+                max_delay=float(get_network_setting("retry_max_delay", "30"))
+            )
+        except ValueError:
+            return cls()
+    
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед попыткой attempt + 1 (full jitter)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Разбирает длительность вида "1.5", "20ms", "6m0s", "2m59.56s" в секунды"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    multipliers = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(number) * multipliers[unit] for number, unit in parts)
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    """
+    Определяет, через сколько секунд сервер разрешает повторить запрос
+    
+    Учитывает заголовок Retry-After (секунды или HTTP-дата) и
+    x-ratelimit-reset (Unix time в секундах или миллисекундах, как у
+    OpenRouter, либо длительность, как у OpenAI/Groq).
+    
+    Returns:
+        Пауза в секундах или None, если сервер ее не указал
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        seconds = _parse_duration(retry_after)
+        if seconds is not None:
+            return max(0.0, seconds)
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    
+    for header in ("x-ratelimit-reset", "x-ratelimit-reset-requests"):
+        reset = response.headers.get(header)
+        if not reset:
+            continue
+        seconds = _parse_duration(reset)
+        if seconds is None:
+            continue
+        if seconds > 1e12:
+            # Unix time в миллисекундах
+            return max(0.0, seconds / 1000 - time.time())
+        if seconds > 1e9:
+            # Unix time в секундах
+            return max(0.0, seconds - time.time())
+        return max(0.0, seconds)
+    
+    return None
+
+
+class ProviderGovernor:
+    """
+    Ограничитель запросов к одному провайдеру (хост + API ключ)
+    
+    Сочетает token bucket (не больше rate запросов в секунду с запасом
+    burst) и лимит одновременных запросов max_in_flight. Скорость
+    подстраивается по AIMD: каждый успешный ответ прибавляет
+    AIMD_INCREASE запросов в секунду (до исходного rate), каждый 429
+    уменьшает ее вдвое. Заголовки x-ratelimit-remaining/-reset и
+    Retry-After приостанавливают выдачу разрешений до сброса лимита.
+    """
+    AIMD_INCREASE = 0.5
+    AIMD_DECREASE = 0.5
+    MIN_RATE = 0.1
+    
+    def __init__(self, host: str, rate: float, burst: int, max_in_flight: int):
+        self.host = host
+        self.max_rate = max(self.MIN_RATE, rate)
+        self.rate = self.max_rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+    
+    def acquire(self, deadline: float, cancel: Optional[CancelToken] = None) -> bool:
+        """
+        Ждет разрешения на запрос, но не дольше deadline (time.monotonic()) и до отмены cancel
+        
+        Returns:
+            True, если запрос можно отправлять (потом обязателен release)
+        """
+        while True:
+            remaining = max(0.0, deadline - time.monotonic())
+            if cancel is not None:
+                remaining = min(remaining, CANCEL_POLL_INTERVAL)
+            if self.in_flight.acquire(timeout=remaining):
+                break
+            if time.monotonic() >= deadline or (cancel is not None and cancel.cancelled):
+                return False
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait_time = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                else:
+                    wait_time = (1 - self.tokens) / self.rate
+            if now + wait_time > deadline:
+                self.in_flight.release()
+                return False
+            if cancel is None:
+                time.sleep(wait_time)
+            elif cancel.wait(wait_time):
+                self.in_flight.release()
+                return False
+    
+    def release(self, response: Optional[requests.Response] = None):
+        """Освобождает слот запроса и учитывает ответ сервера в скорости"""
+        self.in_flight.release()
+        if response is not None:
+            self.observe(response)
+    
+    def observe(self, response: requests.Response):
+        """Учитывает ответ сервера (статус и заголовки лимитов) в скорости, не освобождая слот"""
+        with self.lock:
+            now = time.monotonic()
+            if response.status_code == 429:
+                self.rate = max(self.MIN_RATE, self.rate * self.AIMD_DECREASE)
+                pause = get_retry_after(response)
+                if pause:
+                    self.paused_until = max(self.paused_until, now + pause)
+                log_event("rate_limit_decrease", host=self.host, rate=round(self.rate, 3))
+            elif response.status_code < 400:
+                self.rate = min(self.max_rate, self.rate + self.AIMD_INCREASE)
             
-    except requests.exceptions.Timeout:
-        error_msg = f"Таймаут при запросе к OpenAI API (модель: {model_id})"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP ошибка {e.response.status_code}: {e.response.text[:200] if e.response else str(e)}"
-        logger.error(f"Ошибка при запросе к OpenAI API: {error_msg}")
-        return f"Ошибка: {error_msg}"
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Ошибка сети при запросе к OpenAI API: {str(e)}"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
-    except Exception as e:
-        error_msg = f"Неожиданная ошибка при запросе к OpenAI API: {str(e)}"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
+            remaining = response.headers.get("x-ratelimit-remaining") or \
+                response.headers.get("x-ratelimit-remaining-requests")
+            try:
+                remaining = int(float(remaining)) if remaining is not None else None
+            except ValueError:
+                remaining = None
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0:
+                    pause = get_retry_after(response)
+                    if pause:
+                        self.paused_until = max(self.paused_until, now + pause)
+
+
+def _release_on_close(response: requests.Response, governor: ProviderGovernor):
+    """
+    Откладывает освобождение слота ограничителя до закрытия потокового ответа
+    
+    Потоковый ответ занимает соединение, пока читается тело, поэтому
+    max_in_flight должен учитывать его до response.close() (его вызывает
+    read_sse_stream после чтения потока, а execute_request - в любом случае).
+    """
+    close = response.close
+    released = threading.Event()
+    
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released.is_set():
+                released.set()
+                governor.release()
+    response.close = close_and_release
+
+
+# Ограничители по провайдерам (хост + API ключ), общие для всех потоков
+_governors: Dict[str, ProviderGovernor] = {}
+_governors_lock = threading.Lock()
+
+
+def _get_limit_setting(name: str, host: str, default: str) -> float:
+    """Читает лимит из настроек: сначала вариант для хоста ("name:host"), затем общий"""
+    try:
+        return float(get_network_setting(f"{name}:{host}", get_network_setting(name, default)))
+    except ValueError:
+        return float(default)
+
+
+def get_governor(api_url: str, authorization: str = "") -> ProviderGovernor:
+    """
+    Возвращает ограничитель запросов для хоста и API ключа
+    
+    Лимиты берутся из настроек rate_limit_rps, rate_limit_burst и
+    rate_limit_max_in_flight; для отдельного хоста их можно
+    переопределить ключом вида "rate_limit_rps:openrouter.ai".
+    """
+    host = urlsplit(api_url).netloc.lower()
+    key_hash = hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:12]
+    key = f"{host}|{key_hash}"
+    with _governors_lock:
+        governor = _governors.get(key)
+        if governor is None:
+            governor = ProviderGovernor(
+                host,
+                rate=_get_limit_setting("rate_limit_rps", host, "5"),
+                burst=int(_get_limit_setting("rate_limit_burst", host, "8")),
+                max_in_flight=int(_get_limit_setting("rate_limit_max_in_flight", host, "8"))
+            )
+            _governors[key] = governor
+        return governor
+
 
+def reset_governors():
+    """Сбрасывает ограничители (например, после изменения лимитов в настройках)"""
+    with _governors_lock:
+        _governors.clear()
 
-def send_deepseek_request(api_url: str, api_key: str, model_id: str, prompt: str) -> Optional[str]:
+
+def post_with_retry(api_url: str, headers: Dict, payload: Dict, timeout: float,
+                    stream: bool = False, model_id: str = "",
+                    policy: Optional[RetryPolicy] = None,
+                    stats: Optional[Dict] = None,
+                    cancel: Optional[CancelToken] = None) -> requests.Response:
     """
-    Отправляет запрос к DeepSeek API
+    Отправляет POST-запрос через общую сессию с повторами по RetryPolicy
+    
+    Все попытки вместе с паузами укладываются в timeout (дедлайн модели):
+    если до дедлайна не остается времени на паузу, возвращается последний
+    ответ (или пробрасывается последнее исключение).
     
     Args:
         api_url: URL API
-        api_key: API ключ
-        model_id: ID модели
-        prompt: Текст промта
+        headers: Заголовки запроса
+        payload: Тело запроса (JSON)
+        timeout: Дедлайн на все попытки в секундах
+        stream: Не читать тело ответа сразу
+        model_id: ID модели (для логов)
+        policy: Политика повторов (если None, берется из настроек)
+        stats: Словарь для метрик последней попытки: retries, connect_ms,
+            ttfb_ms (до получения заголовков ответа), bytes_out
+        cancel: Признак отмены: ожидание и паузы прерываются, соединение обрывается
         
     Returns:
-        Ответ модели или None в случае ошибки
+        Ответ сервера (последней попытки). Потоковый ответ занимает слот
+        ограничителя (max_in_flight), пока его не закроют (response.close())
+        
+    Raises:
+        RequestCancelled: если запрос отменен через cancel
     """
-    try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+    if policy is None:
+        policy = RetryPolicy.from_settings()
+    
+    session = get_session(api_url)
+    governor = get_governor(api_url, headers.get("Authorization", ""))
+    deadline = time.monotonic() + timeout
+    with _cancel_scope(cancel):
+        attempt = 0
+        while True:
+            attempt += 1
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if not governor.acquire(deadline, cancel):
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                log_event("rate_limit_timeout", model=model_id, host=governor.host)
+                raise requests.exceptions.Timeout(
+                    f"Не дождались разрешения ограничителя запросов к {governor.host}"
+                )
+            remaining = max(0.1, deadline - time.monotonic())
+            _request_io.connect_seconds = 0.0
+            if stats is not None:
+                stats["retries"] = attempt - 1
+            try:
+                response = session.post(api_url, headers=headers, json=payload,
+                                        timeout=remaining, stream=stream)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if stats is not None:
+                    stats["connect_ms"] = _request_io.connect_seconds * 1000
+                governor.release()
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                if attempt >= policy.max_attempts:
+                    raise
+                delay = policy.backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                log_event("retry", model=model_id, attempt=attempt, reason=type(e).__name__,
+                          wait=round(delay, 3))
+                _sleep(delay, cancel)
+                continue
+            except Exception:
+                governor.release()
+                raise
+            
+            if stream:
+                # Слот освобождается, когда поток прочитан или закрыт
+                governor.observe(response)
+                _release_on_close(response, governor)
+            else:
+                governor.release(response)
+            if stats is not None:
+                stats["connect_ms"] = _request_io.connect_seconds * 1000
+                stats["ttfb_ms"] = response.elapsed.total_seconds() * 1000
+                stats["bytes_out"] = len(response.request.body or b"")
+            
+            if response.status_code not in policy.retry_statuses or attempt >= policy.max_attempts:
+                return response
+            
+            server_delay = get_retry_after(response)
+            delay = server_delay if server_delay is not None else policy.backoff(attempt)
+            if time.monotonic() + delay >= deadline:
+                log_event("retry_give_up", model=model_id, attempt=attempt,
+                          status=response.status_code, wait=round(delay, 3))
+                return response
+            
+            log_event("retry", model=model_id, attempt=attempt, status=response.status_code,
+                      wait=round(delay, 3), retry_after=server_delay is not None)
+            response.close()
+            _sleep(delay, cancel)
+
+
+def _store_usage(usage: Optional[Dict], data: Optional[Dict]):
+    """Переносит число токенов из блока usage ответа API в словарь usage"""
+    if usage is None or not isinstance(data, dict):
+        return
+    for key in ("prompt_tokens", "completion_tokens"):
+        if isinstance(data.get(key), int):
+            usage[key] = data[key]
+
+
+def iter_sse_deltas(response: requests.Response,
+                    usage: Optional[Dict] = None) -> Iterator[str]:
+    """
+    Разбирает поток server-sent events OpenAI-совместимого API
+    
+    Читает строки вида "data: {...}" до "data: [DONE]" и выдает
+    фрагменты текста из choices[0].delta.content. Строки-комментарии
+    (например, ": OPENROUTER PROCESSING") пропускаются.
+    
+    Args:
+        response: Ответ requests, полученный с stream=True
+        usage: Словарь, в который записывается число токенов (prompt_tokens,
+            completion_tokens) из блока usage потока, если сервер его прислал
         
-        data = {
-            "model": model_id,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
-        }
+    Yields:
+        Фрагменты текста ответа модели
         
-        logger.info(f"Отправка запроса к DeepSeek API: модель {model_id}")
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=data,
-            timeout=get_timeout(),
-            proxies=get_proxies()
-        )
-        response.raise_for_status()
+    Raises:
+        ValueError: если сервер прислал в потоке ошибку или некорректный JSON
+    """
+    # text/event-stream без charset requests декодирует как ISO-8859-1
+    response.encoding = "utf-8"
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        # urllib3 не считает байты chunked-ответа, считаем сами (после распаковки)
+        _request_io.stream_bytes = getattr(_request_io, "stream_bytes", 0) + len(line.encode("utf-8")) + 1
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
         
-        result = response.json()
-        if "choices" in result and len(result["choices"]) > 0:
-            message = result["choices"][0]["message"]["content"]
-            logger.info(f"Получен ответ от DeepSeek API: {len(message)} символов")
-            return message
-        else:
-            logger.error("Неожиданный формат ответа от DeepSeek API")
-            return None
-            
-    except requests.exceptions.Timeout:
-        error_msg = f"Таймаут при запросе к DeepSeek API (модель: {model_id})"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP ошибка {e.response.status_code}: {e.response.text[:200] if e.response else str(e)}"
-        logger.error(f"Ошибка при запросе к DeepSeek API: {error_msg}")
-        return f"Ошибка: {error_msg}"
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Ошибка сети при запросе к DeepSeek API: {str(e)}"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
-    except Exception as e:
-        error_msg = f"Неожиданная ошибка при запросе к DeepSeek API: {str(e)}"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
+        chunk = json.loads(payload)
+        if "error" in chunk:
+            error = chunk["error"]
+            message = error.get("message", "Неизвестная ошибка") if isinstance(error, dict) else str(error)
+            raise ValueError(f"Ошибка в потоке ответа: {message}")
+        
+        # usage приходит в последнем фрагменте (Groq кладет его в x_groq)
+        _store_usage(usage, chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage"))
+        
+        choices = chunk.get("choices") or []
+        if choices:
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
 
 
-def send_openrouter_request(api_url: str, api_key: str, model_id: str, prompt: str) -> Optional[str]:
+def read_sse_stream(response: requests.Response,
+                    on_delta: Optional[Callable[[str], None]] = None,
+                    usage: Optional[Dict] = None) -> str:
     """
-    Отправляет запрос к OpenRouter API
+    Читает потоковый ответ целиком, передавая фрагменты в on_delta
     
     Args:
-        api_url: URL API
-        api_key: API ключ
-        model_id: ID модели
-        prompt: Текст промта
+        response: Ответ requests, полученный с stream=True
+        on_delta: Функция, вызываемая для каждого фрагмента текста
+        usage: Словарь для числа токенов (см. iter_sse_deltas)
         
     Returns:
-        Ответ модели или None в случае ошибки
+        Полный текст ответа
     """
+    parts = []
     try:
-        headers = {
+        for delta in iter_sse_deltas(response, usage):
+            parts.append(delta)
+            if on_delta:
+                on_delta(delta)
+    finally:
+        response.close()
+    return "".join(parts)
+
+
+class ProviderAdapter:
+    """
+    Описание OpenAI-совместимого провайдера
+    
+    Все провайдеры отправляют один и тот же запрос /chat/completions и
+    разбирают ответ одним парсером; отличаются только название (для
+    сообщений), хосты для автоопределения, дополнительные заголовки и
+    подсказка о формате ключа. Новый совместимый провайдер добавляется
+    вызовом register_provider без отдельной функции отправки.
+    """
+    def __init__(self, name: str, title: str, hosts: Tuple[str, ...] = (),
+                 extra_headers: Optional[Dict[str, str]] = None, key_prefix: str = ""):
+        self.name = name
+        self.title = title
+        self.hosts = hosts
+        self.extra_headers = extra_headers or {}
+        self.key_prefix = key_prefix
+    
+    def build_headers(self, api_key: str) -> Dict[str, str]:
+        """Формирует заголовки запроса"""
+        return {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
-            "HTTP-Referer": "https://github.com/chatlist",
-            "X-Title": "ChatList"
-        }
-        
-        data = {
-            "model": model_id,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
+            **self.extra_headers
         }
+    
+    def parse_response(self, response: requests.Response, model_id: str, stream: bool = False,
+                       on_delta: Optional[Callable[[str], None]] = None,
+                       usage: Optional[Dict] = None) -> str:
+        """
+        Извлекает текст ответа модели из успешного HTTP-ответа
         
-        logger.info(f"Отправка запроса к OpenRouter API: модель {model_id}")
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=data,
-            timeout=get_timeout(),
-            proxies=get_proxies()
-        )
-        response.raise_for_status()
+        Число токенов из блока usage ответа записывается в словарь usage
+        (prompt_tokens, completion_tokens), если он передан.
         
+        Returns:
+            Текст ответа или строка, начинающаяся с "Ошибка:"
+        """
         # Проверяем Content-Type ответа
         content_type = response.headers.get("Content-Type", "").lower()
         if "text/html" in content_type:
             error_msg = f"Модель {model_id}: Сервер вернул HTML вместо JSON. " \
                        f"Возможно, прокси блокирует эту модель или модель недоступна. " \
                        f"Попробуйте другую модель или проверьте настройки прокси."
-            logger.error(f"OpenRouter API вернул HTML для модели {model_id}")
+            logger.error(f"{self.title} API вернул HTML для модели {model_id}")
             logger.error(f"Content-Type: {content_type}")
             logger.error(f"HTML ответ (первые 300 символов): {response.text[:300]}")
             return f"Ошибка: {error_msg}"
         
+        if stream:
+            message = read_sse_stream(response, on_delta, usage)
+            logger.info(f"Получен потоковый ответ от {self.title} API: {len(message)} символов")
+            return message
+        
         # Проверяем, что ответ не пустой
         if not response.text:
-            error_msg = "Пустой ответ от OpenRouter API"
+            error_msg = f"Пустой ответ от {self.title} API"
             logger.error(error_msg)
             return f"Ошибка: {error_msg}"
         
@@ -314,32 +1160,32 @@ def send_openrouter_request(api_url: str, api_key: str, model_id: str, prompt: s
                 error_msg = f"Модель {model_id}: Сервер вернул HTML вместо JSON. " \
                            f"Возможные причины: прокси блокирует запрос, модель недоступна, " \
                            f"или требуется специальный доступ. Попробуйте другую модель."
-                logger.error(f"OpenRouter API вернул HTML вместо JSON для модели {model_id}")
+                logger.error(f"{self.title} API вернул HTML вместо JSON для модели {model_id}")
                 logger.error(f"HTML ответ (первые 200 символов): {response_text[:200]}")
             else:
-                error_msg = f"Ошибка парсинга JSON от OpenRouter API для модели {model_id}: {str(e)}. " \
+                error_msg = f"Ошибка парсинга JSON от {self.title} API для модели {model_id}: {str(e)}. " \
                            f"Ответ: {response_text[:200]}"
                 logger.error(error_msg)
             return f"Ошибка: {error_msg}"
         
         if "choices" in result and len(result["choices"]) > 0:
             message = result["choices"][0]["message"]["content"]
-            logger.info(f"Получен ответ от OpenRouter API: {len(message)} символов")
+            _store_usage(usage, result.get("usage"))
+            logger.info(f"Получен ответ от {self.title} API: {len(message)} символов")
             return message
         elif "error" in result:
-            error_msg = f"Ошибка от OpenRouter API: {result.get('error', {}).get('message', 'Неизвестная ошибка')}"
+            error = result.get("error") or {}
+            message = error.get("message", "Неизвестная ошибка") if isinstance(error, dict) else str(error)
+            error_msg = f"Ошибка от {self.title} API: {message}"
             logger.error(error_msg)
             return f"Ошибка: {error_msg}"
         else:
-            error_msg = "Неожиданный формат ответа от OpenRouter API"
+            error_msg = f"Неожиданный формат ответа от {self.title} API"
             logger.error(f"{error_msg}. Ответ: {response.text[:200]}")
             return f"Ошибка: {error_msg}"
-            
-    except requests.exceptions.Timeout:
-        error_msg = f"Таймаут при запросе к OpenRouter API (модель: {model_id})"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
-    except requests.exceptions.HTTPError as e:
+    
+    def describe_http_error(self, e: requests.exceptions.HTTPError, model_id: str) -> str:
+        """Формирует понятное сообщение об HTTP-ошибке"""
         status_code = "unknown"
         response_text = ""
         error_msg = ""
@@ -349,7 +1195,7 @@ def send_openrouter_request(api_url: str, api_key: str, model_id: str, prompt: s
             try:
                 # Пытаемся получить JSON ошибки
                 error_json = e.response.json()
-                if "error" in error_json:
+                if isinstance(error_json, dict) and isinstance(error_json.get("error"), dict):
                     error_msg = error_json["error"].get("message", "Неизвестная ошибка")
                 else:
                     error_msg = str(error_json)
@@ -357,13 +1203,15 @@ def send_openrouter_request(api_url: str, api_key: str, model_id: str, prompt: s
                 # Если не JSON (например, HTML страница ошибки), обрабатываем по статус коду
                 try:
                     response_text = e.response.text[:200] if hasattr(e.response, 'text') else str(e.response)[:200]
-                except:
+                except Exception:
                     response_text = str(e.response)[:200]
                 
                 if status_code == 403:
-                    error_msg = "403 Forbidden: Проверьте API ключ OpenRouter и права доступа. Убедитесь, что ключ правильный и начинается с 'sk-or-v1-'"
+                    error_msg = f"403 Forbidden: Проверьте API ключ {self.title} и права доступа"
+                    if self.key_prefix:
+                        error_msg += f". Убедитесь, что ключ правильный и начинается с '{self.key_prefix}'"
                 elif status_code == 401:
-                    error_msg = "401 Unauthorized: Неверный API ключ OpenRouter. Проверьте ключ в файле .env"
+                    error_msg = f"401 Unauthorized: Неверный API ключ {self.title}. Проверьте ключ в файле .env"
                 elif status_code == 429:
                     error_msg = "429 Too Many Requests: Превышен лимит запросов. Попробуйте позже"
                 elif status_code == 400:
@@ -374,131 +1222,475 @@ def send_openrouter_request(api_url: str, api_key: str, model_id: str, prompt: s
             error_msg = f"HTTP ошибка: {str(e)}"
         
         full_error = f"{error_msg}" + (f" (ответ: {response_text[:100]})" if response_text else "")
-        logger.error(f"Ошибка при запросе к OpenRouter API (модель: {model_id}): {full_error}")
-        return f"Ошибка: {error_msg}"
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Ошибка сети при запросе к OpenRouter API: {str(e)}"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
-    except Exception as e:
-        error_msg = f"Неожиданная ошибка при запросе к OpenRouter API: {str(e)}"
-        logger.error(error_msg)
-        return f"Ошибка: {error_msg}"
+        logger.error(f"Ошибка при запросе к {self.title} API (модель: {model_id}): {full_error}")
+        return error_msg
+
+
+# Реестр провайдеров по model_type
+PROVIDERS: Dict[str, ProviderAdapter] = {}
 
 
-def send_groq_request(api_url: str, api_key: str, model_id: str, prompt: str) -> Optional[str]:
+def register_provider(adapter: ProviderAdapter):
+    """Регистрирует провайдера (по model_type и хостам для автоопределения)"""
+    PROVIDERS[adapter.name] = adapter
+
+
+register_provider(ProviderAdapter("openai", "OpenAI"))
+register_provider(ProviderAdapter("deepseek", "DeepSeek", hosts=("deepseek.com",)))
+register_provider(ProviderAdapter("groq", "Groq", hosts=("groq.com",)))
+register_provider(ProviderAdapter(
+    "openrouter", "OpenRouter",
+    hosts=("openrouter.ai",),
+    extra_headers={
+        "HTTP-Referer": "https://github.com/chatlist",
+        "X-Title": "ChatList"
+    },
+    key_prefix="sk-or-v1-"
+))
+
+
+def get_provider(api_url: str, model_type: str = "") -> ProviderAdapter:
+    """
+    Определяет провайдера: сначала по хосту в URL, затем по model_type
+    
+    Неизвестный тип обрабатывается как OpenAI-совместимый.
+    """
+    url = api_url.lower()
+    # Автоматическое определение типа API по URL, если тип не указан или неправильный
+    for adapter in PROVIDERS.values():
+        if any(host in url for host in adapter.hosts):
+            return adapter
+    
+    # Определение по явно указанному типу
+    adapter = PROVIDERS.get(model_type.lower())
+    if adapter is None:
+        logger.warning(f"Неизвестный тип модели: {model_type}, пытаемся OpenAI-совместимый формат")
+        adapter = PROVIDERS["openai"]
+    return adapter
+
+
+class RequestTemplate:
     """
-    Отправляет запрос к Groq API
+    Заранее подготовленный запрос к конкретной модели
+    
+    Заголовки и неизменная часть тела вычисляются один раз, при каждом
+    запросе подставляется только промт.
+    """
+    def __init__(self, adapter: ProviderAdapter, api_url: str, api_key: str, api_id: str):
+        self.adapter = adapter
+        self.api_url = api_url
+        self.api_id = api_id
+        self.headers = adapter.build_headers(api_key)
+        self.body = {"model": api_id, **GENERATION_PARAMS}
+    
+    def build_payload(self, prompt: str, stream: bool = False) -> Dict:
+        """Формирует тело запроса с промтом"""
+        payload = dict(self.body)
+        payload["messages"] = [{"role": "user", "content": prompt}]
+        if stream:
+            payload["stream"] = True
+            # Без этого флага OpenAI-совместимые API не присылают usage в потоке
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+
+# Шаблоны запросов по (api_url, api_id, api_key_env, model_type)
+_templates: Dict[Tuple[str, str, str, str], RequestTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def get_request_template(model_info: Dict) -> Optional[RequestTemplate]:
+    """
+    Возвращает шаблон запроса для модели из БД
+    
+    API ключ читается из окружения только при создании шаблона.
+    
+    Returns:
+        Шаблон запроса или None, если данных модели или API ключа не хватает
+    """
+    api_key_env = model_info.get("api_key_env")
+    api_url = model_info.get("api_url")
+    api_id = model_info.get("api_id")
+    model_type = (model_info.get("model_type") or "").lower()
+    
+    if not api_key_env or not api_url or not api_id:
+        logger.error("Неполная информация о модели")
+        return None
+    
+    key = (api_url, api_id, api_key_env, model_type)
+    template = _templates.get(key)
+    if template is not None:
+        return template
+    
+    api_key = get_api_key(api_key_env)
+    if not api_key:
+        logger.error(f"API ключ не найден: {api_key_env}")
+        return None
+    
+    adapter = get_provider(api_url, model_type)
+    logger.info(f"Для модели {api_id} используется {adapter.title} API")
+    template = RequestTemplate(adapter, api_url, api_key, api_id)
+    with _templates_lock:
+        return _templates.setdefault(key, template)
+
+
+def reset_templates():
+    """Сбрасывает шаблоны запросов (например, после изменения API ключей)"""
+    with _templates_lock:
+        _templates.clear()
+
+
+def _bytes_received(response: Optional[requests.Response]) -> Optional[int]:
+    """Сколько байт тела ответа прочитано из сети"""
+    if response is None:
+        return None
+    try:
+        received = response.raw.tell()
+    except (AttributeError, OSError):
+        received = 0
+    return received or getattr(_request_io, "stream_bytes", 0)
+
+
+def execute_request(template: RequestTemplate, prompt: str, timeout: Optional[float] = None,
+                    stream: bool = False,
+                    on_delta: Optional[Callable[[str], None]] = None,
+                    stats: Optional[Dict] = None,
+                    cancel: Optional[CancelToken] = None) -> Optional[str]:
+    """
+    Отправляет запрос по шаблону и разбирает ответ
     
     Args:
-        api_url: URL API
-        api_key: API ключ
-        model_id: ID модели
+        template: Шаблон запроса к модели
         prompt: Текст промта
+        timeout: Таймаут запроса в секундах (если None, берется из настроек)
+        stream: Получать ответ потоком (server-sent events)
+        on_delta: Функция, получающая фрагменты ответа по мере генерации (при stream=True)
+        stats: Словарь для метрик запроса: connect_ms, ttfb_ms, total_ms, bytes_out,
+            bytes_in, status, retries, outcome (ok, error, http_error, timeout,
+            network_error, cancelled), prompt_tokens и completion_tokens
+            (если API их прислал)
+        cancel: Признак отмены (при отмене возвращается CANCELLED_RESPONSE)
         
     Returns:
-        Ответ модели или None в случае ошибки
+        Ответ модели или строка "Ошибка: ..." в случае ошибки
     """
+    title = template.adapter.title
+    model_id = template.api_id
+    if stats is None:
+        stats = {}
+    start = time.monotonic()
+    _request_io.stream_bytes = 0
+    response = None
     try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        logger.info(f"Отправка запроса к {title} API: модель {model_id}")
+        with _cancel_scope(cancel):
+            response = post_with_retry(
+                template.api_url,
+                headers=template.headers,
+                payload=template.build_payload(prompt, stream),
+                timeout=timeout or get_timeout(),
+                stream=stream,
+                model_id=model_id,
+                stats=stats,
+                cancel=cancel
+            )
+            response.raise_for_status()
+            result = template.adapter.parse_response(response, model_id, stream, on_delta, stats)
+        stats["outcome"] = "error" if result.startswith("Ошибка:") else "ok"
+        return result
         
-        data = {
-            "model": model_id,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
-        }
-        
-        logger.info(f"Отправка запроса к Groq API: модель {model_id}")
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=data,
-            timeout=get_timeout(),
-            proxies=get_proxies()
-        )
-        response.raise_for_status()
-        
-        result = response.json()
-        if "choices" in result and len(result["choices"]) > 0:
-            message = result["choices"][0]["message"]["content"]
-            logger.info(f"Получен ответ от Groq API: {len(message)} символов")
-            return message
-        else:
-            logger.error("Неожиданный формат ответа от Groq API")
-            return None
-            
     except requests.exceptions.Timeout:
-        error_msg = f"Таймаут при запросе к Groq API (модель: {model_id})"
+        stats["outcome"] = "timeout"
+        error_msg = f"Таймаут при запросе к {title} API (модель: {model_id})"
         logger.error(error_msg)
         return f"Ошибка: {error_msg}"
     except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP ошибка {e.response.status_code}: {e.response.text[:200] if e.response else str(e)}"
-        logger.error(f"Ошибка при запросе к Groq API: {error_msg}")
-        return f"Ошибка: {error_msg}"
+        stats["outcome"] = "http_error"
+        return f"Ошибка: {template.adapter.describe_http_error(e, model_id)}"
+    except RequestCancelled:
+        stats["outcome"] = "cancelled"
+        logger.info(f"Запрос к {title} API прерван: модель {model_id}")
+        return CANCELLED_RESPONSE
     except requests.exceptions.RequestException as e:
-        error_msg = f"Ошибка сети при запросе к Groq API: {str(e)}"
+        stats["outcome"] = "network_error"
+        error_msg = f"Ошибка сети при запросе к {title} API: {str(e)}"
         logger.error(error_msg)
         return f"Ошибка: {error_msg}"
     except Exception as e:
-        error_msg = f"Неожиданная ошибка при запросе к Groq API: {str(e)}"
+        stats["outcome"] = "error"
+        error_msg = f"Неожиданная ошибка при запросе к {title} API: {str(e)}"
         logger.error(error_msg)
         return f"Ошибка: {error_msg}"
+    finally:
+        stats["total_ms"] = (time.monotonic() - start) * 1000
+        if response is not None:
+            stats["status"] = response.status_code
+            stats["bytes_in"] = _bytes_received(response)
+            if stream:
+                # Потоковый ответ с ошибкой или HTML не читался read_sse_stream:
+                # закрываем его, чтобы вернуть соединение и слот ограничителя
+                response.close()
+
+
+def _send_with_provider(provider: str, api_url: str, api_key: str, model_id: str, prompt: str,
+                        timeout: Optional[float], stream: bool,
+                        on_delta: Optional[Callable[[str], None]],
+                        cancel: Optional[CancelToken] = None) -> Optional[str]:
+    """Отправляет запрос через указанного провайдера без кэша шаблонов"""
+    template = RequestTemplate(PROVIDERS[provider], api_url, api_key, model_id)
+    return execute_request(template, prompt, timeout, stream, on_delta, cancel=cancel)
+
+
+def send_openai_request(api_url: str, api_key: str, model_id: str, prompt: str,
+                        timeout: Optional[float] = None, stream: bool = False,
+                        on_delta: Optional[Callable[[str], None]] = None,
+                        cancel: Optional[CancelToken] = None) -> Optional[str]:
+    """Отправляет запрос к OpenAI API (см. execute_request)"""
+    return _send_with_provider("openai", api_url, api_key, model_id, prompt, timeout, stream, on_delta,
+                               cancel)
+
+
+def send_deepseek_request(api_url: str, api_key: str, model_id: str, prompt: str,
+                          timeout: Optional[float] = None, stream: bool = False,
+                          on_delta: Optional[Callable[[str], None]] = None,
+                          cancel: Optional[CancelToken] = None) -> Optional[str]:
+    """Отправляет запрос к DeepSeek API (см. execute_request)"""
+    return _send_with_provider("deepseek", api_url, api_key, model_id, prompt, timeout, stream, on_delta,
+                               cancel)
+
+
+def send_openrouter_request(api_url: str, api_key: str, model_id: str, prompt: str,
+                            timeout: Optional[float] = None, stream: bool = False,
+                            on_delta: Optional[Callable[[str], None]] = None,
+                            cancel: Optional[CancelToken] = None) -> Optional[str]:
+    """Отправляет запрос к OpenRouter API (см. execute_request)"""
+    return _send_with_provider("openrouter", api_url, api_key, model_id, prompt, timeout, stream, on_delta,
+                               cancel)
+
+
+def send_groq_request(api_url: str, api_key: str, model_id: str, prompt: str,
+                      timeout: Optional[float] = None, stream: bool = False,
+                      on_delta: Optional[Callable[[str], None]] = None,
+                      cancel: Optional[CancelToken] = None) -> Optional[str]:
+    """Отправляет запрос к Groq API (см. execute_request)"""
+    return _send_with_provider("groq", api_url, api_key, model_id, prompt, timeout, stream, on_delta,
+                               cancel)
+
+
+def make_request_fingerprint(api_url: str, api_id: str, prompt: str,
+                             params: Optional[Dict] = None) -> str:
+    """
+    Вычисляет отпечаток запроса: одинаковые (API, модель, промт, параметры)
+    дают одинаковый ключ
+    
+    Returns:
+        SHA-256 в шестнадцатеричном виде
+    """
+    payload = json.dumps(
+        {"api_url": api_url, "api_id": api_id, "prompt": prompt,
+         "params": params if params is not None else GENERATION_PARAMS},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы в один
+    
+    Первый вызов do() с ключом выполняет функцию, а вызовы с тем же ключом,
+    пришедшие до ее завершения, ждут и получают тот же результат (или то же
+    исключение). Счетчики: leaders - выполненные вызовы, coalesced -
+    вызовы, получившие чужой результат вместо собственного запроса.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Dict] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+    
+    def do(self, key: str, fn: Callable[[], Optional[str]],
+           cancel: Optional[CancelToken] = None) -> Tuple[Optional[str], bool]:
+        """
+        Выполняет fn() или дожидается уже выполняющегося вызова с тем же ключом
+        
+        Args:
+            key: Ключ вызова
+            fn: Функция, выполняемая первым вызовом
+            cancel: Признак отмены, прерывающий ожидание чужого вызова
+        
+        Returns:
+            Кортеж (результат, получен ли он от другого вызова)
+            
+        Raises:
+            RequestCancelled: если ожидание чужого вызова отменено через cancel
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        
+        if not leader:
+            while not call["done"].wait(CANCEL_POLL_INTERVAL if cancel is not None else None):
+                cancel.raise_if_cancelled()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        
+        try:
+            call["result"] = fn()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+        return call["result"], False
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Возвращает копию счетчиков"""
+        with self._lock:
+            return dict(self._stats)
+
+
+# Одинаковые запросы, выполняющиеся одновременно (ключ - отпечаток запроса)
+_inflight = SingleFlight()
+
+
+def get_coalescing_stats() -> Dict[str, int]:
+    """
+    Возвращает счетчики объединения одинаковых запросов
+    
+    Returns:
+        Словарь: leaders - запросов отправлено в сеть, coalesced - сколько
+        вызовов получили ответ уже выполнявшегося запроса (сэкономлено запросов)
+    """
+    return _inflight.get_stats()
+
+
+def _get_cache_settings() -> Optional[Dict]:
+    """Возвращает настройки кэша ответов или None, если кэш выключен"""
+    try:
+        if get_network_setting("cache_enabled", "1") != "1":
+            return None
+        return {
+            "ttl": float(get_network_setting("cache_ttl", "86400")),
+            "max_entries": int(get_network_setting("cache_max_entries", "1000"))
+        }
+    except ValueError as e:
+        logger.warning(f"Не удалось прочитать настройки кэша: {e}")
+        return None
 
 
-def send_request(model_info: Dict, prompt: str) -> Optional[str]:
+def send_request(model_info: Dict, prompt: str, timeout: Optional[float] = None,
+                 stream: bool = False, on_delta: Optional[Callable[[str], None]] = None,
+                 use_cache: bool = True, stats: Optional[Dict] = None,
+                 coalesce: bool = True,
+                 cancel: Optional[CancelToken] = None,
+                 hedge: bool = False) -> Optional[str]:
     """
     Универсальная функция для отправки запроса к API
     
-    Определяет тип API по полю model_type и вызывает соответствующую функцию
+    Определяет провайдера по URL или полю model_type (см. get_provider)
+    и отправляет запрос по шаблону модели
     
     Args:
         model_info: Словарь с информацией о модели из БД
         prompt: Текст промта
+        timeout: Таймаут запроса в секундах (если None, берется из настроек)
+        stream: Получать ответ потоком (server-sent events)
+        on_delta: Функция, получающая фрагменты ответа по мере генерации (при stream=True)
+        use_cache: Искать ответ в кэше перед отправкой (False - всегда идти в сеть)
+        stats: Словарь, в который записываются сведения о запросе
+            (ключи "cached" - ответ взят из кэша, "coalesced" - ответ получен
+            от такого же запроса, выполнявшегося одновременно, метрики
+            отправленного запроса (см. execute_request) и cost - стоимость
+            по ценам модели)
+        coalesce: Объединять с одновременными одинаковыми запросами
+            (False - всегда отправлять собственный запрос)
+        cancel: Признак отмены запуска (отмененный запрос возвращает
+            CANCELLED_RESPONSE)
+        hedge: Запрос - дубль медленного запроса (колонка hedge в request_metrics)
         
     Returns:
         Ответ модели или None в случае ошибки
     """
-    api_key_env = model_info.get("api_key_env")
-    api_url = model_info.get("api_url")
-    api_id = model_info.get("api_id")
-    model_type = model_info.get("model_type", "").lower()
-    
-    if not api_key_env or not api_url or not api_id:
-        logger.error("Неполная информация о модели")
+    if cancel is not None and cancel.cancelled:
+        return CANCELLED_RESPONSE
+    template = get_request_template(model_info)
+    if template is None:
         return None
     
-    api_key = get_api_key(api_key_env)
-    if not api_key:
-        logger.error(f"API ключ не найден: {api_key_env}")
-        return None
+    fingerprint = make_request_fingerprint(template.api_url, template.api_id, prompt)
+    cache_settings = _get_cache_settings() if use_cache else None
+    cache_key = None
+    if cache_settings:
+        import db
+        cache_key = fingerprint
+        try:
+            cached = db.get_cached_response(cache_key, cache_settings["ttl"])
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш ответов: {e}")
+            cached = None
+        if cached is not None:
+            logger.info(f"Ответ для {template.api_id} взят из кэша: {len(cached)} символов")
+            if stream and on_delta:
+                on_delta(cached)
+            if stats is not None:
+                stats["cached"] = True
+            return cached
     
-    # Автоматическое определение типа API по URL, если тип не указан или неправильный
-    if "openrouter.ai" in api_url.lower():
-        logger.info(f"Автоопределение: используем OpenRouter API для {api_id}")
-        return send_openrouter_request(api_url, api_key, api_id, prompt)
-    elif "deepseek.com" in api_url.lower():
-        logger.info(f"Автоопределение: используем DeepSeek API для {api_id}")
-        return send_deepseek_request(api_url, api_key, api_id, prompt)
-    elif "groq.com" in api_url.lower():
-        logger.info(f"Автоопределение: используем Groq API для {api_id}")
-        return send_groq_request(api_url, api_key, api_id, prompt)
+    if stats is not None:
+        stats["cached"] = False
     
-    # Определение по явно указанному типу
-    if model_type == "openai":
-        return send_openai_request(api_url, api_key, api_id, prompt)
-    elif model_type == "deepseek":
-        return send_deepseek_request(api_url, api_key, api_id, prompt)
-    elif model_type == "groq":
-        return send_groq_request(api_url, api_key, api_id, prompt)
-    elif model_type == "openrouter":
-        return send_openrouter_request(api_url, api_key, api_id, prompt)
-    else:
-        logger.warning(f"Неизвестный тип модели: {model_type}, пытаемся OpenAI-совместимый формат")
-        # Попробуем использовать OpenAI-совместимый формат
-        return send_openai_request(api_url, api_key, api_id, prompt)
-
+    def fetch() -> Optional[str]:
+        call_stats: Dict = {}
+        result = execute_request(template, prompt, timeout, stream, on_delta, call_stats, cancel)
+        call_stats["hedge"] = hedge
+        if model_info.get("id") is not None:
+            try:
+                import db
+                price = db.get_model_price(model_info["id"])
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать цены модели: {e}")
+                price = None
+            call_stats["cost"] = calculate_cost(price, call_stats.get("prompt_tokens"),
+                                                call_stats.get("completion_tokens"))
+        record_request_metrics(model_info.get("id"), call_stats)
+        if stats is not None:
+            stats.update(call_stats)
+        # Ошибки не кэшируем, чтобы следующий запуск повторил запрос
+        if cache_key and result and not result.startswith("Ошибка:"):
+            try:
+                import db
+                db.save_cached_response(cache_key, result, cache_settings["max_entries"])
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить ответ в кэш: {e}")
+        return result
+    
+    if not coalesce:
+        return fetch()
+    
+    try:
+        response, shared = _inflight.do(fingerprint, fetch, cancel)
+        own_cancelled = cancel is not None and cancel.cancelled
+        if shared and response == CANCELLED_RESPONSE and not own_cancelled:
+            # Отмена касалась только первого вызова - ожидавшие повторяют запрос
+            response, shared = _inflight.do(fingerprint, fetch, cancel)
+    except RequestCancelled:
+        return CANCELLED_RESPONSE
+    if shared:
+        logger.info(f"Ответ для {template.api_id} получен от такого же запроса, "
+                    f"выполнявшегося одновременно")
+        if stream and on_delta and response and not response.startswith("Ошибка:"):
+            on_delta(response)
+    if stats is not None:
+        stats["coalesced"] = shared
+    
+    return response
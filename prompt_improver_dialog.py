@@ -180,6 +180,8 @@ class PromptImproverDialog(QDialog):
         try:
             db.add_prompt(improved, tags)
             QMessageBox.information(self, "Успех", "Промт сохранен в базу данных")
+        except ValueError as e:
+            QMessageBox.warning(self, "Предупреждение", f"Промт не сохранен: {e}")
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить промт: {e}")
         
@@ -1,13 +1,52 @@
 """
 Диалог для управления промтами
 """
+import json
+import re
+from typing import List, Optional, Tuple
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
     QTableWidgetItem, QHeaderView, QMessageBox, QDialogButtonBox,
-    QFormLayout, QTextEdit, QLineEdit, QLabel
+    QFormLayout, QTextEdit, QLineEdit, QLabel, QFileDialog
 )
 from PyQt5.QtCore import Qt
 import db
+from highlight_delegate import HighlightDelegate
+
+
+def read_prompts_file(filename: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Читает промты из файла для импорта
+    
+    Форматы:
+      - JSON: список строк или объектов {"prompt": ..., "tags": ...}
+      - текст: промты, разделенные пустыми строками
+    
+    Args:
+        filename: Путь к файлу (.json или текстовый)
+        
+    Returns:
+        Пары (текст промта, теги или None)
+        
+    Raises:
+        ValueError: Если JSON не является списком промтов
+    """
+    with open(filename, "r", encoding="utf-8") as f:
+        content = f.read()
+    
+    if filename.lower().endswith(".json"):
+        data = json.loads(content)
+        if not isinstance(data, list):
+            raise ValueError("ожидается JSON-список промтов")
+        prompts = []
+        for item in data:
+            if isinstance(item, str):
+                prompts.append((item.strip(), None))
+            elif isinstance(item, dict) and isinstance(item.get("prompt"), str):
+                prompts.append((item["prompt"].strip(), item.get("tags") or None))
+        return prompts
+    
+    return [(block.strip(), None) for block in re.split(r"\n\s*\n", content) if block.strip()]
 
 
 class PromptEditDialog(QDialog):
@@ -81,6 +120,11 @@ class PromptsDialog(QDialog):
         self.delete_btn.clicked.connect(self.on_delete_prompt)
         buttons_layout.addWidget(self.delete_btn)
         
+        self.import_btn = QPushButton("Импорт...")
+        self.import_btn.setToolTip("JSON-список промтов или текстовый файл, где промты разделены пустыми строками")
+        self.import_btn.clicked.connect(self.on_import_prompts)
+        buttons_layout.addWidget(self.import_btn)
+        
         buttons_layout.addStretch()
         
         self.refresh_btn = QPushButton("Обновить")
@@ -99,6 +143,8 @@ class PromptsDialog(QDialog):
         self.prompts_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeToContents)
         self.prompts_table.setSelectionBehavior(QTableWidget.SelectRows)
         self.prompts_table.setAlternatingRowColors(True)
+        # Найденные слова во фрагментах промтов подсвечиваются
+        self.prompts_table.setItemDelegateForColumn(2, HighlightDelegate(self.prompts_table))
         layout.addWidget(self.prompts_table)
         
         # Кнопки закрытия
@@ -123,7 +169,10 @@ class PromptsDialog(QDialog):
             self.prompts_table.setItem(row, 0, QTableWidgetItem(str(prompt["id"])))
             self.prompts_table.setItem(row, 1, QTableWidgetItem(prompt["date"][:19] if len(prompt["date"]) > 19 else prompt["date"]))
             
-            prompt_text = prompt["prompt"][:100] + "..." if len(prompt["prompt"]) > 100 else prompt["prompt"]
+            if prompt.get("snippet"):
+                prompt_text = prompt["snippet"]
+            else:
+                prompt_text = prompt["prompt"][:100] + "..." if len(prompt["prompt"]) > 100 else prompt["prompt"]
             self.prompts_table.setItem(row, 2, QTableWidgetItem(prompt_text))
             
             tags = prompt.get("tags", "") or ""
@@ -162,9 +211,35 @@ class PromptsDialog(QDialog):
                 db.add_prompt(data["prompt"], data["tags"])
                 QMessageBox.information(self, "Успех", "Промт добавлен")
                 self.load_prompts()
+            except ValueError as e:
+                QMessageBox.warning(self, "Предупреждение", f"Промт не добавлен: {e}")
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось добавить промт: {e}")
     
+    def on_import_prompts(self):
+        """Импорт промтов из файла (уже существующие пропускаются)"""
+        filename, _ = QFileDialog.getOpenFileName(
+            self,
+            "Импорт промтов",
+            "",
+            "JSON (*.json);;Текстовые файлы (*.txt *.md);;Все файлы (*)"
+        )
+        if not filename:
+            return
+        
+        try:
+            prompts = read_prompts_file(filename)
+            added = db.import_prompts(prompts)
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось импортировать промты: {e}")
+            return
+        
+        QMessageBox.information(
+            self, "Успех",
+            f"Добавлено промтов: {added}\nУже были в базе или повторялись: {len(prompts) - added}"
+        )
+        self.load_prompts()
+    
     def on_edit_prompt(self):
         """Редактирование промта"""
         prompt_id = self.get_selected_prompt_id()
@@ -184,13 +259,14 @@ class PromptsDialog(QDialog):
                 QMessageBox.warning(self, "Предупреждение", "Введите текст промта")
                 return
             
-            # Обновление промта (нужно добавить функцию в db.py)
             try:
-                # Пока просто удаляем и создаем заново
-                db.delete_prompt(prompt_id)
-                db.add_prompt(data["prompt"], data["tags"])
-                QMessageBox.information(self, "Успех", "Промт обновлен")
+                if db.update_prompt(prompt_id, data["prompt"], data["tags"]):
+                    QMessageBox.information(self, "Успех", "Промт обновлен")
+                else:
+                    QMessageBox.warning(self, "Предупреждение", "Промт не найден")
                 self.load_prompts()
+            except ValueError as e:
+                QMessageBox.warning(self, "Предупреждение", f"Промт не изменен: {e}")
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось обновить промт: {e}")
     
@@ -1,16 +1,114 @@
 """
 Диалог для просмотра сохраненных результатов
 """
+from typing import Dict, List, Optional
 from PyQt5.QtWidgets import (
-    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
-    QTableWidgetItem, QHeaderView, QMessageBox, QDialogButtonBox,
-    QLineEdit, QLabel
+    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTableView,
+    QHeaderView, QMessageBox, QDialogButtonBox, QLineEdit, QLabel
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
 import db
+from highlight_delegate import HighlightDelegate
 from markdown_viewer import MarkdownViewerDialog
 
 
+class ResultsTableModel(QAbstractTableModel):
+    """
+    Модель таблицы результатов с подгрузкой страниц при прокрутке
+    
+    В памяти хранятся только загруженные страницы с сокращенными текстами
+    (db.get_results_page); следующую страницу представление запрашивает
+    через canFetchMore/fetchMore, когда таблицу прокручивают до конца.
+    """
+    headers = ["ID", "Дата", "Модель", "Промт", "Ответ"]
+    load_failed = pyqtSignal(str)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows: List[Dict] = []
+        self.query: Optional[str] = None
+        self.next_key = None
+        self.has_more = False
+    
+    def load(self, query: Optional[str] = None):
+        """Сбрасывает таблицу и загружает первую страницу (с query - результаты поиска)"""
+        self.beginResetModel()
+        self.rows = []
+        self.query = query
+        self.next_key = None
+        self.has_more = True
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        result = self.rows[index.row()]
+        column = index.column()
+        
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return str(result["id"])
+            if column == 1:
+                return result["date"][:19]
+            if column == 2:
+                return result["model_name"] or "Неизвестно"
+            if column == 3:
+                prompt_text = result["prompt_text"] or ""
+                return prompt_text[:80] + "..." if len(prompt_text) > 80 else prompt_text
+            if column == 4:
+                if result.get("snippet"):
+                    return result["snippet"]
+                response = result["response_preview"] or ""
+                return response[:200] + "..." if result["response_length"] > 200 else response
+        elif role == Qt.ToolTipRole and column == 4:
+            # Начало ответа; полный текст - по кнопке "Открыть"
+            preview = result["response_preview"] or ""
+            return preview + "..." if result["response_length"] > len(preview) else preview
+        return None
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more
+    
+    def fetchMore(self, parent=QModelIndex()):
+        """Загружает следующую страницу результатов"""
+        if not self.canFetchMore(parent):
+            return
+        try:
+            rows, next_key = db.get_results_page(self.next_key, query=self.query)
+        except Exception as e:
+            self.has_more = False
+            self.load_failed.emit(str(e))
+            return
+        self.next_key = next_key
+        self.has_more = next_key is not None
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+    
+    def result_at(self, row: int) -> Optional[Dict]:
+        """Возвращает загруженный результат по номеру строки"""
+        return self.rows[row] if 0 <= row < len(self.rows) else None
+    
+    def remove_row(self, row: int):
+        """Убирает строку из таблицы (после удаления результата из базы)"""
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.rows[row]
+        self.endRemoveRows()
+
+
 class ResultsDialog(QDialog):
     """Диалог для просмотра сохраненных результатов"""
     def __init__(self, parent=None):
@@ -31,34 +129,48 @@ class ResultsDialog(QDialog):
         
         # Кнопки управления
         buttons_layout = QHBoxLayout()
+        self.open_btn = QPushButton("Открыть")
+        self.open_btn.clicked.connect(self.on_open_selected)
+        buttons_layout.addWidget(self.open_btn)
+        
         self.delete_btn = QPushButton("Удалить")
         self.delete_btn.clicked.connect(self.on_delete_result)
         buttons_layout.addWidget(self.delete_btn)
         
         buttons_layout.addStretch()
         
+        self.count_label = QLabel()
+        buttons_layout.addWidget(self.count_label)
+        
         self.refresh_btn = QPushButton("Обновить")
-        self.refresh_btn.clicked.connect(self.load_results)
+        self.refresh_btn.clicked.connect(self.on_search)
         buttons_layout.addWidget(self.refresh_btn)
         
         layout.addLayout(buttons_layout)
         
-        # Таблица результатов
-        self.results_table = QTableWidget()
-        self.results_table.setColumnCount(6)
-        self.results_table.setHorizontalHeaderLabels([
-            "ID", "Дата", "Модель", "Промт", "Ответ", "Действия"
-        ])
+        # Таблица результатов (страницы подгружаются при прокрутке)
+        self.results_model = ResultsTableModel(self)
+        self.results_model.load_failed.connect(self.on_load_failed)
+        self.results_model.modelReset.connect(self.update_count_label)
+        self.results_model.rowsInserted.connect(self.update_count_label)
+        self.results_model.rowsRemoved.connect(self.update_count_label)
+        
+        self.results_table = QTableView()
+        self.results_table.setModel(self.results_model)
         self.results_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
         self.results_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
         self.results_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeToContents)
         self.results_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.Stretch)
         self.results_table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
-        self.results_table.horizontalHeader().setSectionResizeMode(5, QHeaderView.ResizeToContents)
+        self.results_table.verticalHeader().setDefaultSectionSize(80)
         # Включаем перенос текста
         self.results_table.setWordWrap(True)
-        self.results_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.results_table.setSelectionBehavior(QTableView.SelectRows)
+        self.results_table.setSelectionMode(QTableView.SingleSelection)
         self.results_table.setAlternatingRowColors(True)
+        # Найденные слова во фрагментах ответов подсвечиваются
+        self.results_table.setItemDelegateForColumn(4, HighlightDelegate(self.results_table))
+        self.results_table.doubleClicked.connect(lambda index: self.on_open_response(index.row()))
         layout.addWidget(self.results_table)
         
         # Кнопки закрытия
@@ -71,64 +183,37 @@ class ResultsDialog(QDialog):
         self.load_results()
     
     def load_results(self, search_query=None):
-        """Загружает список результатов в таблицу"""
-        if search_query:
-            results_list = db.search_results(search_query)
-        else:
-            results_list = db.get_results()
-        
-        self.results_table.setRowCount(len(results_list))
-        
-        for row, result in enumerate(results_list):
-            self.results_table.setItem(row, 0, QTableWidgetItem(str(result["id"])))
-            
-            date = result["date"][:19] if len(result["date"]) > 19 else result["date"]
-            self.results_table.setItem(row, 1, QTableWidgetItem(date))
-            
-            model_name = result.get("model_name", "Неизвестно") or "Неизвестно"
-            self.results_table.setItem(row, 2, QTableWidgetItem(model_name))
-            
-            prompt_text = result.get("prompt_text", "")[:80] + "..." if len(result.get("prompt_text", "")) > 80 else result.get("prompt_text", "")
-            self.results_table.setItem(row, 3, QTableWidgetItem(prompt_text))
-            
-            response = result.get("response", "")[:200] + "..." if len(result.get("response", "")) > 200 else result.get("response", "")
-            response_item = QTableWidgetItem(response)
-            response_item.setToolTip(result.get("response", ""))  # Полный текст в подсказке
-            self.results_table.setItem(row, 4, response_item)
-            
-            # Кнопка "Открыть" для просмотра полного ответа в markdown
-            open_btn = QPushButton("Открыть")
-            open_btn.clicked.connect(lambda checked, r=row: self.on_open_response(r))
-            self.results_table.setCellWidget(row, 5, open_btn)
-            
-            # Делаем все ячейки нередактируемыми
-            for col in range(5):
-                item = self.results_table.item(row, col)
-                if item:
-                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-        
-        # Автоматически подстраиваем высоту строк
-        self.results_table.resizeRowsToContents()
-        # Устанавливаем минимальную высоту строк
-        for row in range(self.results_table.rowCount()):
-            self.results_table.setRowHeight(row, max(80, self.results_table.rowHeight(row)))
+        """Загружает первую страницу результатов в таблицу"""
+        self.results_model.load(search_query)
     
     def on_search(self):
         """Обработчик поиска"""
         query = self.search_edit.text().strip()
         self.load_results(query if query else None)
     
+    def update_count_label(self):
+        """Показывает, сколько результатов загружено"""
+        count = self.results_model.rowCount()
+        more = " (прокрутите, чтобы загрузить еще)" if self.results_model.has_more else ""
+        self.count_label.setText(f"Показано: {count}{more}")
+    
+    def on_load_failed(self, error: str):
+        """Сообщает об ошибке загрузки страницы результатов"""
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить результаты: {error}")
+    
+    def get_selected_row(self) -> int:
+        """Возвращает номер выбранной строки (-1 - ничего не выбрано)"""
+        index = self.results_table.currentIndex()
+        return index.row() if index.isValid() else -1
+    
     def get_selected_result_id(self):
         """Возвращает ID выбранного результата"""
-        current_row = self.results_table.currentRow()
-        if current_row >= 0:
-            item = self.results_table.item(current_row, 0)
-            if item:
-                return int(item.text())
-        return None
+        result = self.results_model.result_at(self.get_selected_row())
+        return result["id"] if result else None
     
     def on_delete_result(self):
         """Удаление результата"""
+        row = self.get_selected_row()
         result_id = self.get_selected_result_id()
         if not result_id:
             QMessageBox.warning(self, "Предупреждение", "Выберите результат для удаления")
@@ -142,27 +227,30 @@ class ResultsDialog(QDialog):
         if reply == QMessageBox.Yes:
             try:
                 if db.delete_result(result_id):
+                    # Убираем строку, не перезагружая уже загруженные страницы
+                    self.results_model.remove_row(row)
                     QMessageBox.information(self, "Успех", "Результат удален")
-                    self.load_results()
                 else:
                     QMessageBox.warning(self, "Предупреждение", "Не удалось удалить результат")
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", f"Ошибка при удалении: {e}")
     
+    def on_open_selected(self):
+        """Обработчик кнопки 'Открыть'"""
+        row = self.get_selected_row()
+        if row < 0:
+            QMessageBox.warning(self, "Предупреждение", "Выберите результат для просмотра")
+            return
+        self.on_open_response(row)
+    
     def on_open_response(self, row: int):
         """Открывает полный ответ в диалоге с форматированным markdown"""
-        if row < 0 or row >= self.results_table.rowCount():
+        result = self.results_model.result_at(row)
+        if not result:
             return
         
-        # Получаем ID результата из первой колонки
-        id_item = self.results_table.item(row, 0)
-        model_item = self.results_table.item(row, 2)
-        
-        if not id_item or not model_item:
-            return
-        
-        result_id = int(id_item.text())
-        model_name = model_item.text()
+        result_id = result["id"]
+        model_name = result["model_name"] or "Неизвестно"
         
         # Получаем полный ответ из базы данных
         try:
@@ -183,7 +271,3 @@ class ResultsDialog(QDialog):
         # Открываем диалог с форматированным markdown
         dialog = MarkdownViewerDialog(model_name, full_response, self)
         dialog.exec_()
-
-
-
-
@@ -4,7 +4,7 @@
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
     QComboBox, QSpinBox, QFormLayout, QDialogButtonBox, QMessageBox,
-    QLineEdit, QTabWidget, QWidget, QTextEdit
+    QLineEdit, QTabWidget, QWidget, QTextEdit, QCheckBox, QDoubleSpinBox
 )
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
@@ -89,9 +89,97 @@ class SettingsDialog(QDialog):
         api_keys_layout.addStretch()
         api_keys_tab.setLayout(api_keys_layout)
         
+        # Вкладка "Запросы"
+        requests_tab = QWidget()
+        requests_layout = QVBoxLayout()
+        requests_form = QFormLayout()
+        
+        # Таймаут одной модели
+        self.timeout_spin = QSpinBox()
+        self.timeout_spin.setMinimum(5)
+        self.timeout_spin.setMaximum(600)
+        self.timeout_spin.setValue(30)
+        self.timeout_spin.setSuffix(" с")
+        requests_form.addRow("Таймаут модели:", self.timeout_spin)
+        
+        # Таймауты по истории времени ответа каждой модели
+        self.adaptive_timeout_check = QCheckBox("Подбирать таймаут по истории ответов модели")
+        self.adaptive_timeout_check.setToolTip(
+            "Таймаут модели = 99-й перцентиль ее времени ответа × 1.5 (от 5 до 120 с);\n"
+            "пока замеров мало, действует общий таймаут. Ручной таймаут модели важнее"
+        )
+        requests_form.addRow("Адаптивный таймаут:", self.adaptive_timeout_check)
+        
+        # Сколько моделей опрашивать одновременно
+        self.max_concurrent_spin = QSpinBox()
+        self.max_concurrent_spin.setMinimum(1)
+        self.max_concurrent_spin.setMaximum(64)
+        self.max_concurrent_spin.setValue(8)
+        requests_form.addRow("Параллельных запросов:", self.max_concurrent_spin)
+        
+        # Общий лимит времени на запуск
+        self.run_timeout_spin = QSpinBox()
+        self.run_timeout_spin.setMinimum(10)
+        self.run_timeout_spin.setMaximum(3600)
+        self.run_timeout_spin.setValue(120)
+        self.run_timeout_spin.setSuffix(" с")
+        requests_form.addRow("Общий таймаут запуска:", self.run_timeout_spin)
+        
+        # Потоковое получение ответов
+        self.stream_check = QCheckBox("Показывать ответы по мере генерации")
+        self.stream_check.setChecked(True)
+        requests_form.addRow("Потоковый режим:", self.stream_check)
+        
+        # Дублирование запросов к медленно отвечающим моделям
+        self.hedge_check = QCheckBox("Дублировать запрос, если модель отвечает дольше обычного")
+        self.hedge_check.setToolTip(
+            "Если модель не ответила за 90-й перцентиль своего времени ответа,\n"
+            "отправляется второй такой же запрос; используется первый ответ"
+        )
+        requests_form.addRow("Дублирование:", self.hedge_check)
+        
+        # Дневной бюджет
+        self.daily_budget_spin = QDoubleSpinBox()
+        self.daily_budget_spin.setDecimals(2)
+        self.daily_budget_spin.setMaximum(100000)
+        self.daily_budget_spin.setPrefix("$ ")
+        self.daily_budget_spin.setSpecialValueText("без ограничения")
+        self.daily_budget_spin.setToolTip(
+            "Запуск не начнется, если потраченное сегодня вместе с оценкой\n"
+            "стоимости запуска превысит бюджет (по ценам моделей)"
+        )
+        requests_form.addRow("Дневной бюджет:", self.daily_budget_spin)
+        
+        # Кэш ответов
+        self.cache_check = QCheckBox("Повторно использовать ответы на одинаковые запросы")
+        self.cache_check.setChecked(True)
+        requests_form.addRow("Кэш ответов:", self.cache_check)
+        
+        self.cache_ttl_spin = QSpinBox()
+        self.cache_ttl_spin.setMinimum(1)
+        self.cache_ttl_spin.setMaximum(24 * 365)
+        self.cache_ttl_spin.setValue(24)
+        self.cache_ttl_spin.setSuffix(" ч")
+        requests_form.addRow("Срок хранения кэша:", self.cache_ttl_spin)
+        
+        self.cache_max_spin = QSpinBox()
+        self.cache_max_spin.setMinimum(10)
+        self.cache_max_spin.setMaximum(100000)
+        self.cache_max_spin.setValue(1000)
+        requests_form.addRow("Записей в кэше (макс.):", self.cache_max_spin)
+        
+        clear_cache_btn = QPushButton("Очистить кэш")
+        clear_cache_btn.clicked.connect(self.on_clear_cache)
+        requests_form.addRow("", clear_cache_btn)
+        
+        requests_layout.addLayout(requests_form)
+        requests_layout.addStretch()
+        requests_tab.setLayout(requests_layout)
+        
         # Добавляем вкладки
         self.tabs.addTab(appearance_tab, "Внешний вид")
         self.tabs.addTab(api_keys_tab, "API ключи")
+        self.tabs.addTab(requests_tab, "Запросы")
         
         layout.addWidget(self.tabs)
         
@@ -123,6 +211,30 @@ class SettingsDialog(QDialog):
         except ValueError:
             self.font_size_spin.setValue(10)
         
+        # Загружаем настройки запросов
+        for spin, key, default in (
+            (self.timeout_spin, "timeout", 30),
+            (self.max_concurrent_spin, "max_concurrent_requests", 8),
+            (self.run_timeout_spin, "run_timeout", 120),
+        ):
+            try:
+                spin.setValue(int(db.get_setting(key, str(default))))
+            except (TypeError, ValueError):
+                spin.setValue(default)
+        self.stream_check.setChecked(db.get_setting("stream_responses", "1") == "1")
+        self.hedge_check.setChecked(db.get_setting("hedging_enabled", "0") == "1")
+        self.adaptive_timeout_check.setChecked(db.get_setting("adaptive_timeouts", "1") == "1")
+        try:
+            self.daily_budget_spin.setValue(float(db.get_setting("daily_budget", "0")))
+        except (TypeError, ValueError):
+            pass
+        self.cache_check.setChecked(db.get_setting("cache_enabled", "1") == "1")
+        try:
+            self.cache_ttl_spin.setValue(int(float(db.get_setting("cache_ttl", "86400")) // 3600))
+            self.cache_max_spin.setValue(int(db.get_setting("cache_max_entries", "1000")))
+        except (TypeError, ValueError):
+            pass
+        
         # Загружаем API ключи из .env файла
         # Ищем .env в пользовательской папке данных
         env_path = os.path.join(get_app_data_dir(), '.env')
@@ -195,6 +307,22 @@ class SettingsDialog(QDialog):
             db.save_setting("theme", theme)
             db.save_setting("font_size", font_size)
             
+            # Сохраняем настройки запросов
+            db.save_setting("timeout", str(self.timeout_spin.value()))
+            db.save_setting("max_concurrent_requests", str(self.max_concurrent_spin.value()))
+            db.save_setting("run_timeout", str(self.run_timeout_spin.value()))
+            db.save_setting("stream_responses", "1" if self.stream_check.isChecked() else "0")
+            db.save_setting("hedging_enabled", "1" if self.hedge_check.isChecked() else "0")
+            db.save_setting("adaptive_timeouts", "1" if self.adaptive_timeout_check.isChecked() else "0")
+            db.save_setting("daily_budget", f"{self.daily_budget_spin.value():g}")
+            db.save_setting("cache_enabled", "1" if self.cache_check.isChecked() else "0")
+            db.save_setting("cache_ttl", str(self.cache_ttl_spin.value() * 3600))
+            db.save_setting("cache_max_entries", str(self.cache_max_spin.value()))
+            
+            # Сетевой модуль держит снимок настроек - перечитываем его
+            import network
+            network.reload_settings()
+            
             # Сохраняем API ключи
             api_keys_saved = self.save_api_keys()
             
@@ -213,6 +341,14 @@ class SettingsDialog(QDialog):
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить настройки: {e}")
     
+    def on_clear_cache(self):
+        """Очищает кэш ответов моделей"""
+        try:
+            deleted = db.clear_response_cache()
+            QMessageBox.information(self, "Кэш", f"Удалено записей из кэша: {deleted}")
+        except Exception as e:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось очистить кэш: {e}")
+    
     def get_theme(self) -> str:
         """Возвращает выбранную тему"""
         return self.theme_combo.currentData()
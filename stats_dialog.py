@@ -0,0 +1,115 @@
+"""
+Диалог статистики запросов к моделям
+"""
+import time
+from PyQt5.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTableWidget,
+    QTableWidgetItem, QHeaderView, QDialogButtonBox, QComboBox, QLabel
+)
+from PyQt5.QtCore import Qt
+import db
+import network
+
+
+# Периоды статистики: (название, длительность в секундах; None - за все время)
+PERIODS = [
+    ("За сутки", 86400),
+    ("За неделю", 7 * 86400),
+    ("За месяц", 30 * 86400),
+    ("За все время", None),
+]
+
+
+class StatsDialog(QDialog):
+    """Диалог со сводкой времени ответа, расхода токенов и стоимости по моделям"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Статистика моделей")
+        self.setMinimumSize(1000, 500)
+        
+        layout = QVBoxLayout()
+        
+        # Выбор периода
+        period_layout = QHBoxLayout()
+        period_layout.addWidget(QLabel("Период:"))
+        self.period_combo = QComboBox()
+        for title, seconds in PERIODS:
+            self.period_combo.addItem(title, seconds)
+        self.period_combo.setCurrentIndex(1)
+        self.period_combo.currentIndexChanged.connect(self.load_stats)
+        period_layout.addWidget(self.period_combo)
+        period_layout.addStretch()
+        
+        self.refresh_btn = QPushButton("Обновить")
+        self.refresh_btn.clicked.connect(self.load_stats)
+        period_layout.addWidget(self.refresh_btn)
+        layout.addLayout(period_layout)
+        
+        # Таблица статистики
+        self.headers = [
+            "Модель", "Запросов", "Ошибок", "Повторов", "Дублей", "Среднее время, с",
+            "Макс. время, с", "До ответа, с", "Токенов", "Ток/с", "Стоимость, $"
+        ]
+        self.stats_table = QTableWidget()
+        self.stats_table.setColumnCount(len(self.headers))
+        self.stats_table.setHorizontalHeaderLabels(self.headers)
+        self.stats_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        for col in range(1, len(self.headers)):
+            self.stats_table.horizontalHeader().setSectionResizeMode(col, QHeaderView.ResizeToContents)
+        self.stats_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.stats_table.setAlternatingRowColors(True)
+        layout.addWidget(self.stats_table)
+        
+        self.total_label = QLabel()
+        layout.addWidget(self.total_label)
+        
+        # Кнопки закрытия
+        close_buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        close_buttons.rejected.connect(self.accept)
+        layout.addWidget(close_buttons)
+        
+        self.setLayout(layout)
+        
+        self.load_stats()
+    
+    def load_stats(self):
+        """Загружает сводку по моделям за выбранный период (самые медленные - сверху)"""
+        seconds = self.period_combo.currentData()
+        since = time.time() - seconds if seconds else None
+        # Метрики пишутся пачками раз в MetricsWriter.FLUSH_INTERVAL: записываем
+        # накопленные, чтобы в сводку попали только что завершенные запросы
+        network.flush_metrics()
+        rows = db.get_request_metrics_summary(since)
+        
+        self.stats_table.setRowCount(len(rows))
+        total_cost = 0.0
+        total_tokens = 0
+        for row, stats in enumerate(rows):
+            tokens = (stats["prompt_tokens"] or 0) + (stats["completion_tokens"] or 0)
+            total_tokens += tokens
+            total_cost += stats["cost"] or 0.0
+            values = [
+                stats["model_name"] or "(удалена)",
+                str(stats["requests"]),
+                str(stats["errors"] or 0),
+                str(stats["retries"] or 0),
+                str(stats["hedges"] or 0),
+                self.format_seconds(stats["avg_total_ms"]),
+                self.format_seconds(stats["max_total_ms"]),
+                self.format_seconds(stats["avg_ttfb_ms"]),
+                str(tokens) if tokens else "",
+                f"{stats['tokens_per_second']:.1f}" if stats["tokens_per_second"] else "",
+                f"{stats['cost']:.4f}" if stats["cost"] is not None else "",
+            ]
+            for col, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+                if col > 0:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.stats_table.setItem(row, col, item)
+        
+        self.total_label.setText(f"Всего токенов: {total_tokens}, стоимость: ${total_cost:.4f}")
+    
+    def format_seconds(self, ms):
+        """Переводит миллисекунды в строку с секундами"""
+        return f"{ms / 1000:.2f}" if ms is not None else ""
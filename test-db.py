@@ -12,16 +12,20 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
 from typing import List, Dict, Optional
+from db import decode_response
 
 
 class EditRecordDialog(QDialog):
     """Диалог для редактирования записи"""
-    def __init__(self, table_name: str, columns: List[str], record_data: Optional[Dict] = None, parent=None):
+    def __init__(self, table_name: str, columns: List[str], record_data: Optional[Dict] = None, parent=None,
+                 read_only: Optional[List[str]] = None):
         super().__init__(parent)
         self.table_name = table_name
         self.columns = columns
         self.record_data = record_data
         self.is_new = record_data is None
+        # Колонки, которые показываются, но не записываются обратно
+        self.read_only = set(read_only or [])
         
         self.setWindowTitle(f"{'Добавить' if self.is_new else 'Редактировать'} запись в {table_name}")
         self.setMinimumSize(500, 400)
@@ -47,6 +51,8 @@ class EditRecordDialog(QDialog):
                 field = QLineEdit()
                 field.setText(value)
             
+            if col in self.read_only:
+                field.setReadOnly(True)
             self.fields[col] = field
             form_layout.addRow(f"{col}:", field)
         
@@ -63,6 +69,8 @@ class EditRecordDialog(QDialog):
         """Возвращает данные из формы"""
         data = {}
         for col, field in self.fields.items():
+            if col in self.read_only:
+                continue
             if isinstance(field, QTextEdit):
                 data[col] = field.toPlainText()
             else:
@@ -159,6 +167,8 @@ class TableViewDialog(QDialog):
         """Создает соединение с базой данных"""
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
+        # Распаковка сжатых ответов для представления results_text (см. db.py)
+        conn.create_function("response_text", 2, decode_response, deterministic=True)
         return conn
     
     def get_table_info(self):
@@ -285,7 +295,14 @@ class TableViewDialog(QDialog):
                 QMessageBox.warning(self, "Предупреждение", "Не удалось получить данные записи")
                 return
             
-            dialog = EditRecordDialog(self.table_name, columns, data, self)
+            read_only = []
+            if self.table_name == "results" and data.get("response_format", "text") not in ("", "text"):
+                # Сжатый ответ (BLOB) показывается как bytes: запись текста обратно
+                # повредила бы его, поэтому ответ и его формат не редактируются
+                read_only = ["response", "response_format"]
+                data["response"] = f"(сжатый ответ, формат {data['response_format']})"
+            
+            dialog = EditRecordDialog(self.table_name, columns, data, self, read_only=read_only)
             
             if dialog.exec_() == QDialog.Accepted:
                 new_data = dialog.get_data()